@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Bundle of the publications collected from PaN data provider:
+# - ESRF (European Synchrotron Radiation Facility, https://www.esrf.fr/)
+#
+# This script merges the publication entries saved one per file in the output folder in a single json array,
+# compressed in a zip file with the name of the merged json file, as expected by the deliverables:
+#  ../data/oscars_pan_finder_publications_<timestamp>.json.zip
+# The entries are read and compressed one at a time, so the memory used does not grow with the number of
+# entries. By default, the entries are listed from the manifest of the folder, only the ones marked as done;
+# with --scan-folder, the files are listed scanning the folder instead.
+# The zip file is written through a temporary file renamed once complete.
+#
+# Usage: oscars_pan_finder_bundle_esrf_publications
+#   -f, --folder = Folder with the publication entries. Default="../data/esrf/"
+#   -o, --output-file = Zip file created. Default="../data/oscars_pan_finder_publications_<timestamp>.json.zip"
+#   -p, --file-prefix = Prefix of the files of the entries bundled. Default="esrf_publication_"
+#   -s, --scan-folder = List the files scanning the folder instead of reading the manifest
+#
+# Version: 1.0
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import argparse
+import datetime
+import json
+import os
+import time
+import zipfile
+
+import oscars_pan_finder_manifest as manifest
+
+default_folder = "../data/esrf/"
+default_file_prefix = "esrf_publication_"
+default_output_file_prefix = "../data/oscars_pan_finder_publications_"
+
+
+def get_default_output_file():
+    return default_output_file_prefix + datetime.datetime.now().strftime("%Y%m%d%H%M%S%f") + ".json.zip"
+
+
+def list_folder_files(folder, file_prefix):
+    """
+    Return the name and path of the json files of the folder starting with file_prefix, ordered by name.
+    """
+    with os.scandir(folder) as folder_entries:
+        file_names = sorted(
+            folder_entry.name
+            for folder_entry
+            in folder_entries
+            if folder_entry.is_file()
+            and folder_entry.name.startswith(file_prefix)
+            and folder_entry.name.endswith(".json")
+        )
+    return [(file_name, os.path.join(folder, file_name)) for file_name in file_names]
+
+
+def bundle_files(files, output_file):
+    """
+    Write the entries saved in files, pairs of name and path, as a compact json array in the zip file output_file.
+
+    It returns the statistics of the bundle.
+    """
+    # the member has the name of the merged json file, without the folder
+    member_name = os.path.basename(output_file)
+    if member_name.endswith(".zip"):
+        member_name = member_name[:-len(".zip")]
+    temp_file = f"{output_file}.{os.getpid()}.tmp"
+    stats = {"entries": 0, "bytes_read": 0, "bytes_written": 0, "missing": 0, "invalid": 0}
+    start_time = time.monotonic()
+
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with zipfile.ZipFile(temp_file, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        member = zipfile.ZipInfo(member_name, date_time=time.localtime()[:6])
+        member.compress_type = zipfile.ZIP_DEFLATED
+        with zip_file.open(member, "w", force_zip64=True) as fh:
+            fh.write(b"[")
+            for file_name, file_path in files:
+                try:
+                    with open(file_path, "rb") as entry_fh:
+                        data = entry_fh.read()
+                except FileNotFoundError:
+                    print(f" - Entry file {file_name} not found, skipped")
+                    stats["missing"] += 1
+                    continue
+                try:
+                    entry = json.loads(data)
+                except ValueError:
+                    print(f" - Entry file {file_name} is not valid json, skipped")
+                    stats["invalid"] += 1
+                    continue
+                if stats["entries"]:
+                    fh.write(b",")
+                # same compact output as jq -c -s
+                record = json.dumps(entry, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+                fh.write(record)
+                stats["entries"] += 1
+                stats["bytes_read"] += len(data)
+                stats["bytes_written"] += len(record)
+                if stats["entries"] % 1000 == 0:
+                    print(f" - {stats['entries']} entries bundled")
+            fh.write(b"]\n")
+    os.replace(temp_file, output_file)
+
+    stats["elapsed_seconds"] = time.monotonic() - start_time
+    stats["compressed_bytes"] = os.path.getsize(output_file)
+    return stats
+
+
+def print_stats(stats):
+    elapsed_seconds = max(stats["elapsed_seconds"], 1e-6)
+    print("Bundle summary")
+    print(f" - Entries bundled          : {stats['entries']}")
+    print(f" - Entry files missing      : {stats['missing']}")
+    print(f" - Entry files invalid      : {stats['invalid']}")
+    print(f" - Bytes read               : {stats['bytes_read']}")
+    print(f" - Json bytes written       : {stats['bytes_written']}")
+    print(f" - Compressed bytes         : {stats['compressed_bytes']}")
+    print(f" - Elapsed time (s)         : {stats['elapsed_seconds']:.1f}")
+    print(f" - Entries per second       : {stats['entries'] / elapsed_seconds:.1f}")
+    print(f" - MB read per second       : {stats['bytes_read'] / elapsed_seconds / 1e6:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-f","--folder",
+        help="Folder with the publication entries",
+        dest="folder",
+        default=default_folder,
+        type=str
+    )
+    parser.add_argument(
+        "-o","--output-file",
+        help="Zip file created. Default=../data/oscars_pan_finder_publications_<timestamp>.json.zip",
+        dest="output_file",
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        "-p","--file-prefix",
+        help="Prefix of the files of the entries bundled",
+        dest="file_prefix",
+        default=default_file_prefix,
+        type=str
+    )
+    parser.add_argument(
+        "-s","--scan-folder",
+        help="List the files scanning the folder instead of reading the manifest",
+        dest="scan_folder",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    folder = os.path.abspath(args.folder)
+    output_file = os.path.abspath(args.output_file or get_default_output_file())
+
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_bundle_esrf_publications - BEGIN")
+    print(datetime.datetime.now().isoformat())
+    print(f" - Folder                   : {folder}")
+    print(f" - File Prefix              : {args.file_prefix}")
+    print(f" - Output File              : {output_file}")
+    print(f" - Scan Folder              : {args.scan_folder}")
+
+    if args.scan_folder:
+        files = list_folder_files(folder, args.file_prefix)
+    else:
+        files = manifest.get_manifest(folder).iterate_files(args.file_prefix)
+    stats = bundle_files(files, output_file)
+    print_stats(stats)
+
+    print(datetime.datetime.now().isoformat())
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_bundle_esrf_publications - END")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,9 +13,9 @@
 # This script use a previously collected list of PaNOSC entries to collect each individual entries from the ESRF data api
 # We load the json file with all the ESRF PaNOSC entries and then loop through it to run the collection script
 #  ../data/esrf/oscars_pan_finder_esrf_panosc_documents.json
+# The file can be a json array or a JSONL file, with the .jsonl extension. It is read one entry at a time.
 #
-# 
-# Version: 1.0
+# Version: 1.2
 #
 #
 #
@@ -39,6 +39,8 @@ import os
 import datetime
 import argparse
 
+import oscars_pan_finder_jsonl as jsonl
+import oscars_pan_finder_panosc_index as panosc_index
 import oscars_pan_finder_settings_esrf as settings
 
 
@@ -58,8 +60,24 @@ def main():
         default="../data/esrf/",
         type=str
     )
+    parser.add_argument(
+        "-k","--session-cache-file",
+        help="File where the session with the portal is saved to be reused by each entry collection.",
+        dest="session_cache_file",
+        default="../data/esrf/esrf_session.json",
+        type=str
+    )
+    parser.add_argument(
+        "-C","--http-cache-file",
+        help="SQLite file caching the HTTP responses, shared by each entry collection. An empty value disables the cache.",
+        dest="http_cache_file",
+        default=settings.http_cache_file,
+        type=str
+    )
     args = parser.parse_args()
     input_file = os.path.abspath(args.input_file)
+    session_cache_file = os.path.abspath(args.session_cache_file)
+    http_cache_file = os.path.abspath(args.http_cache_file) if args.http_cache_file else ""
     output_folder = os.path.abspath(args.output_folder)
 
     print("OSCARS PaN-Finder project - Task 1 - ESRF - oscars_pan_finder_collect_esrf_entries_from_panosc_list - BEGIN")
@@ -71,17 +89,17 @@ def main():
     print(f" - ESRF Data Portal API Url   : {settings.panosc_data_provider_url}")
     print(f" - Input File                 : {input_file}")
     print(f" - Output Folder              : {output_folder}")
+    print(f" - Session Cache File         : {session_cache_file}")
+    print(f" - HTTP Cache File            : {http_cache_file}")
 
 
-    print("Loading file with PaNOSC entries")
-    with open(input_file, "r") as f:
-        panosc_entries = json.load(f)
-    print("File with PaNOSC entries loaded")
-    print(f"Loaded {len(panosc_entries)} entries")
-
-
+    # the entries are read from the file one at a time, each collection script reads its entry
+    # from the DOI index of the file, see oscars_pan_finder_panosc_index.py
+    panosc_index.get_file_index(input_file)
     print("Collection loop started")
-    for entry in panosc_entries:
+    number_of_entries = 0
+    for entry in jsonl.iterate_records(input_file):
+        number_of_entries += 1
         print(f"Collecting {entry['doi']}")
         if isinstance(entry["doi"],str) and entry["doi"]:
             print("BEGIN ============")
@@ -90,8 +108,12 @@ def main():
                 os.path.abspath("./oscars_pan_finder_collect_esrf_entry.py"),
                 "-d",
                 entry["doi"],
-                "-p",
-                json.dumps(entry),
+                "-i",
+                input_file,
+                "-k",
+                session_cache_file,
+                "-C",
+                http_cache_file,
                 "-s",
                 "-u"]
             )
@@ -100,6 +122,7 @@ def main():
             print(f"No doi. Skipping entry {entry}")
 
     print("Collection loop completed")
+    print(f"Collected {number_of_entries} entries")
 
     print("----------------------------------------------------------")
     print(datetime.datetime.now().isoformat())
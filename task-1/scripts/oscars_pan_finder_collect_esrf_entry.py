@@ -23,8 +23,10 @@
 # - input_file: the file containing the information from the panosc portal. Optional.
 #
 # documents that already present in the folder are not downloaded
-# 
-# Version: 4.0
+# The PaNOSC entry of the doi is read from the DOI index of the input file, built once and saved next to it,
+# see oscars_pan_finder_panosc_index.py
+#
+# Version: 4.2
 #
 #
 # -------------------------------------------------
@@ -53,58 +55,10 @@ import re
 from IPython.display import display, JSON
 import sys
 import argparse
+import oscars_pan_finder_manifest as manifest
+import oscars_pan_finder_panosc_index as panosc_index
 import oscars_pan_finder_settings_esrf as settings
 
-def get_config(data_portal_config_esrf_file: None):
-    print("get_config - BEGIN")
-    config = {}
-
-    if data_portal_config_esrf_file is None:
-        print("Config file not defined")
-        data_portal_config_esrf_file = "../data/esrf/esrf_data_portal_config.json"
-    data_portal_config_esrf_file = os.path.abspath(data_portal_config_esrf_file)
-
-    print("Config file : ", data_portal_config_esrf_file)
-    if not os.path.exists(data_portal_config_esrf_file):
-        print("Get config from portal")
-        print(f"Config url  : {settings.data_portal_config_url}")
-        res = requests.get(settings.data_portal_config_url)
-        print(" -- configuration request result : ", res.status_code)
-        config = res.json()
-        print(" -- saving configuration to file")
-        with open(data_portal_config_esrf_file, "w") as f:
-            json.dump(config,f)
-    else:
-        print("Loaded config from file")
-        with open(data_portal_config_esrf_file) as f:
-            config = json.load(f)
-
-    print("get_config - END")
-    return config
-
-
-def get_session(user_info: dict):
-    print("get_session - BEGIN")
-    payload = settings.session_payload
-    payload["username"] = user_info["username"]
-    payload["password"] = user_info["password"]
-    payload["plugin"] = user_info["plugin"]
-
-    print("requesting session")
-    res = requests.post(
-        settings.session_url,
-        json=payload,
-    )
-    print(" -- session request result : ", res.status_code)
-
-    session_info = res.json()
-
-    print(" -- session info : ", session_info)
-
-    print("get_session - BEGIN")
-    return session_info["sessionId"]
-
-
 def retrieve_panosc_entry(doi, panosc_entry, panosc_input_file):
     print("get_panosc_entry - BEGIN")
     output_data = {}
@@ -115,11 +69,13 @@ def retrieve_panosc_entry(doi, panosc_entry, panosc_input_file):
     except:
         print("invalid panosc entry")
         try:
-            print("loading panosc input file")
-            with open(panosc_input_file) as f:
-                panosc_data = json.load(f)
-                output_data = [e for e in panosc_data if e["doi"] == doi][0]
-            print("found panosc entry in file")
+            print("looking up panosc entry in the index of the input file")
+            panosc_data = panosc_index.get_panosc_entry(panosc_input_file, doi)
+            if panosc_data is None:
+                print("panosc entry not found in input file")
+            else:
+                output_data = panosc_data
+                print("found panosc entry in file")
         except:
             print("impossible toi retrieve panosc entry from input file")
 
@@ -133,7 +89,7 @@ def retrieve_datacite_info(doi):
         try:
             datacite_url = re.sub("<DOI>",doi,settings.datacite_base_url)
             print(" -- datacite url : " + datacite_url)
-            res = requests.get(datacite_url)
+            res = settings.get_http_client().get(datacite_url)
             print(" -- request result : ", res.status_code)
             output_data = res.json()
         except:
@@ -147,44 +103,12 @@ def retrieve_datacite_info(doi):
     return output_data
 
 
-def remove_fields(initem,fields):
-    outitem = dict(initem)
-    for field in fields:
-        if field in outitem.keys():
-            del outitem[field]
-    return outitem
-
-
-def extract_fields(initem,fields):
-    delete_fields = set(initem.keys()).difference(set(fields))
-    return remove_fields(initem,delete_fields)
-
-
-def fix_dataset_parameter(initem):
-    outitem = dict(initem)
-    del outitem["id"]
-    del outitem["datasetId"]
-    return outitem
-
-
 def fix_dataset(initem):
-    outitem = dict(initem)
-    outitem = remove_fields(outitem,["investigation","meta"])
-    outitem["parameters"] = [fix_dataset_parameter(parameter) for parameter in outitem["parameters"]]
-    return outitem
-
-
-def fix_sample_parameter(initem):
-    outitem = dict(initem)
-    del outitem["id"]
-    return outitem
+    return settings.projectors["dataset"](initem)
 
 
 def fix_sample(initem):
-    outitem = dict(initem)
-    outitem = remove_fields(outitem,["investigation","meta","datasets"])
-    outitem["parameters"] = [fix_sample_parameter(parameter) for parameter in outitem["parameters"]]
-    return outitem
+    return settings.projectors["sample"](initem)
 
 
 def extract_pid(doi, panosc_entry):
@@ -223,13 +147,13 @@ def retrieve_investigation(catalogue_url,pid):
                 "ids" : pid
             }
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 url = session_investigation_url,
                 params = params
             )
             print(" -- request result : ", res.status_code)
 
-            investigation_data = remove_fields(res.json()[0],["meta","type"])
+            investigation_data = settings.projectors["investigation"](res.json()[0])
         except:
             print(" -- error retrieving resource")
             investigation_data = "Error retrieving resource"
@@ -269,7 +193,7 @@ def retrieve_datasets(catalogue_url, pid):
                 "nested" : True
             }
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 url = session_datasets_url,
                 params = params
             )
@@ -304,7 +228,7 @@ def retrieve_reports(doi):
     try:
         reports_url = re.sub("<DOI>", doi, settings.reports_base_url)
         print(" -- reports url : " + reports_url)
-        res = requests.get(reports_url)
+        res = settings.get_http_client().get(reports_url)
         print(" -- request result status: ", res.status_code)
         reports_data = res.json()
 
@@ -354,7 +278,7 @@ def retrieve_samples(catalogue_url,pid):
                 "sortOrder" : 1,
             }
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 url = session_samples_url,
                     params = params
             )
@@ -392,7 +316,7 @@ def retrieve_users(catalogue_url,pid):
             session_users_url =  "/".join([catalogue_url, "investigation", "id", pid, "investigationusers"])
             print(" -- session users url : " + session_users_url)
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 url = session_users_url,
             )
             print(" -- request result status : ", res.status_code)
@@ -417,7 +341,7 @@ def fix_users(users):
 
     return [
         {
-            **extract_fields(v,["fullName","email","familyName","givenName","affiliation"]),
+            **settings.projectors["user"](v),
             **{
                 "orcid": v["orcidId"],
                 "roles": list(v["roles"]),
@@ -512,19 +436,35 @@ def main():
     )
 
 
+    parser.add_argument(
+        "-k","--session-cache-file",
+        help="File where the session with the portal is saved to be reused by other processes.",
+        dest="session_cache_file",
+        default="",
+        type=str
+    )
+    parser.add_argument(
+        "-C","--http-cache-file",
+        help="SQLite file caching the HTTP responses. An empty value disables the cache.",
+        dest="http_cache_file",
+        default=settings.http_cache_file,
+        type=str
+    )
     args = parser.parse_args()
+    settings.http_cache_file = os.path.abspath(args.http_cache_file) if args.http_cache_file else None
     # transfer input to internal variables
     doi=args.doi
     panosc_entry = args.panosc_entry
     panosc_input_file = os.path.abspath(args.panosc_input_file) if args.panosc_input_file else ""
     conf_file = os.path.abspath(args.conf_file)
+    settings.session_cache_file = os.path.abspath(args.session_cache_file) if args.session_cache_file else None
     include_samples = args.include_samples
     include_datafiles = args.include_datafiles
     include_users = args.include_users
     output_folder = os.path.abspath(args.output_folder)
 
     print("OSCARS PaN-Finder project - Task 1 - ESRF - oscars_pan_finder_collect_esrf_entry - BEGIN")
-    print("Version 4.0")
+    print("Version 4.2")
     print(datetime.datetime.now().isoformat())
     print("----------------------------------------------------------")
     print("Input arguments:")
@@ -540,15 +480,16 @@ def main():
 
     safe_doi = re.sub("[ /.-]", "_", doi)
 
-    document_file = [f for f in os.listdir(output_folder) if safe_doi in f]
-    if document_file:
-        print(" - document already retrieved {}".format(document_file[0]))
+    document_file_name = "esrf_document_" + safe_doi + ".json"
+    entries_manifest = manifest.get_manifest(output_folder)
+    if entries_manifest.is_done(document_file_name):
+        print(" - document already retrieved {}".format(document_file_name))
     else:
-        document_file =  output_folder + "/esrf_document_" + safe_doi + ".json"
+        document_file =  output_folder + "/" + document_file_name
         print(" - saving data in file: " + document_file)
 
-        config = get_config(conf_file)
-        sessionId = get_session(user_info = config["authentication"]["anonymous"])
+        config = settings.get_config(conf_file)
+        sessionId = settings.get_session(user_info = config["authentication"]["anonymous"])
         catalogue_url = re.sub("<SESSION_TOKEN>",sessionId,settings.catalogue_base_url)
 
         panosc_entry = retrieve_panosc_entry(doi, panosc_entry, panosc_input_file)
@@ -592,8 +533,9 @@ def main():
             users_entries,
         )
 
-        with open(document_file, 'w') as fh:
-            json.dump(entry, fh)
+        if not entries_manifest.save_entry(document_file_name, doi, entry):
+            print(" - document unchanged {}".format(document_file))
+    settings.print_http_stats()
     print("----------------------------------------------------------")
     print(datetime.datetime.now().isoformat())
     print("OSCARS PaN-Finder project - Task 1 - ESRF - oscars_pan_finder_collect_esrf_entry - END")
@@ -13,9 +13,11 @@
 # This script run the data collection script in the correct python environment.
 # This script to leverage the ESRF PaNOSC search api to collect all the public available data and save them in a file named
 #  ../data/esrf/oscars_pan_finder_esrf_panosc_documents.json
+# The file is written through a temporary file renamed once complete. If its name ends with .jsonl,
+# the documents are saved one per line instead of as a json array.
+# With -e, each entry collection reads its PaNOSC document from the DOI index of the file.
 #
-# 
-# Version: 1.0
+# Version: 1.1
 #
 #
 #
@@ -47,6 +49,25 @@ from IPython.display import display, JSON
 import argparse
 
 import oscars_pan_finder_settings_esrf as settings
+import oscars_pan_finder_jsonl as jsonl
+import oscars_pan_finder_paginator as paginator
+
+
+def retrieve_panosc_documents_window(skip, limit):
+    """
+    Retrieve one page of the PaNOSC documents.
+    """
+    params = {
+        "filter" : json.dumps({
+            "skip" : skip,
+            "limit" : limit
+        })
+    }
+    res = settings.get_http_client().get(
+        settings.panosc_documents_url,
+        params = params
+    )
+    return res.json()
 
 
 def main():
@@ -64,7 +85,15 @@ def main():
         dest="include_entries",
         action="store_true",
     )
+    parser.add_argument(
+        "-C","--http-cache-file",
+        help="SQLite file caching the HTTP responses. An empty value disables the cache.",
+        dest="http_cache_file",
+        default=settings.http_cache_file,
+        type=str
+    )
     args = parser.parse_args()
+    settings.http_cache_file = os.path.abspath(args.http_cache_file) if args.http_cache_file else None
     output_file = os.path.abspath(args.output_file)
     include_entries = args.include_entries
 
@@ -81,32 +110,21 @@ def main():
 
 
     # Retrieve the number of PaNOSC documents
-    res = requests.get(settings.panosc_documents_count_url)
+    res = settings.get_http_client().get(settings.panosc_documents_count_url)
     assert(res.status_code == 200)
     number_of_panosc_documents = res.json()["count"]
     print("Number of public documents available : " + str(number_of_panosc_documents))
 
     # Retrieve all the PaNOSC documents
     print("Starting panosc document collection...")
-    panosc_documents = []
-    keep_going = True
-    skip = settings.initial_skip
-    while keep_going:
-        params = {
-            "filter" : json.dumps({
-                "skip" : skip,
-                "limit" : settings.batch_limit
-            })
-        }
-        res = requests.get(
-            settings.panosc_documents_url,
-            params = params
-        )
-        current_batch = res.json()
-        keep_going = len(current_batch) == settings.batch_limit
-        panosc_documents += current_batch
-        print(".",end="")
-        skip += len(current_batch)
+    panosc_documents = paginator.collect_all(
+        retrieve_panosc_documents_window,
+        number_of_panosc_documents,
+        settings.batch_limit,
+        workers=settings.pagination_workers,
+        initial_skip=settings.initial_skip,
+        key=lambda d: d.get("pid")
+    )
 
     print("")
     print("Panosc documents collected")
@@ -117,8 +135,7 @@ def main():
         print("Number of PaNOSC documents collected does not match with the count provided")
 
     print("Saving saving PaNOSC documents in file: " + output_file)
-    with open(output_file,'w') as fh:
-        json.dump(panosc_documents,fh)
+    jsonl.save_records(output_file, panosc_documents)
 
     if include_entries:
         for entry in panosc_documents:
@@ -130,11 +147,14 @@ def main():
                     os.path.abspath("./oscars_pan_finder_collect_esrf_entry.py"),
                     "-d",
                     entry["doi"],
+                    "-i",
+                    output_file,
                     "-s",
                     "-u"]
                 )
                 print("END ==============")
 
+    settings.print_http_stats()
     print("----------------------------------------------------------")
     print(datetime.datetime.now().isoformat())
     print("OSCARS PaN-Finder project - Task 1 - ESRF - oscars_pan_finder_collect_esrf_panosc_documents - END")
@@ -19,15 +19,19 @@
 #
 # Usage: oscars_pan_finder_collect_esrf_publications
 #   -d, --doi : Doi of the document to be retrieved from ESRF data portal
+#   -p, --publication-entry = Publication entry for this doi. Full entry as json string
+#   -i, --publication-input-file = File with the list of publications, the entry of this doi is read from its DOI index
 #   -c, --portal-conf-file = Path to the file containing the configuration for the portal. It will be created if it does not exists. Default="../data/esrf/esrf_data_portal_config.json"
 #   -s, --include-samples = Include samples information in entry
 #   -f, --include-datafiles = Include datafiles information in entry
 #   -u, --include-users = Include users information in entry
 #   -o, --output-folder = Path to the folder where we will save the output file. Default=../data/esrf/
+#   -k, --session-cache-file = File where the session with the portal is saved to be reused by other processes. Optional.
+#   -C, --http-cache-file = SQLite file caching the HTTP responses, empty to disable. Default="../data/esrf/esrf_http_cache.sqlite"
 #
 # documents that already present in the data folder are not downloaded
 # 
-# Version: 1.0
+# Version: 1.2
 #
 #
 # -------------------------------------------------
@@ -56,8 +60,35 @@ import re
 from IPython.display import display, JSON
 import sys
 import argparse
+import concurrent.futures
+import threading
+import oscars_pan_finder_manifest as manifest
+import oscars_pan_finder_paginator as paginator
+import oscars_pan_finder_panosc_index as panosc_index
 import oscars_pan_finder_settings_esrf as settings
 
+# pool of threads used to send the enrichment calls of a publication concurrently
+enrichment_executor = None
+enrichment_executor_lock = threading.Lock()
+
+# pool of threads sending the datafile requests and page size accepted by the server
+datafile_executor = None
+datafile_executor_lock = threading.Lock()
+datafile_page_size = None
+datafile_page_size_lock = threading.Lock()
+
+# the retrieve functions return a message starting with this prefix when a resource can not be retrieved
+retrieval_error_prefix = "Error retrieving"
+
+# exit code of the script when some resources of the publication could not be retrieved
+retrieval_error_exit_code = 3
+
+
+class RetrievalError(Exception):
+    """
+    Some resources of a publication could not be retrieved, the publication is not saved.
+    """
+
 # def get_config(data_portal_config_esrf_file: None):
 #     print("get_config - BEGIN")
 #     config = {}
@@ -160,31 +191,12 @@ import oscars_pan_finder_settings_esrf as settings
 #     return remove_fields(initem,delete_fields)
 
 
-def fix_dataset_parameter(initem):
-    outitem = dict(initem)
-    del outitem["id"]
-    del outitem["datasetId"]
-    return outitem
-
-
 def fix_dataset(initem):
-    outitem = dict(initem)
-    outitem = settings.remove_fields(outitem,["investigation","meta"])
-    outitem["parameters"] = [fix_dataset_parameter(parameter) for parameter in outitem["parameters"]]
-    return outitem
-
-
-def fix_sample_parameter(initem):
-    outitem = dict(initem)
-    del outitem["id"]
-    return outitem
+    return settings.projectors["dataset"](initem)
 
 
 def fix_sample(initem):
-    outitem = dict(initem)
-    outitem = settings.remove_fields(outitem,["investigation","meta","datasets"])
-    outitem["parameters"] = [fix_sample_parameter(parameter) for parameter in outitem["parameters"]]
-    return outitem
+    return settings.projectors["sample"](initem)
 
 
 def extract_pid(doi, panosc_entry):
@@ -230,14 +242,14 @@ def retrieve_doi_dataset(doi_url):
             doi_datasets_url = urllib.parse.urljoin(doi_url, "datasets")
             print(" -- doi datasets Url : " + doi_datasets_url)
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 url = doi_datasets_url,
                 headers={"Accept": "application/json"},
             )
             print(" -- request result : ", res.status_code)
 
             doi_datasets_data = [
-                settings.remove_fields(ds,["meta","type"])
+                settings.projectors["doi_dataset"](ds)
                 for ds
                 in res.json()
             ]
@@ -270,7 +282,7 @@ def retrieve_doi_datacite(doi_url):
             doi_datacite_url = urllib.parse.urljoin(doi_url, "json-datacite")
             print(" -- doi datacite Url : " + doi_datacite_url)
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 url = doi_datacite_url,
                 #headers={"Accept": "application/json"},
             )
@@ -306,7 +318,7 @@ def retrieve_datacite_entry(datacite_url):
         try:
             print(" -- doi datacite Url : " + datacite_url)
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 url=datacite_url,
                 headers={"Accept": "application/json"},
             )
@@ -345,13 +357,13 @@ def retrieve_investigation(catalogue_url,investigation_id):
                 "ids" : investigation_id
             }
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 url = session_investigation_url,
                 params = params
             )
             print(" -- request result : ", res.status_code)
 
-            investigation_data = settings.remove_fields(res.json()[0],["meta","type"])
+            investigation_data = settings.projectors["investigation"](res.json()[0])
         except:
             print(" -- error retrieving resource")
             investigation_data = "Error retrieving resource"
@@ -391,7 +403,7 @@ def retrieve_datasets(catalogue_url, investigation_id):
                 "nested" : True
             }
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 url = session_datasets_url,
                 params = params
             )
@@ -431,7 +443,7 @@ def retrieve_reports(doi_url):
             doi_reports_url = urllib.parse.urljoin(doi_url, "reports")
             print(" -- doi datacite Url : " + doi_reports_url)
 
-            res = requests.get(doi_reports_url)
+            res = settings.get_http_client().get(doi_reports_url)
             print(" -- request result status: ", res.status_code)
             reports_data = res.json()
 
@@ -480,7 +492,7 @@ def retrieve_samples(catalogue_url,pid):
                 "sortOrder" : 1,
             }
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 url = session_samples_url,
                     params = params
             )
@@ -518,7 +530,7 @@ def retrieve_users(catalogue_url,investigation_id):
             session_users_url =  '/'.join([catalogue_url, "investigation", "id",str(investigation_id), "investigationusers"])
             print(" -- session users url : " + session_users_url)
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 url = session_users_url,
             )
             print(" -- request result status : ", res.status_code)
@@ -543,7 +555,7 @@ def fix_users(users):
 
     return [
         {
-            **settings.extract_fields(v,["fullName","email","familyName","givenName","affiliation"]),
+            **settings.projectors["user"](v),
             **{
                 "orcid": v["orcidId"],
                 "roles": list(v["roles"]),
@@ -554,20 +566,203 @@ def fix_users(users):
     ]
 
 def retrieve_datafiles(catalogue_url, in_datasets):
+    """
+    Retrieve the datafiles of all the datasets of a publication and add them to each dataset.
+
+    The pages of all the datasets are requested concurrently on the datafile pool, which caps the
+    number of datafile requests in flight in the whole process.
+    The next page of a dataset is requested before the current one is processed.
+    """
+    print(" - retrieve_datafiles - BEGIN ")
+    datafiles_entries = retrieve_datafiles_for_datasets(
+        catalogue_url,
+        [ds["id"] for ds in in_datasets]
+    )
     out_datasets = [
         {
             **ds,
-            "datafiles" : retrieve_datafiles_for_dataset(
-                catalogue_url,
-                ds["id"]
-            )
+            "datafiles" : datafiles_entries[ds["id"]]
         }
         for ds
         in in_datasets
     ]
+    print(" - retrieve_datafiles - END")
     return out_datasets
 
 
+def get_datafile_executor():
+    """
+    Return the pool of threads sending the datafile requests of this process.
+    """
+    global datafile_executor
+    if datafile_executor is None:
+        with datafile_executor_lock:
+            if datafile_executor is None:
+                datafile_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=settings.datafile_workers,
+                    thread_name_prefix="datafiles"
+                )
+    return datafile_executor
+
+
+def retrieve_datafiles_page(datafiles_url, dataset_id, skip, limit):
+    params = {
+        "datasetId": dataset_id,
+        "skip": skip,
+        "limit": limit
+    }
+    res = settings.get_http_client().get(
+        datafiles_url,
+        params=params
+    )
+    return res.json()
+
+
+def probe_datafile_page_size(datafiles_url, dataset_id):
+    """
+    Return the largest page size, among settings.datafile_page_sizes, accepted by the server for a dataset.
+
+    A page size is accepted only if the server returns a full page of exactly that size. A page size is rejected
+    if the page is shorter than the total reported by the server, which then caps the page size.
+    It returns None when the dataset has fewer datafiles than a page size, the size can not be confirmed,
+    and settings.batch_limit when no size is accepted.
+    """
+    for candidate in settings.datafile_page_sizes:
+        try:
+            page = retrieve_datafiles_page(datafiles_url, dataset_id, settings.initial_skip, candidate)
+        except Exception:
+            continue
+        if not isinstance(page, list):
+            continue
+        if len(page) == candidate:
+            return candidate
+        total = paginator.get_page_total(page)
+        if total is not None and len(page) < total - settings.initial_skip:
+            # the server caps the page size below candidate
+            continue
+        # the dataset is too small to tell
+        return None
+    return settings.batch_limit
+
+
+def get_datafile_page_size(datafiles_url, dataset_id):
+    """
+    Return the page size of the datafile requests and whether the server is known to return full pages of it.
+
+    The page size is probed once per process, outside of the lock so that a slow probe does not hold the
+    other publications. When the size can not be confirmed with this dataset, settings.batch_limit is used
+    for this publication and the size is probed again with the next one.
+    """
+    global datafile_page_size
+    if datafile_page_size is not None:
+        return datafile_page_size, True
+    page_size = probe_datafile_page_size(datafiles_url, dataset_id)
+    if page_size is None:
+        return settings.batch_limit, False
+    with datafile_page_size_lock:
+        if datafile_page_size is None:
+            datafile_page_size = page_size
+            print(f" -- datafiles page size : {datafile_page_size}")
+    return datafile_page_size, True
+
+
+def retrieve_datafiles_for_datasets(catalogue_url, dataset_ids):
+    """
+    Retrieve all the datafiles associated with a list of datasets
+
+    It does GET requests to ESRF catalogue for each dataset as follow:
+    ```
+    https://icatplus.esrf.fr/catalogue/cc06fd64-2b10-4f77-a194-bda0552580fd/datafile?datasetId=514590601&skip=0&limit=1000
+    ```
+    The pages of a dataset are requested up to the total reported in the meta section of its first page,
+    each page starting after the rows actually returned by the previous ones, in case the server caps the page size.
+    Without total, the pages are requested one after the other until a page shorter than the page size,
+    when the server is known to return full pages of that size, or otherwise until an empty page.
+    It returns a dictionary with the cleaned Datafile records, or an error message, for each dataset id.
+    It raises RetrievalError if fewer datafiles than the total reported by the server were retrieved.
+    """
+    datafiles_entries = {}
+    if not catalogue_url:
+        print(" - no catalogue url token")
+        return {dataset_id: "Catalogue Url with Session not provided" for dataset_id in dataset_ids}
+
+    datafiles_url = urllib.parse.urljoin(catalogue_url, "datafile")
+    print(" -- datafiles url : " + datafiles_url)
+
+    pending = {}
+    totals = {}
+    executor = get_datafile_executor()
+
+    def request_page(dataset_id, skip, limit):
+        future = executor.submit(retrieve_datafiles_page, datafiles_url, dataset_id, skip, limit)
+        pending[future] = (dataset_id, skip, limit)
+
+    page_size = None
+    page_size_confirmed = False
+    pages = {}
+    for dataset_id in dataset_ids:
+        if not dataset_id:
+            print(" - no dataset id")
+            datafiles_entries[dataset_id] = "Dataset id not provided"
+            continue
+        if page_size is None:
+            page_size, page_size_confirmed = get_datafile_page_size(datafiles_url, dataset_id)
+        pages[dataset_id] = {}
+        request_page(dataset_id, settings.initial_skip, page_size)
+
+    while pending:
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            dataset_id, skip, limit = pending.pop(future)
+            if dataset_id in datafiles_entries:
+                # the dataset already failed
+                continue
+            try:
+                current_batch = future.result()
+                if not isinstance(current_batch, list):
+                    raise ValueError(f"unexpected datafiles page {current_batch}")
+                # prefetch the next pages before processing the current one:
+                # all of them when the first page reports the total, otherwise the next one
+                if skip == settings.initial_skip:
+                    totals[dataset_id] = paginator.get_page_total(current_batch)
+                    if totals[dataset_id] is not None and current_batch:
+                        # the pages have the size of the first page, which the server may have capped below limit
+                        step = len(current_batch)
+                        for next_skip in range(skip + step, totals[dataset_id], step):
+                            request_page(dataset_id, next_skip, step)
+                is_last_page = not current_batch or (page_size_confirmed and len(current_batch) < limit)
+                if totals[dataset_id] is None and not is_last_page:
+                    request_page(dataset_id, skip + len(current_batch), limit)
+                pages[dataset_id][skip] = [
+                    settings.projectors["datafile"](e['Datafile'])
+                    for e
+                    in current_batch
+                ]
+                print(".", end="")
+            except Exception:
+                print(" -- error retrieving data files")
+                datafiles_entries[dataset_id] = "Error retrieving data files"
+
+    for dataset_id, dataset_pages in pages.items():
+        if dataset_id in datafiles_entries:
+            continue
+        datafiles = [
+            datafile
+            for skip
+            in sorted(dataset_pages)
+            for datafile
+            in dataset_pages[skip]
+        ]
+        total = totals.get(dataset_id)
+        if total is not None and len(datafiles) < total - settings.initial_skip:
+            raise RetrievalError(
+                f"datafiles of dataset {dataset_id}: {len(datafiles)} retrieved of {total - settings.initial_skip}"
+            )
+        datafiles_entries[dataset_id] = datafiles
+
+    return datafiles_entries
+
+
 def retrieve_datafiles_for_dataset(catalogue_url,dataset_id):
     """
     Retrieve all the datafiles associated with this document and its datasets
@@ -592,58 +787,12 @@ def retrieve_datafiles_for_dataset(catalogue_url,dataset_id):
     ```
     """
     print(" - retrieve_datafiles - BEGIN ")
-
-    datafiles_entries = ""
-    if not catalogue_url:
-        print(" - no catalogue url token")
-        datafiles_entries = "Catalogue Url with Session not provided"
-    elif not dataset_id:
-        print(" - no dtaaset id")
-        datafiles_entries = "Dataset id not provided"
-    else:
-        try:
-            datafiles_url =  urllib.parse.urljoin(catalogue_url, "datafile")
-            print(" -- datafiles url : " + datafiles_url)
-
-            datafiles_entries = []
-            keep_going = True
-            skip = settings.initial_skip
-            while keep_going:
-                params = {
-                    "datasetId": dataset_id,
-                    "skip": skip,
-                    "limit": settings.batch_limit
-                }
-                res = requests.get(
-                    datafiles_url,
-                    params=params
-                )
-                current_batch = res.json()
-                keep_going = len(current_batch) == settings.batch_limit
-                datafiles_entries += current_batch
-                print(".", end="")
-                skip += len(current_batch)
-
-            datafiles_entries = [
-                settings.remove_fields(
-                    e['Datafile'],
-                    ["dataset", "dataCollectionDatafiles", "destDatafiles","sourceDatafiles"]
-                )
-                for e
-                in datafiles_entries
-            ]
-
-        except:
-            print(" -- error retrieving data files")
-            datafiles_entries = "Error retrieving data files"
-
+    datafiles_entries = retrieve_datafiles_for_datasets(catalogue_url, [dataset_id])[dataset_id]
     print(" - retrieve_datafiles - END")
     return datafiles_entries
 
 def fix_datafiles(datafiles_entries):
-    return settings.extract_fields(
-        datafiles_entries['Datafile'],
-        ["id","createTime","modTime","fileSize","location","name","isReleased"])
+    return settings.projectors["datafile_summary"](datafiles_entries['Datafile'])
 
 def retrieve_data_collection(catalogue_url, dataset_doi):
     # curl -X GET
@@ -670,7 +819,7 @@ def retrieve_data_collection(catalogue_url, dataset_doi):
                 "datasetID": dataset_doi
             }
 
-            res = requests.get(
+            res = settings.get_http_client().get(
                 data_collection_url,
                 params=params,
                 headers={"Accept": "application/json"}
@@ -678,10 +827,7 @@ def retrieve_data_collection(catalogue_url, dataset_doi):
 
             data_collection_entries = res.json()
             print(f" - retrieved {len(data_collection_entries)} data collection entries")
-            data_collection_entry = settings.extract_fields(
-                data_collection_entries[0],
-                ["createTime", "modTime", "dataCollectionDatasets", "doi", "parameters"]
-            )
+            data_collection_entry = settings.projectors["data_collection"](data_collection_entries[0])
 
         except:
             print(" -- error retrieving data collection")
@@ -745,10 +891,7 @@ def extract_instruments_from_investigations(investigation_entries):
         in inv["investigationInstruments"]
     }
     instruments = [
-        settings.remove_fields(
-            i,
-            ["shifts","datasetInstruments","instrumentScientists","investigationInstruments"]
-        )
+        settings.projectors["instrument"](i)
         for i
         in instruments.values()
     ]
@@ -763,6 +906,313 @@ def extract_citations_from_datacite(datacite_entry):
     ]
     return list(set(citations))
 
+def get_enrichment_executor():
+    """
+    Return the pool of threads used to send the independent enrichment calls of a publication.
+
+    The pool is created once per process and shared by all the publications collected at the same time.
+    """
+    global enrichment_executor
+    if enrichment_executor is None:
+        with enrichment_executor_lock:
+            if enrichment_executor is None:
+                enrichment_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=settings.enrichment_workers,
+                    thread_name_prefix="enrichment"
+                )
+    return enrichment_executor
+
+
+def run_concurrently(calls):
+    """
+    Run independent retrieve functions at the same time.
+
+    calls maps a key to a (function, arguments) tuple.
+    It returns a dictionary with the result of each function under the same key.
+    """
+    executor = get_enrichment_executor()
+    futures = {
+        key: executor.submit(function, *args)
+        for key, (function, args)
+        in calls.items()
+    }
+    return {
+        key: future.result()
+        for key, future
+        in futures.items()
+    }
+
+
+def is_retrieval_error(value):
+    return isinstance(value, str) and value.startswith(retrieval_error_prefix)
+
+
+def get_retrieval_errors(results):
+    """
+    Return the names of the enrichment calls whose result is an error message.
+
+    The datafiles are checked for each dataset.
+    """
+    errors = []
+    for key, value in results.items():
+        name = " ".join(str(k) for k in key) if isinstance(key, tuple) else key
+        if is_retrieval_error(value):
+            errors.append(name)
+        elif key == "datafiles" and isinstance(value, list):
+            errors += [
+                f"datafiles {ds['id']}"
+                for ds
+                in value
+                if is_retrieval_error(ds.get("datafiles"))
+            ]
+    return errors
+
+
+def get_publication_file_name(doi):
+    safe_doi = re.sub("[ /.-]", "_", doi)
+    return "esrf_publication_" + safe_doi + ".json"
+
+
+def get_publication_file(doi, output_folder):
+    return output_folder + "/" + get_publication_file_name(doi)
+
+
+def is_publication_retrieved(doi, output_folder):
+    document_file = get_publication_file_name(doi)
+    retrieved = manifest.get_manifest(output_folder).is_done(document_file)
+    if retrieved:
+        print(" - document already retrieved {}".format(document_file))
+    return retrieved
+
+
+def forget_publication(doi, output_folder):
+    """
+    Mark the saved publication as stale, so that it is collected again.
+
+    The file and the content hash are kept, the file is only rewritten if the publication has changed.
+    """
+    manifest.get_manifest(output_folder).set_status(get_publication_file_name(doi), "stale")
+
+
+def get_publication_cache_patterns(doi, output_folder):
+    """
+    Return the regular expressions of the cache keys of the responses used to collect a publication.
+
+    The DOI and DataCite responses are found from the DOI, the catalogue responses from the dataset
+    and investigation ids of the saved publication.
+    """
+    patterns = [
+        "^GET " + re.escape(requests.utils.requote_uri(base_url.replace("<DOI>", doi))) + r"[/?]"
+        for base_url
+        in [settings.data_portal_doi_base_url.rstrip("/"), settings.datacite_base_url]
+    ]
+    publication_file = get_publication_file(doi, output_folder)
+    if not os.path.exists(publication_file):
+        return patterns
+    with open(publication_file) as f:
+        entry = json.load(f)
+    dataset_ids = [
+        re.escape(str(ds["id"]))
+        for ds
+        in (entry.get("datasets") if isinstance(entry.get("datasets"), list) else [])
+        if isinstance(ds, dict) and ds.get("id")
+    ]
+    investigation_ids = [
+        re.escape(str(i["id"]))
+        for i
+        in (entry.get("investigation") if isinstance(entry.get("investigation"), list) else [])
+        if isinstance(i, dict) and i.get("id")
+    ]
+    catalogue_query = r"/catalogue/<SESSION_TOKEN>/[^?]+\?(.*&)?"
+    if dataset_ids:
+        patterns.append(catalogue_query + f"(datasetId|datasetID)=({'|'.join(dataset_ids)})(&|$)")
+    if investigation_ids:
+        patterns.append(catalogue_query + f"(ids|investigationId|investigationIds)=({'|'.join(investigation_ids)})(&|$)")
+        patterns.append(f"/catalogue/<SESSION_TOKEN>/investigation/id/({'|'.join(investigation_ids)})/")
+    return patterns
+
+
+def invalidate_cached_publications(dois, output_folder):
+    """
+    Remove from the HTTP cache the responses used to collect the given publications.
+
+    Used for the publications modified since they were collected: their responses may still be fresh in the
+    cache, and collecting them again would return the previous content.
+    It returns the number of responses removed.
+    """
+    cache = settings.get_http_client().cache
+    if cache is None:
+        return 0
+    return cache.invalidate([
+        pattern
+        for doi
+        in dois
+        for pattern
+        in get_publication_cache_patterns(doi, output_folder)
+    ])
+
+
+def open_catalogue(conf_file):
+    """
+    Log in to the ESRF data portal and return the catalogue url with the session token.
+
+    The catalogue url can be shared by all the publications collected in the same run.
+    """
+    print("Retrieving session - BEGIN")
+    config = settings.get_config(conf_file)
+    session_id = settings.get_session(user_info = config["authentication"]["anonymous"])
+    print(f" - Session Id                     : {session_id}")
+    print("Retrieving session - END")
+
+    catalogue_url = re.sub("<SESSION_TOKEN>", session_id, settings.catalogue_base_url)
+    print(f" - Catalogue URL                  : {catalogue_url}")
+    return catalogue_url
+
+
+def collect_publication(
+        doi,
+        pub_entry,
+        catalogue_url,
+        output_folder,
+        include_samples=True,
+        include_datafiles=True,
+        include_users=True
+):
+    """
+    Collect all the information available for one publication and save them in its own file.
+
+    This is the per-DOI logic of the script, usable as a library by the harvester.
+    It returns "skipped" if the publication was already retrieved, "unchanged" if it was collected again
+    with the same content as the saved one, and "retrieved" otherwise.
+    It raises RetrievalError, without saving the publication, if any resource could not be retrieved.
+    """
+    print(f"collect_publication {doi} - BEGIN")
+
+    if is_publication_retrieved(doi, output_folder):
+        print(f"collect_publication {doi} - END")
+        return "skipped"
+
+    document_file = get_publication_file(doi, output_folder)
+    print(" - saving data in file: " + document_file)
+
+    print("Settings URL - BEGIN")
+    print(f" - Catalogue URL                  : {catalogue_url}")
+    doi_url = re.sub("<DOI>", doi, settings.data_portal_doi_base_url)
+    print(f" - DOI URL                        : {doi_url}")
+    datacite_url = re.sub("<DOI>", doi, settings.datacite_base_url)
+    print(f" - Datacite URL                   : {datacite_url}")
+    print("Settings URL - END")
+
+    # the enrichment calls that only depend on the DOI are sent at the same time
+    results = run_concurrently({
+        "doi_datacite": (retrieve_doi_datacite, (doi_url,)),
+        "datacite": (retrieve_datacite_entry, (datacite_url,)),
+        "doi_datasets": (retrieve_doi_dataset, (doi_url,)),
+        "reports": (retrieve_reports, (doi_url,)),
+    })
+    errors = get_retrieval_errors(results)
+    if errors:
+        raise RetrievalError(f"{doi} - could not retrieve: {', '.join(errors)}")
+    doi_datacite_entry = results["doi_datacite"]
+    datacite_entry = results["datacite"]
+    doi_datasets_entries = results["doi_datasets"]
+    reports_entries = results["reports"]
+
+    citation_entries = extract_citations_from_datacite(datacite_entry)
+    datacite_entry = settings.projectors["datacite"](datacite_entry)
+
+    # investigation_ids = list(set([
+    #     ds["investigation"]["id"]
+    #     for ds
+    #     in doi_datasets_entries
+    # ]))
+    # print(f" - Investigation IDs : {investigation_ids}")
+    # print(f" - Number of investigations : {len(investigation_ids)}")
+    # investigation_id = investigation_ids[0]
+    # print(f" - Selecting Investigation ID : {investigation_id}")
+
+    #investigation_entry = retrieve_investigation(catalogue_url, investigation_id)
+    investigation_entries = extract_investigations_from_datasets(doi_datasets_entries)
+    first_dataset_id = doi_datasets_entries[0]["id"] if doi_datasets_entries else None
+    doi_datasets_entries = [
+        settings.projectors["publication_dataset"](ds)
+        for ds in doi_datasets_entries
+    ]
+    investigation_ids = [
+        i['id']
+        for i
+        in investigation_entries
+    ]
+
+    #release_date = get_release_date(datacite_entry)
+    #is_public = is_investigation_public(release_date)
+
+    #datasets_entries = retrieve_datasets(catalogue_url, investigation_id)
+
+    # the enrichment calls that depend on the datasets are sent at the same time
+    calls = {}
+    if not pub_entry:
+        calls["collection"] = (retrieve_data_collection, (catalogue_url, first_dataset_id))
+    for investigation_id in investigation_ids:
+        if include_samples:
+            calls[("samples", investigation_id)] = (retrieve_samples, (catalogue_url, investigation_id))
+        if include_users:
+            calls[("users", investigation_id)] = (retrieve_users, (catalogue_url, investigation_id))
+    if include_datafiles:
+        calls["datafiles"] = (retrieve_datafiles, (catalogue_url, doi_datasets_entries))
+    results = run_concurrently(calls)
+    errors = get_retrieval_errors(results)
+    if errors:
+        raise RetrievalError(f"{doi} - could not retrieve: {', '.join(errors)}")
+
+    if not pub_entry:
+        pub_entry = results["collection"]
+
+    samples_entries = []
+    users_entries = []
+    for investigation_id in investigation_ids:
+        if include_samples:
+            entries = results[("samples", investigation_id)]
+            if isinstance(entries, list):
+                samples_entries += entries
+        if include_users:
+            entries = results[("users", investigation_id)]
+            if isinstance(entries, list):
+                users_entries += entries
+
+    samples_entries = "Not included" if not include_samples else samples_entries
+    users_entries = "Not included" if not include_users else users_entries
+
+    instruments_entries = extract_instruments_from_investigations(investigation_entries)
+    investigation_entries = [
+        settings.projectors["publication_investigation"](i)
+        for i in investigation_entries
+    ]
+
+    if include_datafiles:
+        doi_datasets_entries = results["datafiles"]
+
+    entry = prepare_entry(
+        pub_entry,
+        doi_datacite_entry,
+        datacite_entry,
+        reports_entries,
+        doi_datasets_entries,
+        samples_entries,
+        users_entries,
+        citation_entries,
+        instruments_entries,
+        investigation_entries
+    )
+
+    is_changed = manifest.get_manifest(output_folder).save_entry(get_publication_file_name(doi), doi, entry)
+    if not is_changed:
+        print(f" - document unchanged {document_file}")
+
+    print(f"collect_publication {doi} - END")
+    return "retrieved" if is_changed else "unchanged"
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -779,6 +1229,13 @@ def main():
         default="",
         type=str
     )
+    parser.add_argument(
+        "-i","--publication-input-file",
+        help="File with the list of publications, the entry of this doi is read from its DOI index. Used without -p.",
+        dest="publication_input_file",
+        default="",
+        type=str
+    )
     parser.add_argument(
         "-c","--portal-conf-file",
         help="Path to the file containing the configuration for the portal. It will be created if it does not exists.",
@@ -813,18 +1270,39 @@ def main():
     )
 
 
+    parser.add_argument(
+        "-k","--session-cache-file",
+        help="File where the session with the portal is saved to be reused by other processes.",
+        dest="session_cache_file",
+        default="",
+        type=str
+    )
+    parser.add_argument(
+        "-C","--http-cache-file",
+        help="SQLite file caching the HTTP responses. An empty value disables the cache.",
+        dest="http_cache_file",
+        default=settings.http_cache_file,
+        type=str
+    )
     args = parser.parse_args()
+    settings.http_cache_file = os.path.abspath(args.http_cache_file) if args.http_cache_file else None
     # transfer input to internal variables
     doi=args.doi
-    pub_entry = args.pub_entry
+    if args.pub_entry:
+        pub_entry = json.loads(args.pub_entry)
+    elif args.publication_input_file:
+        pub_entry = panosc_index.get_panosc_entry(os.path.abspath(args.publication_input_file), doi) or ""
+    else:
+        pub_entry = ""
     conf_file = os.path.abspath(args.conf_file)
+    settings.session_cache_file = os.path.abspath(args.session_cache_file) if args.session_cache_file else None
     include_samples = args.include_samples
     include_datafiles = args.include_datafiles
     include_users = args.include_users
     output_folder = os.path.abspath(args.output_folder)
 
     print("OSCARS PaN-Finder project - Task 1 - ESRF - oscars_pan_finder_collect_esrf_publication - BEGIN")
-    print("Version 1.0")
+    print("Version 1.2")
     print(datetime.datetime.now().isoformat())
     print("----------------------------------------------------------")
     print("Input arguments:")
@@ -837,115 +1315,25 @@ def main():
     print(f" - Output Folder     : {format(output_folder)}")
     print("")
 
-    safe_doi = re.sub("[ /.-]", "_", doi)
+    catalogue_url = None
+    if not is_publication_retrieved(doi, output_folder):
+        catalogue_url = open_catalogue(conf_file)
 
-    document_file = [f for f in os.listdir(output_folder) if safe_doi in f]
-    if document_file:
-        print(" - document already retrieved {}".format(document_file[0]))
-    else:
-        document_file =  output_folder + "/esrf_publication_" + safe_doi + ".json"
-        print(" - saving data in file: " + document_file)
-
-        print("Retrieving session - BEGIN")
-        config = settings.get_config(conf_file)
-        session_id = settings.get_session(user_info = config["authentication"]["anonymous"])
-        print(f" - Session Id                     : {session_id}")
-        print("Retrieving session - END")
-
-        print("Settings URL - BEGIN")
-        catalogue_url = re.sub("<SESSION_TOKEN>", session_id, settings.catalogue_base_url)
-        print(f" - Catalogue URL                  : {catalogue_url}")
-        doi_url = re.sub("<DOI>", doi, settings.data_portal_doi_base_url)
-        print(f" - DOI URL                        : {doi_url}")
-        datacite_url = re.sub("<DOI>", doi, settings.datacite_base_url)
-        print(f" - Datacite URL                   : {datacite_url}")
-        print("Settings URL - END")
-
-        doi_datacite_entry = retrieve_doi_datacite(doi_url)
-        datacite_entry = retrieve_datacite_entry(datacite_url)
-        citation_entries = extract_citations_from_datacite(datacite_entry)
-        datacite_entry = settings.remove_fields(
-            datacite_entry,
-            ["relationships"]
-        )
-        doi_datasets_entries = retrieve_doi_dataset(doi_url)
-        if not pub_entry:
-            pub_entry = retrieve_data_collection(catalogue_url, doi_datasets_entries[0]["id"])
-
-        # investigation_ids = list(set([
-        #     ds["investigation"]["id"]
-        #     for ds
-        #     in doi_datasets_entries
-        # ]))
-        # print(f" - Investigation IDs : {investigation_ids}")
-        # print(f" - Number of investigations : {len(investigation_ids)}")
-        # investigation_id = investigation_ids[0]
-        # print(f" - Selecting Investigation ID : {investigation_id}")
-
-        #investigation_entry = retrieve_investigation(catalogue_url, investigation_id)
-        investigation_entries = extract_investigations_from_datasets(doi_datasets_entries)
-        doi_datasets_entries = [
-            settings.remove_fields(
-                ds,
-                ["investigation"]
-            )
-            for ds in doi_datasets_entries
-        ]
-        investigation_ids = [
-            i['id']
-            for i
-            in investigation_entries
-        ]
-
-        #release_date = get_release_date(datacite_entry)
-        #is_public = is_investigation_public(release_date)
-
-        reports_entries = retrieve_reports(doi_url)
-
-        #datasets_entries = retrieve_datasets(catalogue_url, investigation_id)
-
-        samples_entries = []
-        users_entries = []
-        for investigation_id in investigation_ids:
-            if include_samples:
-                entries = retrieve_samples(catalogue_url, investigation_id)
-                if isinstance(entries, list):
-                    samples_entries += entries
-            if include_users:
-                entries = retrieve_users(catalogue_url, investigation_id)
-                if isinstance(entries, list):
-                    users_entries += entries
-
-        samples_entries = "Not included" if not include_samples else samples_entries
-        users_entries = "Not included" if not include_users else users_entries
-
-        instruments_entries = extract_instruments_from_investigations(investigation_entries)
-        investigation_entries = [
-            settings.remove_fields(
-                i,
-                ["investigationInstruments"]
-            )
-            for i in investigation_entries
-        ]
-
-        if include_datafiles:
-            doi_datasets_entries = retrieve_datafiles(catalogue_url, doi_datasets_entries)
-
-        entry = prepare_entry(
+    try:
+        collect_publication(
+            doi,
             pub_entry,
-            doi_datacite_entry,
-            datacite_entry,
-            reports_entries,
-            doi_datasets_entries,
-            samples_entries,
-            users_entries,
-            citation_entries,
-            instruments_entries,
-            investigation_entries
+            catalogue_url,
+            output_folder,
+            include_samples,
+            include_datafiles,
+            include_users
         )
-
-        with open(document_file, 'w') as fh:
-            json.dump(entry, fh)
+    except RetrievalError as e:
+        print(e)
+        settings.print_http_stats()
+        sys.exit(retrieval_error_exit_code)
+    settings.print_http_stats()
     print("----------------------------------------------------------")
     print(datetime.datetime.now().isoformat())
     print("OSCARS PaN-Finder project - Task 1 - ESRF - oscars_pan_finder_collect_esrf_entry - END")
@@ -10,6 +10,16 @@
 #
 # This script run the data collection scripts in the correct order and correct python environment.
 #
+# Usage: oscars_pan_finder_collect_esrf_publications.bash [--incremental]
+#
+# With --incremental, the publications already collected are kept, only the publications created or modified
+# since the previous run are listed and only the modified ones are collected again.
+#
+# The publications entries are finally merged in ../data/oscars_pan_finder_publications_<timestamp>.json.zip
+# by oscars_pan_finder_bundle_esrf_publications.py, one entry at a time.
+# The parameters of their datasets and samples are exported in columnar tables in ../data/esrf/parameters/
+# by oscars_pan_finder_export_esrf_parameters.py, which requires pyarrow.
+#
 # -------------------------------------------------
 # This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
 # PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
@@ -24,12 +34,21 @@
 #
 
 
+INCREMENTAL=""
+if [ "$1" == "--incremental" ]; then
+  INCREMENTAL="--incremental"
+fi
+
 # check if folder for temporary files is present
 TEMP_DATA_FOLDER="../data/esrf"
 if [ -d ${TEMP_DATA_FOLDER} ]; then
   echo "Directory ${TEMP_DATA_FOLDER} exists."
-  echo "Removing all publications entries."
-  rm -fv ${TEMP_DATA_FOLDER}/esrf_publication_*.json
+  if [ -n "${INCREMENTAL}" ]; then
+    echo "Incremental mode. Keeping publications entries."
+  else
+    echo "Removing all publications entries."
+    find ${TEMP_DATA_FOLDER} -maxdepth 1 -name 'esrf_publication_*.json' -print -delete
+  fi
 else
   echo "Creating temp data folder"
   mkdir ${TEMP_DATA_FOLDER}
@@ -41,7 +60,7 @@ PUBLICATIONS_FILE=${TEMP_DATA_FOLDER}/oscars_pan_finder_esrf_publications.json
 PUBLICATIONS_LIST_LOG=${TEMP_DATA_FOLDER}/oscars_pan_finder_esrf_publications_list.`date '+%Y%m%d%H%M%S%N'`.log
 echo "Full list of publications file: ${PUBLICATIONS_FILE}"
 echo "Publications list logs: ${PUBLICATIONS_LIST_LOG}"
-micromamba run -n oscars-pan-finder-task-1 ./oscars_pan_finder_collect_esrf_publications.py -o ${PUBLICATIONS_FILE} 1>${PUBLICATIONS_LIST_LOG} 2>&1
+micromamba run -n oscars-pan-finder-task-1 ./oscars_pan_finder_collect_esrf_publications.py ${INCREMENTAL} -o ${PUBLICATIONS_FILE} 1>${PUBLICATIONS_LIST_LOG} 2>&1
 
 # collect all ESRF publications
 PUBLICATION_ENTRIES_LOG=${TEMP_DATA_FOLDER}/oscars_pan_finder_esrf_publications_entries.`date '+%Y%m%d%H%M%S%N'`.log
@@ -49,12 +68,16 @@ echo "Publications entries logs: ${PUBLICATIONS_ENTRIES_LOG}"
 micromamba run -n oscars-pan-finder-task-1 ./oscars_pan_finder_collect_esrf_publications_from_file.py -i ${PUBLICATIONS_FILE} 1>${PUBLICATIONS_ENTRIES_LOG} 2>&1
 
 
-# merge all the files
-OUTPUT_FILE = "../data/oscars_pan_finder_esrf_publications_`date '+%Y%m%d%H%M%S%N'`.json"
-jq -s '.' ../data/esrf/esrf_document_* >  ${output_file}
-jq -c -s '.' ${TEMP_DATA_FOLDER}/esrf_publication_*.json > ${OUTPUT_DATA}
-
-
-# compress file
-zip ${OUTPUT_DATA}.zip ${OUTPUT_DATA}
+# merge all the publications entries in a single compressed file
+OUTPUT_FILE="../data/oscars_pan_finder_publications_`date '+%Y%m%d%H%M%S%N'`.json.zip"
+PUBLICATIONS_BUNDLE_LOG=${TEMP_DATA_FOLDER}/oscars_pan_finder_esrf_publications_bundle.`date '+%Y%m%d%H%M%S%N'`.log
+echo "Publications bundle file: ${OUTPUT_FILE}"
+echo "Publications bundle logs: ${PUBLICATIONS_BUNDLE_LOG}"
+micromamba run -n oscars-pan-finder-task-1 ./oscars_pan_finder_bundle_esrf_publications.py -f ${TEMP_DATA_FOLDER} -o ${OUTPUT_FILE} 1>${PUBLICATIONS_BUNDLE_LOG} 2>&1
 
+# export the parameters of the datasets and samples of the publications entries in columnar tables
+PARAMETERS_FOLDER=${TEMP_DATA_FOLDER}/parameters
+PARAMETERS_EXPORT_LOG=${TEMP_DATA_FOLDER}/oscars_pan_finder_esrf_parameters_export.`date '+%Y%m%d%H%M%S%N'`.log
+echo "Parameters tables folder: ${PARAMETERS_FOLDER}"
+echo "Parameters export logs: ${PARAMETERS_EXPORT_LOG}"
+micromamba run -n oscars-pan-finder-task-1 ./oscars_pan_finder_export_esrf_parameters.py -f ${TEMP_DATA_FOLDER} -o ${PARAMETERS_FOLDER} 1>${PARAMETERS_EXPORT_LOG} 2>&1
@@ -23,8 +23,24 @@
 #   -e, --retrieve-entries = Retrieves all the entries and save them to individual files
 #   -c, --portal-conf-file = Path to the file containing the configuration for the portal. It will be created if it does not exists.
 #                            default="../data/esrf/esrf_data_portal_config.json",
+#   -x, --executor = How each DOI is collected: thread, process or subprocess. Default="thread"
+#   -w, --workers = Number of DOIs collected at the same time. Default=4
+#   -r, --retry-failed = Collect only the DOIs recorded as failed in the harvest journal of the output folder. Implies -e
+#   -k, --session-cache-file = File where the session with the portal is saved to be reused by other processes.
+#                              Default="../data/esrf/esrf_session.json"
+#   -C, --http-cache-file = SQLite file caching the HTTP responses, empty to disable.
+#                           Default="../data/esrf/esrf_http_cache.sqlite"
+#   -i, --incremental = List only the publications created or modified since the previous listing, saved in the output file,
+#                       and collect again only the modified ones
+#   -W, --watermark-file = File where the high-water mark of the listing is saved. Default="../data/esrf/esrf_watermarks.json"
+#   -O, --output-folder = Folder where the publications are saved, with their manifest and harvest journal. Default="../data/esrf/"
+#   -S, --full-sweep-days = Number of days after which an incremental run lists all the publications, to find the ones
+#                           modified below the pages already seen. Default=7
 #
-# Version: 1.0
+# The output file is written through a temporary file renamed once complete. If its name ends with .jsonl,
+# the publications are saved one per line instead of as a json array.
+#
+# Version: 1.5
 #
 #
 #
@@ -41,7 +57,6 @@
 # If not, see <https://www.gnu.org/licenses/>.
 #
 
-import subprocess
 import urllib
 
 import requests
@@ -55,9 +70,63 @@ import re
 #from playwright.sync_api import sync_playwright, expect
 from IPython.display import display, JSON
 import argparse
+import functools
 import sys
 
 import oscars_pan_finder_settings_esrf as settings
+import oscars_pan_finder_collect_esrf_publication as publication
+import oscars_pan_finder_esrf_harvester as harvester
+import oscars_pan_finder_jsonl as jsonl
+import oscars_pan_finder_paginator as paginator
+import oscars_pan_finder_watermark as watermark
+
+# name of the listing in the watermark file and fields with the creation and modification time of its entries
+watermark_source = "datacollection"
+watermark_time_fields = ["createTime", "modTime"]
+# the incremental listing stops at the first page already seen, a full listing finds the entries modified below it
+default_full_sweep_days = 7
+
+
+def retrieve_datacollection_window(datacollection_url, skip, limit):
+    """
+    Retrieve one page of the ESRF data collections, sorted by date, most recent first.
+
+    ```
+    https://icatplus.esrf.fr/catalogue/a1a4c6c7-a77c-44cc-b06e-4cd9439c1dfd/datacollection?type=datacollection&sortBy=DATE&sortOrder=-1&limit=20&skip=0
+    ```
+    """
+    params = {
+        "type" : "datacollection",
+        "sortBy" : "DATE",
+        "sortOrder" : -1,
+        "skip" : skip,
+        "limit" : limit
+    }
+    res = settings.get_http_client().get(
+        datacollection_url,
+        params = params
+    )
+    return res.json()
+
+
+def retrieve_all_datacollections(fetch_window):
+    """
+    Retrieve all the ESRF data collections, the pages being requested concurrently once the total is known.
+    """
+    first_page = fetch_window(settings.initial_skip, settings.batch_limit)
+    total = paginator.get_page_total(first_page)
+    print(f" - Total number of publications   : {total}")
+    publication_documents = paginator.collect_all(
+        fetch_window,
+        total,
+        settings.batch_limit,
+        workers=settings.pagination_workers,
+        initial_skip=settings.initial_skip,
+        key=lambda e: e.get("id"),
+        first_page=first_page
+    )
+    print("")
+    return publication_documents
 
 
 def main():
@@ -82,10 +151,81 @@ def main():
         default="../data/esrf/esrf_data_portal_config.json",
         type=str
     )
+    parser.add_argument(
+        "-r","--retry-failed",
+        help="Collect only the DOIs recorded as failed in the harvest journal",
+        dest="retry_failed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-x","--executor",
+        help="How each DOI is collected: in a pool of threads or processes, or in its own python interpreter.",
+        dest="executor",
+        default=harvester.default_executor,
+        choices=harvester.executors,
+        type=str
+    )
+    parser.add_argument(
+        "-w","--workers",
+        help="Number of DOIs collected at the same time.",
+        dest="workers",
+        default=harvester.default_workers,
+        type=int
+    )
+    parser.add_argument(
+        "-k","--session-cache-file",
+        help="File where the session with the portal is saved to be reused by other processes.",
+        dest="session_cache_file",
+        default="../data/esrf/esrf_session.json",
+        type=str
+    )
+    parser.add_argument(
+        "-i","--incremental",
+        help="List only the publications created or modified since the previous listing and collect again the modified ones",
+        dest="incremental",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-W","--watermark-file",
+        help="File where the high-water mark of the listing is saved.",
+        dest="watermark_file",
+        default="../data/esrf/esrf_watermarks.json",
+        type=str
+    )
+    parser.add_argument(
+        "-O","--output-folder",
+        help="Folder where the publications are saved, with their manifest and harvest journal.",
+        dest="output_folder",
+        default=harvester.default_output_folder,
+        type=str
+    )
+    parser.add_argument(
+        "-S","--full-sweep-days",
+        help="Number of days after which an incremental run lists all the publications to find the modified ones.",
+        dest="full_sweep_days",
+        default=default_full_sweep_days,
+        type=float
+    )
+    parser.add_argument(
+        "-C","--http-cache-file",
+        help="SQLite file caching the HTTP responses. An empty value disables the cache.",
+        dest="http_cache_file",
+        default=settings.http_cache_file,
+        type=str
+    )
     args = parser.parse_args()
+    settings.http_cache_file = os.path.abspath(args.http_cache_file) if args.http_cache_file else None
     output_file = os.path.abspath(args.output_file)
-    retrieve_entries = args.retrieve_entries
+    retrieve_entries = args.retrieve_entries or args.retry_failed
     conf_file = args.conf_file
+    settings.session_cache_file = os.path.abspath(args.session_cache_file) if args.session_cache_file else None
+    executor = args.executor
+    workers = args.workers
+    retry_failed = args.retry_failed
+    incremental = args.incremental
+    watermark_file = os.path.abspath(args.watermark_file)
+    output_folder = os.path.abspath(args.output_folder)
+    full_sweep_days = args.full_sweep_days
 
     python_path = sys.executable
 
@@ -102,6 +242,13 @@ def main():
     print(f" - Retrieve Entries               : {retrieve_entries}")
     print(f" - Configuration File             : {conf_file}")
     print(f" - Python Interpreter             : {python_path}")
+    print(f" - Executor                       : {executor}")
+    print(f" - Workers                        : {workers}")
+    print(f" - Retry Failed                   : {retry_failed}")
+    print(f" - Incremental                    : {incremental}")
+    print(f" - Watermark File                 : {watermark_file}")
+    print(f" - Output Folder                  : {output_folder}")
+    print(f" - Full Sweep Days                : {full_sweep_days}")
 
     # establish session
     print("Retrieving session - BEGIN")
@@ -117,83 +264,117 @@ def main():
     print(f" - Data Collection URL            : {datacollection_url}")
     print("Settings URL - END")
 
-    # Retrieve all ESRF publication entries
-    print("Collecting ESRF publications - BEGIN")
-    publication_documents = []
-    keep_going = True
-    skip = settings.initial_skip
-    while keep_going:
-        # https://icatplus.esrf.fr/catalogue/a1a4c6c7-a77c-44cc-b06e-4cd9439c1dfd/datacollection
-        #  ?
-        #   type = datacollection &
-        #   sortBy = DATE &
-        #   sortOrder = -1 &
-        #   limit = 20 &
-        #   skip = 0
-        params = {
-            "type" : "datacollection",
-            "sortBy" : "DATE",
-            "sortOrder" : -1,
-            "skip" : skip,
-            "limit" : settings.batch_limit
+    fetch_window = functools.partial(retrieve_datacollection_window, datacollection_url)
+    previous_watermark = watermark.load_watermark(watermark_file, watermark_source)
+    last_full_sweep = previous_watermark.get("last_full_sweep") if previous_watermark else None
+    if incremental and previous_watermark and os.path.exists(output_file):
+        previous_documents = jsonl.load_records(output_file)
+        known_times = {
+            pub["doi"]: watermark.get_entry_time(pub, watermark_time_fields)
+            for pub
+            in previous_documents
         }
-        res = requests.get(
-            datacollection_url,
-            params = params
-        )
-        current_batch = res.json()
-        keep_going = len(current_batch) == settings.batch_limit
-        publication_documents += current_batch
-        print(".",end="")
-        skip += len(current_batch)
+        if watermark.is_full_sweep_due(previous_watermark, full_sweep_days):
+            # List all the ESRF publication entries, to find the ones modified below the pages of the
+            # incremental listings, which are sorted by publication date and not by modification time
+            print("Sweeping ESRF publications - BEGIN")
+            print(f" - Last full sweep                : {last_full_sweep}")
+            publication_documents = retrieve_all_datacollections(fetch_window)
+            new_documents = watermark.select_changed_entries(
+                publication_documents,
+                known_times,
+                key=lambda e: e.get("doi"),
+                time_fields=watermark_time_fields
+            )
+            last_full_sweep = datetime.datetime.now().isoformat()
+            print("Sweeping ESRF publications - END")
+        else:
+            # Retrieve only the ESRF publication entries created or modified since the previous listing
+            print("Collecting new ESRF publications - BEGIN")
+            print(f" - High-water mark                : {previous_watermark['high_water_mark']}")
+            new_documents, number_of_pages = watermark.collect_new_entries(
+                fetch_window,
+                settings.batch_limit,
+                known_times,
+                previous_watermark["high_water_mark"],
+                key=lambda e: e.get("doi"),
+                time_fields=watermark_time_fields,
+                initial_skip=settings.initial_skip
+            )
+            new_documents = paginator.deduplicate(new_documents, lambda e: e.get("id"))
+            publication_documents = watermark.merge_entries(previous_documents, new_documents, lambda e: e.get("doi"))
+            print(f" - Pages requested                : {number_of_pages}")
+            print("Collecting new ESRF publications - END")
+        modified_dois = [
+            pub["doi"]
+            for pub
+            in new_documents
+            if pub.get("doi") in known_times
+        ]
+        print(f" - New publications               : {len(new_documents) - len(modified_dois)}")
+        print(f" - Modified publications          : {len(modified_dois)}")
 
-    print("")
-    print("Collecting ESRF publications - END")
+        # the modified publications are collected again, without the responses cached for their previous content
+        modified_dois = [doi for doi in modified_dois if isinstance(doi, str) and doi]
+        for doi in modified_dois:
+            publication.forget_publication(doi, output_folder)
+        invalidated = publication.invalidate_cached_publications(modified_dois, output_folder)
+        print(f" - Cached responses invalidated   : {invalidated}")
+        documents_to_collect = new_documents
+    else:
+        # Retrieve all ESRF publication entries
+        print("Collecting ESRF publications - BEGIN")
+        publication_documents = retrieve_all_datacollections(fetch_window)
+        last_full_sweep = datetime.datetime.now().isoformat()
+        print("Collecting ESRF publications - END")
+        documents_to_collect = None
     print("Collected " + str(len(publication_documents)) + " documents")
 
     print("Cleaning entries - BEGIN")
     publication_documents = [
-        settings.extract_fields(
-            pub,
-            ["createTime", "modTime", "dataCollectionDatasets", "doi", "parameters"]
-        )
+        settings.projectors["data_collection"](pub)
         for pub
         in publication_documents
     ]
     print("Cleaning entries - END")
 
     print("Saving ESRF publication documents in file: " + output_file)
-    with open(output_file,'w') as fh:
-        json.dump(publication_documents,fh)
+    jsonl.save_records(output_file, publication_documents)
+    watermark.save_watermark(
+        watermark_file,
+        watermark_source,
+        watermark.get_high_water_mark(
+            publication_documents,
+            watermark_time_fields,
+            previous_watermark["high_water_mark"] if previous_watermark else None
+        ),
+        len(publication_documents),
+        {"last_full_sweep": last_full_sweep}
+    )
 
     if retrieve_entries:
-        error_dois = []
-        for entry in publication_documents:
-            print(f"Collecting publication with DOI {entry['doi']}")
-            try:
-                if isinstance(entry["doi"],str) and entry["doi"]:
-                    print("BEGIN ============")
-                    subprocess.run([
-                        python_path,
-                        os.path.abspath("./oscars_pan_finder_collect_esrf_publication.py"),
-                        "-d",
-                        entry["doi"],
-                        "-p",
-                        json.dumps(entry),
-                        "-f",
-                        "-s",
-                        "-u"]
-                    )
-                    print("END ==============")
-            except Exception as e:
-                print(f"Error collecting publication with DOI {entry['doi']}")
-                print(e)
-
-        print(f"Collection errors")
-        print(f" - Number of errors {len(error_dois)}")
-        print(f" - DOIs with errors ")
-        print(json.dumps(error_dois))
+        if documents_to_collect is not None and not retry_failed:
+            # in incremental mode only the new and modified publications are collected
+            new_dois = set(pub.get("doi") for pub in documents_to_collect)
+            publication_documents = [
+                pub
+                for pub
+                in publication_documents
+                if pub["doi"] in new_dois
+            ]
+        summary = harvester.harvest_publications(
+            publication_documents,
+            conf_file,
+            output_folder=output_folder,
+            executor=executor,
+            workers=workers,
+            catalogue_url=catalogue_url,
+            retry_failed=retry_failed,
+            input_file=output_file
+        )
+        harvester.print_summary(summary)
 
+    settings.print_http_stats()
     print("----------------------------------------------------------")
     print(datetime.datetime.now().isoformat())
     print("OSCARS PaN-Finder project - Task 1 - ESRF - oscars_pan_finder_collect_esrf_panosc_documents - END")
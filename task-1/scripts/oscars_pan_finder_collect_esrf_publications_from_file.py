@@ -15,14 +15,24 @@
 # This script will not perform the collection of the list of DOIs, but it will rely on a file previously saved
 # If not specified otherwise, The list of publications should be in a file named:
 #  "../data/esrf/oscars_pan_finder_esrf_publications.json"
+# The file can be a json array or a JSONL file, with the .jsonl extension. It is read one entry at a time while
+# the entries are collected, so the memory used does not depend on the number of publications.
+# With the subprocess executor, each script reads its entry from the DOI index of the file.
 #
 # Usage:
 #  oscars_pan_finder_collect_esrf_publications
 #   -i, --input-file = File with DOIs entries previously saved. Default="../data/esrf/oscars_pan_finder_esrf_publications.json"
 #   -c, --portal-conf-file = Path to the file containing the configuration for the portal. It will be created if it does not exists.
 #                            default="../data/esrf/esrf_data_portal_config.json",
+#   -x, --executor = How each DOI is collected: thread, process or subprocess. Default="thread"
+#   -w, --workers = Number of DOIs collected at the same time. Default=4
+#   -r, --retry-failed = Collect only the DOIs recorded as failed in the harvest journal of the output folder
+#   -k, --session-cache-file = File where the session with the portal is saved to be reused by other processes.
+#                              Default="../data/esrf/esrf_session.json"
+#   -C, --http-cache-file = SQLite file caching the HTTP responses, empty to disable.
+#                           Default="../data/esrf/esrf_http_cache.sqlite"
 #
-# Version: 1.0
+# Version: 1.3
 #
 #
 #
@@ -39,7 +49,6 @@
 # If not, see <https://www.gnu.org/licenses/>.
 #
 
-import subprocess
 import urllib
 
 import requests
@@ -56,6 +65,8 @@ import argparse
 import sys
 
 import oscars_pan_finder_settings_esrf as settings
+import oscars_pan_finder_esrf_harvester as harvester
+import oscars_pan_finder_jsonl as jsonl
 
 
 def main():
@@ -74,9 +85,49 @@ def main():
         default="../data/esrf/esrf_data_portal_config.json",
         type=str
     )
+    parser.add_argument(
+        "-r","--retry-failed",
+        help="Collect only the DOIs recorded as failed in the harvest journal",
+        dest="retry_failed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-x","--executor",
+        help="How each DOI is collected: in a pool of threads or processes, or in its own python interpreter.",
+        dest="executor",
+        default=harvester.default_executor,
+        choices=harvester.executors,
+        type=str
+    )
+    parser.add_argument(
+        "-w","--workers",
+        help="Number of DOIs collected at the same time.",
+        dest="workers",
+        default=harvester.default_workers,
+        type=int
+    )
+    parser.add_argument(
+        "-k","--session-cache-file",
+        help="File where the session with the portal is saved to be reused by other processes.",
+        dest="session_cache_file",
+        default="../data/esrf/esrf_session.json",
+        type=str
+    )
+    parser.add_argument(
+        "-C","--http-cache-file",
+        help="SQLite file caching the HTTP responses. An empty value disables the cache.",
+        dest="http_cache_file",
+        default=settings.http_cache_file,
+        type=str
+    )
     args = parser.parse_args()
+    settings.http_cache_file = os.path.abspath(args.http_cache_file) if args.http_cache_file else None
     input_file = os.path.abspath(args.input_file)
     conf_file = args.conf_file
+    settings.session_cache_file = os.path.abspath(args.session_cache_file) if args.session_cache_file else None
+    executor = args.executor
+    workers = args.workers
+    retry_failed = args.retry_failed
 
     python_path = sys.executable
 
@@ -92,45 +143,22 @@ def main():
     print(f" - Input File                     : {input_file}")
     print(f" - Configuration File             : {conf_file}")
     print(f" - Python Interpreter             : {python_path}")
+    print(f" - Executor                       : {executor}")
+    print(f" - Workers                        : {workers}")
+    print(f" - Retry Failed                   : {retry_failed}")
 
-    # Load entries from file
-    print("Loading ESRF publications from file - BEGIN")
-    with open(input_file,'r') as fh:
-        publication_documents = json.load(fh)
-    print("Loading ESRF publications from file - END")
-    print("Loaded " + str(len(publication_documents)) + " documents")
-
-    print("Saving ESRF publication documents in file: " + input_file)
-    with open(input_file,'w') as fh:
-        json.dump(publication_documents,fh)
-
-    error_dois = []
-    for entry in publication_documents:
-        print(f"Collecting publication with DOI {entry['doi']}")
-        try:
-            if isinstance(entry["doi"], str) and entry["doi"]:
-                print("BEGIN ============")
-                subprocess.run([
-                    python_path,
-                    os.path.abspath("./oscars_pan_finder_collect_esrf_publication.py"),
-                    "-d",
-                    entry["doi"],
-                    "-p",
-                    json.dumps(entry),
-                    "-f",
-                    "-s",
-                    "-u"]
-                )
-                print("END ==============")
-        except Exception as e:
-            error_dois.append(entry['doi'])
-            print(f"Error collecting publication with DOI {entry['doi']}")
-            print(e)
-
-    print(f"Collection errors")
-    print(f" - Number of errors {len(error_dois)}")
-    print(f" - DOIs with errors ")
-    print(json.dumps(error_dois))
+    # the entries are read from the file one at a time, while they are collected
+    print("Streaming ESRF publications from file")
+    summary = harvester.harvest_publications(
+        jsonl.iterate_records(input_file),
+        conf_file,
+        input_file=input_file,
+        executor=executor,
+        workers=workers,
+        retry_failed=retry_failed
+    )
+    harvester.print_summary(summary)
+    settings.print_http_stats()
     print("----------------------------------------------------------")
     print(datetime.datetime.now().isoformat())
     print("OSCARS PaN-Finder project - Task 1 - ESRF - oscars_pan_finder_collect_esrf_panosc_documents - END")
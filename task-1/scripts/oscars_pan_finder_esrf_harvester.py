@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Data collector for publications from PaN data provider:
+# - ESRF (European Synchrotron Radiation Facility, https://www.esrf.fr/)
+#
+# This module runs the collection of many publications inside a single python process.
+# It imports oscars_pan_finder_collect_esrf_publication as a library, logs in to the ESRF data portal once
+# and runs the per-DOI logic in a bounded pool of workers, threads or processes.
+# The legacy behaviour, one python interpreter per DOI, is still available with the subprocess executor.
+# The publications whose content hash changed during the run are listed in
+# <output folder>/esrf_changed_entries_<timestamp>.json
+# The list of publications is iterated once, while the publications are collected, so it can be streamed from
+# the input file without holding it in memory.
+#
+# Version: 1.1
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import concurrent.futures
+import datetime
+import functools
+import itertools
+import json
+import os
+import subprocess
+import sys
+
+import oscars_pan_finder_collect_esrf_publication as publication
+import oscars_pan_finder_journal as journal
+import oscars_pan_finder_manifest as manifest
+import oscars_pan_finder_panosc_index as panosc_index
+import oscars_pan_finder_settings_esrf as settings
+
+# executors available to run the collection of each DOI
+executors = ["thread", "process", "subprocess"]
+default_executor = "thread"
+default_workers = 4
+default_output_folder = "../data/esrf/"
+# number of DOIs recorded as pending in the journal at a time
+pending_batch_size = 1000
+
+
+def collect_publication_subprocess(
+        doi,
+        pub_entry,
+        conf_file,
+        output_folder,
+        include_samples=True,
+        include_datafiles=True,
+        include_users=True,
+        input_file=None
+):
+    """
+    Collect one publication running the collection script in its own python interpreter.
+
+    With input_file, the script reads the publication entry from the DOI index of the file,
+    otherwise the entry is passed on the command line.
+    """
+    command = [
+        sys.executable,
+        os.path.abspath("./oscars_pan_finder_collect_esrf_publication.py"),
+        "-d",
+        doi,
+    ]
+    command += ["-i", input_file] if input_file else ["-p", json.dumps(pub_entry)]
+    command += [
+        "-c",
+        conf_file,
+        "-o",
+        output_folder,
+    ]
+    if settings.session_cache_file:
+        command += ["-k", settings.session_cache_file]
+    command += ["-C", settings.http_cache_file or ""]
+    if include_datafiles:
+        command.append("-f")
+    if include_samples:
+        command.append("-s")
+    if include_users:
+        command.append("-u")
+
+    res = subprocess.run(command)
+    if res.returncode == publication.retrieval_error_exit_code:
+        raise publication.RetrievalError(f"{doi} - could not retrieve some resources, see the collection logs")
+    if res.returncode != 0:
+        raise RuntimeError(f"collection script exited with code {res.returncode}")
+    return "completed"
+
+
+def get_indexed_entries(input_file, dois, in_memory=False):
+    """
+    Yield the publication entries of dois read from the DOI index of input_file, skipping the missing ones.
+
+    With in_memory, the entries are indexed in memory, for the executors collecting in this process.
+    """
+    for doi in dois:
+        entry = panosc_index.get_panosc_entry(input_file, doi, in_memory=in_memory)
+        if entry is None:
+            print(f" - DOI {doi} not found in {input_file}")
+            continue
+        yield entry
+
+
+def select_entries(publication_documents, dois):
+    """
+    Yield the publication entries of dois, reading publication_documents only until all of them are found.
+    """
+    remaining = set(dois)
+    if not remaining:
+        return
+    for entry in publication_documents:
+        if entry["doi"] in remaining:
+            remaining.discard(entry["doi"])
+            yield entry
+            if not remaining:
+                return
+
+
+def bounded_submit(executor, jobs, max_pending):
+    """
+    Submit jobs to the executor keeping at most max_pending of them in flight.
+
+    jobs is an iterable of (key, function, args) tuples.
+    It yields (key, future) pairs as the futures complete.
+    """
+    pending = {}
+    for key, function, args in jobs:
+        pending[executor.submit(function, *args)] = key
+        if len(pending) >= max_pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+
+    for future in concurrent.futures.as_completed(list(pending)):
+        yield pending.pop(future), future
+
+
+def harvest_publications(
+        publication_documents,
+        conf_file,
+        output_folder=default_output_folder,
+        executor=default_executor,
+        workers=default_workers,
+        include_samples=True,
+        include_datafiles=True,
+        include_users=True,
+        catalogue_url=None,
+        retry_failed=False,
+        input_file=None
+):
+    """
+    Collect all the publications listed in publication_documents.
+
+    publication_documents can be any iterable, such as the records of the input file read one at a time:
+    it is iterated only once, as the workers take the publications, and it is never held in memory.
+    With the subprocess executor and input_file, the file the publications are read from, each script
+    reads its publication entry from the DOI index of the file instead of the command line.
+
+    With the thread and process executors, the session with the ESRF data portal is opened once
+    and shared by all the workers. An already opened catalogue url can be passed with catalogue_url.
+    The state of each DOI is recorded in the journal of the output folder. The DOIs left in flight by
+    a previous run are collected again, and with retry_failed only the DOIs that failed are collected:
+    their entries are read from the DOI index of input_file, or from publication_documents without it.
+    It returns a summary of the run with the number of publications per status and the DOIs that failed.
+    """
+    print("harvest_publications - BEGIN")
+    if executor not in executors:
+        raise ValueError(f"Unknown executor {executor}. Valid values: {executors}")
+    workers = max(1, workers)
+    conf_file = os.path.abspath(conf_file)
+    output_folder = os.path.abspath(output_folder)
+
+    print(f" - Executor      : {executor}")
+    print(f" - Workers       : {workers}")
+    print(f" - Output Folder : {output_folder}")
+
+    # the manifest is opened, and rebuilt if missing, before the workers start using it
+    entries_manifest = manifest.get_manifest(output_folder)
+    print(f" - Manifest      : {entries_manifest.count()} entries")
+
+    harvest_journal = journal.Journal(output_folder)
+    print(f" - Resumed       : {harvest_journal.resume()} DOIs left in flight")
+    publication_documents = (
+        entry
+        for entry
+        in publication_documents
+        if isinstance(entry.get("doi"), str) and entry.get("doi")
+    )
+    if retry_failed:
+        failed_dois = harvest_journal.get_dois(journal.failed)
+        if input_file:
+            # the failed DOIs come from the journal, their entries from the DOI index of the input file
+            publication_documents = get_indexed_entries(input_file, failed_dois, in_memory=executor != "subprocess")
+        else:
+            publication_documents = select_entries(publication_documents, failed_dois)
+        print(f" - Retry failed  : {len(failed_dois)} DOIs")
+
+    if executor == "subprocess":
+        function = functools.partial(collect_publication_subprocess, input_file=input_file)
+        target = conf_file
+        if input_file:
+            # the DOI index is built here once, not by each collection script
+            panosc_index.get_file_index(input_file)
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    else:
+        function = publication.collect_publication
+        target = catalogue_url if catalogue_url else publication.open_catalogue(conf_file)
+        if executor == "process":
+            # the worker processes reuse the session opened here and the response cache file
+            pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=settings.import_session,
+                initargs=(settings.export_session(), settings.session_cache_file, settings.http_cache_file)
+            )
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def get_jobs():
+        # the DOIs are recorded as pending a batch at a time, as they are read
+        while True:
+            batch = list(itertools.islice(publication_documents, pending_batch_size))
+            if not batch:
+                return
+            harvest_journal.add_pending([entry["doi"] for entry in batch])
+            for entry in batch:
+                harvest_journal.set_in_flight(entry["doi"])
+                yield (
+                    entry["doi"],
+                    function,
+                    (entry["doi"], entry, target, output_folder, include_samples, include_datafiles, include_users)
+                )
+
+    summary = {
+        "statuses": {},
+        "error_dois": [],
+        "errors": {},
+    }
+    start_time = datetime.datetime.now()
+    started_at = start_time.isoformat()
+    with pool:
+        for doi, future in bounded_submit(pool, get_jobs(), workers * 2):
+            try:
+                status = future.result()
+                harvest_journal.set_done(doi)
+            except Exception as e:
+                print(f"Error collecting publication with DOI {doi}")
+                print(e)
+                status = "failed"
+                summary["error_dois"].append(doi)
+                summary["errors"][doi] = f"{type(e).__name__}: {e}"
+                harvest_journal.set_failed(doi, type(e).__name__, str(e))
+            summary["statuses"][status] = summary["statuses"].get(status, 0) + 1
+
+    elapsed = (datetime.datetime.now() - start_time).total_seconds()
+    summary["total"] = sum(summary["statuses"].values())
+    summary["elapsed_seconds"] = elapsed
+    summary["publications_per_second"] = summary["total"] / elapsed if elapsed else 0.0
+    summary["journal"] = harvest_journal.count_states()
+    # entries whose content hash changed during the run, written by all the workers in the manifest
+    changes = entries_manifest.get_changes(started_at)
+    summary["changed_entries"] = len(changes)
+    summary["changed_entries_file"] = save_changed_entries(changes, output_folder, start_time)
+    # throttle events of the requests sent by this process
+    summary["throttling"] = {
+        host: {stat: host_stats[stat] for stat in ["throttled", "transient_errors", "retries", "rate"]}
+        for host, host_stats
+        in settings.get_http_client().rate_limiter.get_stats().items()
+    }
+
+    print("harvest_publications - END")
+    return summary
+
+
+def save_changed_entries(changes, output_folder, start_time):
+    """
+    Save the list of the entries added or changed by a run in the output folder and return the file name.
+    """
+    changed_entries_file = os.path.join(
+        output_folder,
+        "esrf_changed_entries_" + start_time.strftime("%Y%m%d%H%M%S%f") + ".json"
+    )
+    with open(changed_entries_file, 'w') as fh:
+        json.dump(changes, fh, indent=2)
+    return changed_entries_file
+
+
+def print_summary(summary):
+    print("Collection summary")
+    print(f" - Number of publications   : {summary['total']}")
+    for status, count in sorted(summary["statuses"].items()):
+        print(f" - {status:<24} : {count}")
+    print(f" - Elapsed time (s)         : {summary['elapsed_seconds']:.1f}")
+    print(f" - Publications per second  : {summary['publications_per_second']:.2f}")
+    print(f" - Changed entries          : {summary['changed_entries']}")
+    print(f" - Changed entries file     : {summary['changed_entries_file']}")
+    print(f"Harvest journal")
+    for state, count in summary["journal"].items():
+        print(f" - {state:<24} : {count}")
+    print(f"Throttling")
+    for host, host_stats in sorted(summary["throttling"].items()):
+        print(
+            f" - {host:<24} : {host_stats['throttled']} throttled,"
+            f" {host_stats['transient_errors']} transient errors, rate {host_stats['rate']:.1f}/s"
+        )
+    print(f"Collection errors")
+    print(f" - Number of errors {len(summary['error_dois'])}")
+    print(f" - DOIs with errors ")
+    print(json.dumps(summary["error_dois"]))
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Export of the parameters of the datasets and samples collected from PaN data provider:
+# - ESRF (European Synchrotron Radiation Facility, https://www.esrf.fr/)
+#
+# The parameters of the datasets and samples of all the publication entries are flattened in two columnar tables,
+# one row per parameter, so that analytic queries, such as all the datasets with an energy between two values,
+# run on the tables instead of parsing every publication file:
+#  <output folder>/dataset_parameters.parquet : dataset_id, doi, name, value, numeric_value, units
+#  <output folder>/sample_parameters.parquet  : sample_id, doi, name, value, numeric_value, units
+# doi is the DOI of the publication entry, value the raw value of the parameter and numeric_value its value
+# parsed as a number, null when it is not numeric. doi, name and units are dictionary encoded.
+# The tables are written in Parquet or, with --format arrow, in the Arrow IPC file format (.arrow).
+# The entries are read one at a time and the rows are written in batches of batch_rows rows,
+# through temporary files renamed once complete.
+#
+# It requires pyarrow, the other collectors do not.
+#
+# Example of query:
+#   pyarrow.parquet.read_table("dataset_parameters.parquet",
+#     filters=[("name", "=", "InstrumentMonochromator_energy"), ("numeric_value", ">=", 10), ("numeric_value", "<", 15)])
+#
+# Usage: oscars_pan_finder_export_esrf_parameters
+#   -f, --folder = Folder with the publication entries. Default="../data/esrf/"
+#   -p, --file-prefix = Prefix of the files of the entries exported. Default="esrf_publication_"
+#   -s, --scan-folder = List the files scanning the folder instead of reading the manifest
+#   -i, --input-file = Bundle, json, JSONL or seekable file with the entries, read instead of the folder
+#   -o, --output-folder = Folder where the tables are saved. Default="../data/esrf/parameters/"
+#   -F, --format = Format of the tables, parquet or arrow. Default=parquet
+#   -b, --batch-rows = Number of rows written at a time. Default=100000
+#
+# Version: 1.0
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import argparse
+import datetime
+import json
+import math
+import os
+import sys
+import time
+
+import oscars_pan_finder_bundle_esrf_publications as bundle
+import oscars_pan_finder_jsonl as jsonl
+import oscars_pan_finder_manifest as manifest
+import oscars_pan_finder_snapshot_diff as snapshot_diff
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+default_folder = "../data/esrf/"
+default_file_prefix = "esrf_publication_"
+default_output_folder = "../data/esrf/parameters/"
+default_batch_rows = 100000
+
+output_formats = {"parquet": ".parquet", "arrow": ".arrow"}
+
+# table of the parameters of each part of the entries, with the name of the column of the record id
+parameter_tables = {
+    "datasets": ("dataset_parameters", "dataset_id"),
+    "samples": ("sample_parameters", "sample_id"),
+}
+dictionary_columns = ["doi", "name", "units"]
+
+
+def parse_numeric(value):
+    """
+    Return the value of a parameter as a float, or None if it is not a finite number.
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_table_schema(id_column):
+    dictionary_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return pyarrow.schema([
+        (id_column, pyarrow.int64()),
+        ("doi", dictionary_type),
+        ("name", dictionary_type),
+        ("value", pyarrow.string()),
+        ("numeric_value", pyarrow.float64()),
+        ("units", dictionary_type),
+    ])
+
+
+class ParameterTableWriter:
+    """
+    Write the rows of a parameter table in batches, through a temporary file renamed when the writer is closed.
+
+    The dictionaries of the dictionary encoded columns grow across the batches: a value keeps its index in
+    the whole table, so that the Arrow file only appends the new values of each batch to its dictionaries.
+    """
+
+    def __init__(self, output_file, id_column, output_format="parquet", batch_rows=default_batch_rows):
+        self.output_file = os.path.abspath(output_file)
+        self.id_column = id_column
+        self.batch_rows = batch_rows
+        self.schema = get_table_schema(id_column)
+        self.temp_file = f"{self.output_file}.{os.getpid()}.tmp"
+        self.number_of_rows = 0
+        self.dictionaries = {column: {} for column in dictionary_columns}
+        self.columns = {field.name: [] for field in self.schema}
+
+        os.makedirs(os.path.dirname(self.output_file), exist_ok=True)
+        if output_format == "arrow":
+            self.writer = pyarrow.ipc.new_file(
+                self.temp_file,
+                self.schema,
+                options=pyarrow.ipc.IpcWriteOptions(compression="zstd", emit_dictionary_deltas=True)
+            )
+        else:
+            self.writer = pyarrow.parquet.ParquetWriter(self.temp_file, self.schema, compression="zstd")
+        self.closed = False
+
+    def encode(self, column, value):
+        if value is None:
+            return None
+        dictionary = self.dictionaries[column]
+        index = dictionary.get(value)
+        if index is None:
+            index = dictionary[value] = len(dictionary)
+        return index
+
+    def add(self, record_id, doi, parameter):
+        value = parameter.get("value")
+        units = parameter.get("units")
+        self.columns[self.id_column].append(parse_id(record_id))
+        self.columns["doi"].append(self.encode("doi", doi))
+        self.columns["name"].append(self.encode("name", parameter.get("name")))
+        self.columns["value"].append(None if value is None else str(value))
+        self.columns["numeric_value"].append(parse_numeric(value))
+        self.columns["units"].append(self.encode("units", None if units is None else str(units)))
+        self.number_of_rows += 1
+        if len(self.columns["value"]) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending rows as a new batch, or row group in Parquet.
+        """
+        if not self.columns["value"]:
+            return
+        arrays = []
+        for field in self.schema:
+            values = self.columns[field.name]
+            if field.name in self.dictionaries:
+                arrays.append(pyarrow.DictionaryArray.from_arrays(
+                    pyarrow.array(values, type=pyarrow.int32()),
+                    pyarrow.array(list(self.dictionaries[field.name]), type=pyarrow.string())
+                ))
+            else:
+                arrays.append(pyarrow.array(values, type=field.type))
+        self.writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.columns = {field.name: [] for field in self.schema}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.closed = True
+        os.replace(self.temp_file, self.output_file)
+
+    def abort(self):
+        self.writer.close()
+        self.closed = True
+        os.remove(self.temp_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.closed:
+            return False
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def iterate_folder_entries(folder, file_prefix, scan_folder=False):
+    """
+    Yield the entries of the folder, listed from its manifest, only the ones marked as done, or scanning the folder.
+    """
+    if scan_folder:
+        files = bundle.list_folder_files(folder, file_prefix)
+    else:
+        files = manifest.get_manifest(folder).iterate_files(file_prefix)
+    for file_name, file_path in files:
+        try:
+            with open(file_path) as fh:
+                yield json.load(fh)
+        except FileNotFoundError:
+            print(f" - Entry file {file_name} not found, skipped")
+
+
+def export_parameters(entries, output_folder, output_format="parquet", batch_rows=default_batch_rows):
+    """
+    Write the parameters of the datasets and samples of the entries in the parameter tables of output_folder.
+
+    It returns the statistics of the export.
+    """
+    stats = {"entries": 0, "start_time": time.monotonic()}
+    writers = {
+        part: ParameterTableWriter(
+            os.path.join(output_folder, table_name + output_formats[output_format]),
+            id_column,
+            output_format=output_format,
+            batch_rows=batch_rows
+        )
+        for part, (table_name, id_column)
+        in parameter_tables.items()
+    }
+    try:
+        for entry in entries:
+            doi = snapshot_diff.get_record_key(entry)
+            for part, writer in writers.items():
+                # the parts not included or not retrieved are saved as messages
+                records = entry.get(part)
+                if not isinstance(records, list):
+                    continue
+                for record in records:
+                    for parameter in record.get("parameters") or []:
+                        writer.add(record.get("id"), doi, parameter)
+            stats["entries"] += 1
+            if stats["entries"] % 1000 == 0:
+                print(f" - {stats['entries']} entries exported")
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    for writer in writers.values():
+        writer.close()
+
+    stats["elapsed_seconds"] = time.monotonic() - stats.pop("start_time")
+    stats["tables"] = {
+        writer.output_file: {
+            "rows": writer.number_of_rows,
+            "names": len(writer.dictionaries["name"]),
+            "size": os.path.getsize(writer.output_file),
+        }
+        for writer
+        in writers.values()
+    }
+    return stats
+
+
+def print_stats(stats):
+    print("Export summary")
+    print(f" - Entries exported         : {stats['entries']}")
+    print(f" - Elapsed time (s)         : {stats['elapsed_seconds']:.1f}")
+    for output_file, table in stats["tables"].items():
+        print(f" - {os.path.basename(output_file)}")
+        print(f"   - Rows                   : {table['rows']}")
+        print(f"   - Parameter names        : {table['names']}")
+        print(f"   - File size              : {table['size']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-f","--folder",
+        help="Folder with the publication entries",
+        dest="folder",
+        default=default_folder,
+        type=str
+    )
+    parser.add_argument(
+        "-p","--file-prefix",
+        help="Prefix of the files of the entries exported",
+        dest="file_prefix",
+        default=default_file_prefix,
+        type=str
+    )
+    parser.add_argument(
+        "-s","--scan-folder",
+        help="List the files scanning the folder instead of reading the manifest",
+        dest="scan_folder",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-i","--input-file",
+        help="Bundle, json, JSONL or seekable file with the entries, read instead of the folder",
+        dest="input_file",
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        "-o","--output-folder",
+        help="Folder where the tables are saved",
+        dest="output_folder",
+        default=default_output_folder,
+        type=str
+    )
+    parser.add_argument(
+        "-F","--format",
+        help="Format of the tables",
+        dest="output_format",
+        choices=list(output_formats),
+        default="parquet",
+    )
+    parser.add_argument(
+        "-b","--batch-rows",
+        help="Number of rows written at a time",
+        dest="batch_rows",
+        default=default_batch_rows,
+        type=int
+    )
+    args = parser.parse_args()
+
+    if pyarrow is None:
+        print("pyarrow is required to export the parameters: pip install pyarrow")
+        sys.exit(1)
+
+    output_folder = os.path.abspath(args.output_folder)
+
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_export_esrf_parameters - BEGIN")
+    print(datetime.datetime.now().isoformat())
+    if args.input_file:
+        print(f" - Input File               : {os.path.abspath(args.input_file)}")
+        entries = jsonl.iterate_records(args.input_file)
+    else:
+        folder = os.path.abspath(args.folder)
+        print(f" - Folder                   : {folder}")
+        print(f" - File Prefix              : {args.file_prefix}")
+        print(f" - Scan Folder              : {args.scan_folder}")
+        entries = iterate_folder_entries(folder, args.file_prefix, scan_folder=args.scan_folder)
+    print(f" - Output Folder            : {output_folder}")
+    print(f" - Format                   : {args.output_format}")
+
+    stats = export_parameters(entries, output_folder, output_format=args.output_format, batch_rows=args.batch_rows)
+    print_stats(stats)
+
+    print(datetime.datetime.now().isoformat())
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_export_esrf_parameters - END")
+
+
+if __name__ == "__main__":
+    main()
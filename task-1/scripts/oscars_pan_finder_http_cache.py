@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Persistent HTTP response cache used by the data collectors.
+#
+# The responses to GET requests are saved in a SQLite file, keyed by method, url and sorted query parameters.
+# Session tokens are removed from the key, so a response can be reused across sessions and runs.
+# Each endpoint has its own time to live, given as a list of (url regular expression, seconds) rules:
+# - a fresh response is served from the cache without contacting the server
+# - a stale response is revalidated with If-None-Match/If-Modified-Since when the server provided an ETag or
+#   a Last-Modified header, and served from the cache if the server answers 304 Not Modified
+# - urls that do not match any rule are not cached. A time to live of 0 means always revalidate.
+# The responses of entries known to have changed can be removed with invalidate before they are requested again.
+#
+# Version: 1.1
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# session tokens removed from the cache keys
+default_token_patterns = [
+    r"(?<=/catalogue/)[^/?]+",
+]
+
+# headers describing the encoding of the body on the wire, not valid for the decoded body saved in the cache
+transport_headers = ["content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"]
+
+
+class ResponseCache:
+    """
+    Disk-backed cache of the responses to GET requests.
+
+    cache_file is the SQLite file holding the responses. It can be shared by several processes.
+    ttls is the list of (url regular expression, time to live in seconds) rules. The first matching rule applies.
+    token_patterns are the regular expressions of the url parts removed from the cache keys.
+    """
+
+    def __init__(self, cache_file, ttls, token_patterns=None):
+        self.cache_file = os.path.abspath(cache_file)
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        self.token_patterns = [re.compile(pattern) for pattern in (token_patterns or default_token_patterns)]
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "stored": 0, "bypassed": 0}
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        self.connection = sqlite3.connect(self.cache_file, timeout=60, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " url TEXT,"
+                " status INTEGER,"
+                " headers TEXT,"
+                " body BLOB,"
+                " etag TEXT,"
+                " last_modified TEXT,"
+                " stored_at REAL"
+                ")"
+            )
+            self.connection.commit()
+
+    def get_key(self, method, url, params=None):
+        """
+        Return the cache key of a request: method, url without session tokens and sorted query parameters.
+        """
+        full_url = requests.Request(method, url, params=params).prepare().url
+        parts = urllib.parse.urlsplit(full_url)
+        path = parts.path
+        for pattern in self.token_patterns:
+            path = pattern.sub("<SESSION_TOKEN>", path)
+        query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+        return f"{method.upper()} {parts.scheme}://{parts.netloc}{path}?{query}"
+
+    def get_ttl(self, url):
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return None
+
+    def load(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT url, status, headers, body, etag, last_modified, stored_at FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "url": row[0],
+            "status": row[1],
+            "headers": json.loads(row[2]),
+            "body": row[3],
+            "etag": row[4],
+            "last_modified": row[5],
+            "stored_at": row[6],
+        }
+
+    def store(self, key, res):
+        headers = {
+            name: value
+            for name, value
+            in res.headers.items()
+            if name.lower() not in transport_headers
+        }
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    res.url,
+                    res.status_code,
+                    json.dumps(headers),
+                    res.content,
+                    res.headers.get("ETag"),
+                    res.headers.get("Last-Modified"),
+                    time.time(),
+                )
+            )
+            self.connection.commit()
+            self.stats["stored"] += 1
+
+    def touch(self, key):
+        with self.lock:
+            self.connection.execute("UPDATE responses SET stored_at = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+
+    def invalidate(self, patterns):
+        """
+        Remove the cached responses whose key matches one of the regular expressions, in a single pass.
+
+        It returns the number of responses removed.
+        """
+        if not patterns:
+            return 0
+        matcher = re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+        with self.lock:
+            self.connection.create_function("is_invalidated", 1, lambda key: matcher.search(key) is not None)
+            removed = self.connection.execute("DELETE FROM responses WHERE is_invalidated(key)").rowcount
+            self.connection.commit()
+        return removed
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def to_response(self, entry):
+        """
+        Rebuild a requests response from a cache entry.
+        """
+        res = requests.Response()
+        res.status_code = entry["status"]
+        res.url = entry["url"]
+        res.headers = CaseInsensitiveDict(entry["headers"])
+        res.encoding = get_encoding_from_headers(res.headers)
+        res._content = entry["body"]
+        res.reason = "OK"
+        res.from_cache = True
+        return res
+
+    def send(self, session_send, method, url, params=None, headers=None):
+        """
+        Serve a request from the cache, revalidating or fetching it with session_send(headers) when needed.
+
+        session_send sends the request to the server with the given headers and returns the response.
+        """
+        ttl = self.get_ttl(url)
+        if ttl is None or method.upper() != "GET":
+            self.count("bypassed")
+            return session_send(headers)
+
+        key = self.get_key(method, url, params)
+        entry = self.load(key)
+        if entry is not None and time.time() - entry["stored_at"] < ttl:
+            self.count("hits")
+            return self.to_response(entry)
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry["etag"]:
+                request_headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                request_headers["If-Modified-Since"] = entry["last_modified"]
+
+        res = session_send(request_headers)
+        if res.status_code == 304 and entry is not None:
+            self.count("revalidated")
+            self.touch(key)
+            return self.to_response(entry)
+
+        self.count("misses")
+        if res.status_code == 200:
+            self.store(key, res)
+        return res
+
+    def print_stats(self):
+        print("HTTP cache")
+        print(f" - Cache file  : {self.cache_file}")
+        for stat, value in self.stats.items():
+            print(f" - {stat:<11} : {value}")
+        served = self.stats["hits"] + self.stats["revalidated"]
+        requests_count = served + self.stats["misses"]
+        print(f" - hit rate    : {served / requests_count if requests_count else 0.0:.1%}")
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Shared HTTP client used by the data collectors.
+#
+# A single client keeps connections alive between requests, with a connection pool sized per host,
+# negotiates compressed responses and applies a default timeout to every request.
+# It also keeps track of how many requests reused an already open connection.
+# Optionally, the urls can be rewritten before each request, for example to insert the current session token,
+# and a request refused with 401 or 403 is retried once after renewing the credentials.
+# The GET requests can also go through a persistent response cache (see oscars_pan_finder_http_cache)
+# and the requests sent to each host can be throttled by a rate limiter (see oscars_pan_finder_rate_limiter).
+# The bytes transferred are counted per endpoint, named by (url regular expression, name) rules, and can be saved
+# to compare the transfers of two runs, for example with and without server-side field selection.
+#
+# Version: 1.1
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import datetime
+import json
+import os
+import re
+import threading
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+
+# connect and read timeout in seconds applied when the caller does not provide one
+default_timeout = (10, 300)
+
+# number of connections kept alive for hosts without a dedicated pool size
+default_pool_size = 10
+
+
+class HttpClient(requests.Session):
+    """
+    requests session with keep-alive connection pools sized per host and a default timeout.
+
+    host_pool_sizes maps a host name to the number of connections kept alive for that host.
+    url_rewriter(url) returns the url to be requested instead of url.
+    auth_refresher(url) is called when a request is refused with 401 or 403. It returns the url to retry,
+    or None if the request should not be retried.
+    cache is an optional oscars_pan_finder_http_cache.ResponseCache serving the GET requests.
+    rate_limiter is an optional oscars_pan_finder_rate_limiter.RateLimiter applied to the requests sent to the hosts.
+    endpoint_names is the list of (url regular expression, name) rules naming the endpoints in the transfer statistics,
+    the first matching rule applies. The other urls are named by their path.
+    The client can be shared by all the threads of a collector.
+    """
+
+    def __init__(
+            self,
+            host_pool_sizes=None,
+            pool_size=default_pool_size,
+            timeout=default_timeout,
+            url_rewriter=None,
+            auth_refresher=None,
+            cache=None,
+            rate_limiter=None,
+            endpoint_names=None
+    ):
+        super().__init__()
+        self.timeout = timeout
+        self.url_rewriter = url_rewriter
+        self.auth_refresher = auth_refresher
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.host_pool_sizes = dict(host_pool_sizes or {})
+        self.endpoint_names = [(re.compile(pattern), name) for pattern, name in (endpoint_names or [])]
+        self.transfers = {}
+        self.transfers_lock = threading.Lock()
+
+        # accept every compression supported by the installed urllib3 (gzip, deflate and br/zstd when available)
+        self.headers.update(make_headers(accept_encoding=True))
+
+        self.pool_adapters = []
+        default_adapter = self.create_adapter(pool_size)
+        self.mount("https://", default_adapter)
+        self.mount("http://", default_adapter)
+        for host, host_pool_size in self.host_pool_sizes.items():
+            host_adapter = self.create_adapter(host_pool_size)
+            self.mount(f"https://{host}/", host_adapter)
+            self.mount(f"http://{host}/", host_adapter)
+
+    def create_adapter(self, pool_size):
+        adapter = HTTPAdapter(
+            pool_connections=len(self.host_pool_sizes) + default_pool_size,
+            pool_maxsize=pool_size,
+        )
+        self.pool_adapters.append(adapter)
+        return adapter
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        if self.url_rewriter is not None:
+            url = self.url_rewriter(url)
+
+        if self.cache is None:
+            return self.send_request(method, url, kwargs)
+        return self.cache.send(
+            lambda headers: self.send_request(method, url, dict(kwargs, headers=headers)),
+            method,
+            url,
+            params=kwargs.get("params"),
+            headers=kwargs.get("headers"),
+        )
+
+    def send_request(self, method, url, kwargs):
+        res = self.send_limited_request(method, url, kwargs)
+
+        if res.status_code in (401, 403) and self.auth_refresher is not None:
+            retry_url = self.auth_refresher(url)
+            if retry_url:
+                res = self.send_limited_request(method, retry_url, kwargs)
+        return res
+
+    def send_limited_request(self, method, url, kwargs):
+        if self.rate_limiter is None:
+            res = requests.Session.request(self, method, url, **kwargs)
+        else:
+            res = self.rate_limiter.send(
+                urllib.parse.urlsplit(url).hostname,
+                lambda: requests.Session.request(self, method, url, **kwargs)
+            )
+        self.count_transfer(url, res)
+        return res
+
+    def get_endpoint(self, url):
+        parts = urllib.parse.urlsplit(url)
+        for pattern, name in self.endpoint_names:
+            if pattern.search(parts.path):
+                return f"{parts.hostname} {name}"
+        return f"{parts.hostname} {parts.path}"
+
+    def count_transfer(self, url, res):
+        """
+        Count the body of a response received from the network: decoded bytes and bytes read on the wire.
+        """
+        body_bytes = len(res.content or b"")
+        # the raw urllib3 response reports the bytes read before decompression
+        wire_bytes = res.raw.tell() if hasattr(res.raw, "tell") else body_bytes
+        endpoint = self.get_endpoint(url)
+        with self.transfers_lock:
+            transfer = self.transfers.setdefault(endpoint, {"requests": 0, "bytes": 0, "wire_bytes": 0})
+            transfer["requests"] += 1
+            transfer["bytes"] += body_bytes
+            transfer["wire_bytes"] += wire_bytes
+
+    def transfer_stats(self):
+        """
+        Return, per endpoint, the number of responses received from the network and their size in bytes.
+        """
+        with self.transfers_lock:
+            return {endpoint: dict(transfer) for endpoint, transfer in self.transfers.items()}
+
+    def connection_stats(self):
+        """
+        Return, per host, the number of requests sent and of new connections opened.
+
+        Every request that did not open a new connection reused one kept alive in the pool.
+        """
+        stats = {}
+        for adapter in self.pool_adapters:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host_stats = stats.setdefault(pool.host, {"requests": 0, "connections": 0})
+                host_stats["requests"] += pool.num_requests
+                host_stats["connections"] += pool.num_connections
+
+        for host_stats in stats.values():
+            reused = max(0, host_stats["requests"] - host_stats["connections"])
+            host_stats["reuse_rate"] = reused / host_stats["requests"] if host_stats["requests"] else 0.0
+        return stats
+
+    def print_connection_stats(self):
+        print("HTTP connections")
+        stats = self.connection_stats()
+        if not stats:
+            print(" - no requests sent")
+        for host, host_stats in sorted(stats.items()):
+            print(
+                f" - {host:<24} : {host_stats['requests']} requests,"
+                f" {host_stats['connections']} connections,"
+                f" reuse rate {host_stats['reuse_rate']:.1%}"
+            )
+
+    def print_transfer_stats(self, baseline=None, baseline_label="baseline"):
+        """
+        Print the bytes transferred per endpoint, compared per request with the transfer statistics baseline if any.
+        """
+        print("HTTP transfers")
+        stats = self.transfer_stats()
+        if not stats:
+            print(" - no responses received")
+        for endpoint, transfer in sorted(stats.items()):
+            bytes_per_request = transfer["bytes"] / transfer["requests"]
+            print(
+                f" - {endpoint:<48} : {transfer['requests']} requests,"
+                f" {transfer['bytes']} bytes, {transfer['wire_bytes']} bytes on the wire,"
+                f" {bytes_per_request:.0f} bytes per request"
+            )
+            baseline_transfer = (baseline or {}).get(endpoint)
+            if baseline_transfer and baseline_transfer["requests"]:
+                baseline_bytes_per_request = baseline_transfer["bytes"] / baseline_transfer["requests"]
+                change = bytes_per_request / baseline_bytes_per_request - 1 if baseline_bytes_per_request else 0.0
+                print(
+                    f"   {baseline_label:<48} : {baseline_transfer['requests']} requests,"
+                    f" {baseline_transfer['bytes']} bytes, {baseline_bytes_per_request:.0f} bytes per request,"
+                    f" change per request {change:+.1%}"
+                )
+
+    def print_stats(self, transfer_baseline=None, transfer_baseline_label="baseline"):
+        self.print_connection_stats()
+        self.print_transfer_stats(transfer_baseline, transfer_baseline_label)
+        if self.rate_limiter is not None:
+            self.rate_limiter.print_stats()
+        if self.cache is not None:
+            self.cache.print_stats()
+
+
+def load_transfer_stats(stats_file):
+    """
+    Return the transfer statistics saved in stats_file, per run label, or an empty dict if the file does not exist.
+    """
+    if not os.path.exists(stats_file):
+        return {}
+    with open(stats_file) as fh:
+        return json.load(fh)
+
+
+def save_transfer_stats(stats_file, label, stats):
+    """
+    Save the transfer statistics of a run under label, replacing the previous run saved with the same label.
+    """
+    runs = load_transfer_stats(stats_file)
+    runs[label] = {"saved_at": datetime.datetime.now().isoformat(), "endpoints": stats}
+    os.makedirs(os.path.dirname(os.path.abspath(stats_file)), exist_ok=True)
+    temp_file = f"{stats_file}.{os.getpid()}.tmp"
+    with open(temp_file, "w") as fh:
+        json.dump(runs, fh, indent=2)
+    os.replace(temp_file, stats_file)
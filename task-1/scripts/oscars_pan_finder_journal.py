@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Journal of a harvest of publications.
+#
+# The journal is a SQLite file saved in the output folder, named esrf_journal.sqlite.
+# It records the state of each DOI of the harvest: pending, in-flight, done or failed, with the class and
+# the message of the error for the failed ones. It is updated as soon as a DOI changes state, so that a run
+# that crashed can be resumed and the failed DOIs can be collected again without walking the full list.
+#
+# Usage: oscars_pan_finder_journal
+#   -f, --folder = Output folder of the harvest. Default="../data/esrf/"
+#   -s, --state = Print the DOIs in this state: pending, in-flight, done or failed
+#
+# Version: 1.0
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+journal_file_name = "esrf_journal.sqlite"
+
+# states of a DOI
+pending = "pending"
+in_flight = "in-flight"
+done = "done"
+failed = "failed"
+states = [pending, in_flight, done, failed]
+
+
+class Journal:
+    """
+    State of each DOI of the harvests run on an output folder.
+
+    The journal is written by the process driving the harvest only, the workers report to it.
+    """
+
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+        self.journal_file = os.path.join(self.folder, journal_file_name)
+        self.lock = threading.Lock()
+
+        os.makedirs(self.folder, exist_ok=True)
+        self.connection = sqlite3.connect(self.journal_file, timeout=60, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS dois ("
+                " doi TEXT PRIMARY KEY,"
+                " state TEXT,"
+                " error_class TEXT,"
+                " error_message TEXT,"
+                " attempts INTEGER,"
+                " updated_at TEXT"
+                ")"
+            )
+            self.connection.commit()
+
+    def add_pending(self, dois):
+        """
+        Add the DOIs not yet in the journal as pending.
+        """
+        now = datetime.datetime.now().isoformat()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO dois VALUES (?, ?, NULL, NULL, 0, ?)",
+                [(doi, pending, now) for doi in dois]
+            )
+            self.connection.commit()
+
+    def resume(self):
+        """
+        Set back to pending the DOIs left in flight by a run that did not complete, and return their number.
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE dois SET state = ?, updated_at = ? WHERE state = ?",
+                (pending, datetime.datetime.now().isoformat(), in_flight)
+            )
+            self.connection.commit()
+            return cursor.rowcount
+
+    def set_in_flight(self, doi):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE dois SET state = ?, attempts = attempts + 1, updated_at = ? WHERE doi = ?",
+                (in_flight, datetime.datetime.now().isoformat(), doi)
+            )
+            self.connection.commit()
+
+    def set_done(self, doi):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE dois SET state = ?, error_class = NULL, error_message = NULL, updated_at = ? WHERE doi = ?",
+                (done, datetime.datetime.now().isoformat(), doi)
+            )
+            self.connection.commit()
+
+    def set_failed(self, doi, error_class, error_message):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE dois SET state = ?, error_class = ?, error_message = ?, updated_at = ? WHERE doi = ?",
+                (failed, error_class, error_message, datetime.datetime.now().isoformat(), doi)
+            )
+            self.connection.commit()
+
+    def get_dois(self, state):
+        with self.lock:
+            return [
+                row[0]
+                for row
+                in self.connection.execute("SELECT doi FROM dois WHERE state = ? ORDER BY doi", (state,))
+            ]
+
+    def get_errors(self):
+        """
+        Return the class and message of the error of each failed DOI.
+        """
+        with self.lock:
+            return {
+                row[0]: {"error_class": row[1], "error_message": row[2], "attempts": row[3]}
+                for row
+                in self.connection.execute(
+                    "SELECT doi, error_class, error_message, attempts FROM dois WHERE state = ? ORDER BY doi",
+                    (failed,)
+                )
+            }
+
+    def count_states(self):
+        with self.lock:
+            counts = dict(self.connection.execute("SELECT state, COUNT(*) FROM dois GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in states}
+
+    def print_states(self):
+        print("Harvest journal")
+        print(f" - Journal file : {self.journal_file}")
+        for state, count in self.count_states().items():
+            print(f" - {state:<12} : {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-f","--folder",
+        help="Output folder of the harvest.",
+        dest="folder",
+        default="../data/esrf/",
+        type=str
+    )
+    parser.add_argument(
+        "-s","--state",
+        help="Print the DOIs in this state.",
+        dest="state",
+        choices=states,
+        default=None,
+        type=str
+    )
+    args = parser.parse_args()
+
+    journal = Journal(args.folder)
+    journal.print_states()
+    if args.state == failed:
+        print(json.dumps(journal.get_errors(), indent=2))
+    elif args.state:
+        print(json.dumps(journal.get_dois(args.state), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Streaming writer and reader of the output files of the data collectors.
+#
+# The writer appends each finished record to a temporary file, as one json line (JSONL) or as the next
+# element of a json array, and flushes it to disk periodically. When the writer is closed, the temporary
+# file is renamed to the output file, so the output file is either complete or absent. If the collection
+# crashes, the records already written are kept in the temporary file.
+# The format is chosen from the extension of the output file: .jsonl for JSONL, .jsonl.gz for the seekable
+# compressed JSONL of oscars_pan_finder_seekable.py, json array otherwise. The records are read the same way
+# from the three formats, and from the .json.zip files of the data folder, one record at a time: the json arrays
+# are parsed incrementally, so the memory used does not depend on the size of the file.
+#
+# Used as a script, it converts a JSONL or seekable file to the json array format expected by the existing consumers.
+#
+# Usage: oscars_pan_finder_jsonl
+#   -i, --input-file = JSONL file to be converted
+#   -o, --output-file = Json array file. Default: input file with the .json extension
+#
+# Version: 1.2
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import argparse
+import datetime
+import io
+import json
+import os
+import time
+import zipfile
+
+import oscars_pan_finder_seekable as seekable
+jsonl_extension = ".jsonl"
+
+# the records are flushed to disk every flush_records records or every flush_seconds seconds
+default_flush_records = 100
+default_flush_seconds = 30
+
+# characters read at a time from a json array file
+default_read_size = 65536
+
+
+def is_jsonl_file(file_name):
+    return file_name.endswith(jsonl_extension)
+
+
+def get_file_format(file_name):
+    if seekable.is_seekable_file(file_name):
+        return "seekable"
+    return "jsonl" if is_jsonl_file(file_name) else "json"
+
+
+class JsonlWriter:
+    """
+    Write records one by one to output_file, through a temporary file renamed when the writer is closed.
+
+    The records are written as JSONL if output_file ends with .jsonl, as a json array otherwise,
+    unless array is given.
+    """
+
+    def __init__(
+            self,
+            output_file,
+            array=None,
+            flush_records=default_flush_records,
+            flush_seconds=default_flush_seconds
+    ):
+        self.output_file = os.path.abspath(output_file)
+        self.array = not is_jsonl_file(output_file) if array is None else array
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.temp_file = f"{self.output_file}.{os.getpid()}.tmp"
+        self.number_of_records = 0
+        self.pending_records = 0
+        self.flushed_at = time.monotonic()
+
+        os.makedirs(os.path.dirname(self.output_file), exist_ok=True)
+        self.fh = open(self.temp_file, "w")
+        if self.array:
+            self.fh.write("[")
+
+    def write(self, record):
+        if self.array:
+            if self.number_of_records:
+                # same separator as json.dump of a list
+                self.fh.write(", ")
+            json.dump(record, self.fh)
+        else:
+            self.fh.write(json.dumps(record) + "\n")
+        self.number_of_records += 1
+        self.pending_records += 1
+        if self.pending_records >= self.flush_records or time.monotonic() - self.flushed_at >= self.flush_seconds:
+            self.flush()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+        return self.number_of_records
+
+    def flush(self):
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+        self.pending_records = 0
+        self.flushed_at = time.monotonic()
+
+    def close(self):
+        """
+        Complete the output file, it replaces the previous file with the same name.
+        """
+        if self.array:
+            self.fh.write("]")
+        self.flush()
+        self.fh.close()
+        os.replace(self.temp_file, self.output_file)
+
+    def discard(self):
+        """
+        Remove the temporary file, the output file is left untouched.
+        """
+        self.fh.close()
+        os.remove(self.temp_file)
+
+    def abort(self):
+        """
+        Keep the records already written in the temporary file, the output file is left untouched.
+        """
+        self.flush()
+        self.fh.close()
+        print(f" - {self.number_of_records} records written before the error kept in {self.temp_file}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.fh.closed:
+            return False
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def open_writer(output_file):
+    """
+    Return the writer of the format given by the extension of output_file.
+    """
+    if seekable.is_seekable_file(output_file):
+        return seekable.SeekableWriter(output_file)
+    return JsonlWriter(output_file)
+
+
+def save_records(output_file, records):
+    """
+    Save the records in output_file, in the format given by its extension, and return their number.
+    """
+    with open_writer(output_file) as writer:
+        return writer.write_all(records)
+
+
+def iterate_json_array(fh, read_size=default_read_size):
+    """
+    Yield the elements of the json array read from the text file fh one at a time, keeping a single element
+    and the characters read ahead in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    is_eof = False
+    expected = "["
+
+    def read_more():
+        nonlocal buffer, position, is_eof
+        if is_eof:
+            raise ValueError(f"Incomplete json array, expected {expected}")
+        # an element larger than read_size doubles the size of the next read
+        chunk = fh.read(max(read_size, len(buffer) - position))
+        is_eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            read_more()
+            continue
+        char = buffer[position]
+        if expected == "[":
+            if char != "[":
+                raise ValueError("The file does not contain a json array")
+            position += 1
+            expected = "element or ]"
+        elif expected in ["element or ]", ", or ]"] and char == "]":
+            return
+        elif expected == ", or ]":
+            if char != ",":
+                raise ValueError(f"Invalid json array, expected , or ] and found {char}")
+            position += 1
+            expected = "element"
+        else:
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                read_more()
+                continue
+            if (
+                    isinstance(element, (int, float))
+                    and not is_eof
+                    and (end == len(buffer) or buffer[end] not in ",]" and not buffer[end].isspace())
+            ):
+                # the number may continue in the characters not read yet
+                read_more()
+                continue
+            yield element
+            position = end
+            expected = ", or ]"
+
+
+def iterate_records(input_file):
+    """
+    Yield the records of a JSONL, seekable, json array or zipped json array file.
+    """
+    if seekable.is_seekable_file(input_file):
+        yield from seekable.iterate_records(input_file)
+    elif input_file.endswith(".zip"):
+        # the json array is the first file of the zip archive, as in the .json.zip files of the data folder
+        with zipfile.ZipFile(input_file) as zip_file:
+            with zip_file.open(zip_file.namelist()[0]) as fh:
+                yield from iterate_json_array(io.TextIOWrapper(fh, encoding="utf-8"))
+    elif is_jsonl_file(input_file):
+        with open(input_file) as fh:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(input_file) as fh:
+            yield from iterate_json_array(fh)
+
+
+def load_records(input_file):
+    return list(iterate_records(input_file))
+
+
+def convert_to_json_array(input_file, output_file):
+    """
+    Convert a JSONL or seekable file to a json array file, one record at a time, and return the number of records.
+    """
+    with JsonlWriter(output_file, array=True) as writer:
+        return writer.write_all(iterate_records(input_file))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i","--input-file",
+        help="JSONL file to be converted",
+        dest="input_file",
+        required=True,
+        type=str
+    )
+    parser.add_argument(
+        "-o","--output-file",
+        help="Json array file. Default: input file with the .json extension",
+        dest="output_file",
+        default=None,
+        type=str
+    )
+    args = parser.parse_args()
+    input_file = os.path.abspath(args.input_file)
+    output_file = os.path.abspath(args.output_file or os.path.splitext(args.input_file)[0] + ".json")
+
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_jsonl - BEGIN")
+    print(datetime.datetime.now().isoformat())
+    print(f" - Input File  : {input_file}")
+    print(f" - Output File : {output_file}")
+    number_of_records = convert_to_json_array(input_file, output_file)
+    print(f" - Records     : {number_of_records}")
+    print(datetime.datetime.now().isoformat())
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_jsonl - END")
+
+
+if __name__ == "__main__":
+    main()
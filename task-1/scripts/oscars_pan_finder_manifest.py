@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Manifest of the entries already collected in an output folder.
+#
+# The manifest is a SQLite file saved in the output folder, named esrf_manifest.sqlite.
+# It maps the name of each output file to the DOI, path, status, size, content hash and time of the entry,
+# so that checking if a DOI has already been collected does not need to scan the whole folder.
+# If the manifest is missing, or with the --rebuild option, it is rebuilt from the files of the folder in a single pass.
+#
+# The content hash is the sha256 of the canonical json of the entry: sorted keys, no whitespace.
+# An entry whose hash matches the stored one is not written again, and each entry added, changed or removed
+# is recorded in the changes table, so that the downstream processing can work on the real changes only.
+# The entries saved together in a single snapshot file, as the SciCat collectors do, are recorded with
+# their key in place of the file name.
+#
+# Usage: oscars_pan_finder_manifest
+#   -f, --folder = Output folder of the collected entries. Default="../data/esrf/"
+#   -r, --rebuild = Rebuild the manifest from the files present in the folder
+#   -c, --changes-since = Print the entries added, changed or removed since this ISO time
+#
+# Version: 1.1
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+manifest_file_name = "esrf_manifest.sqlite"
+
+# prefixes of the output files indexed when the manifest is rebuilt
+entry_file_prefixes = ["esrf_publication_", "esrf_document_"]
+
+# one manifest per process and folder, the sqlite connections can not be shared with forked processes
+manifests = {}
+manifests_lock = threading.Lock()
+
+
+# kinds of change recorded in the changes table
+added = "added"
+changed = "changed"
+removed = "removed"
+change_fields = ["file_name", "doi", "change", "content_hash", "changed_at"]
+
+
+def get_content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_entry_hash(entry):
+    """
+    Return the content hash of an entry, independent of the order of its keys.
+    """
+    return get_content_hash(json.dumps(entry, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+
+
+def get_file_hash(file_path):
+    """
+    Return the size and the content hash of the entry saved in a json file.
+    """
+    with open(file_path, "rb") as fh:
+        data = fh.read()
+    return len(data), get_entry_hash(json.loads(data))
+
+
+class Manifest:
+    """
+    Index of the entries saved in an output folder, keyed by the name of their file.
+    """
+
+    def __init__(self, folder, file_name=manifest_file_name, file_prefixes=None):
+        self.folder = os.path.abspath(folder)
+        self.manifest_file = os.path.join(self.folder, file_name)
+        self.file_prefixes = entry_file_prefixes if file_prefixes is None else file_prefixes
+        self.lock = threading.Lock()
+
+        os.makedirs(self.folder, exist_ok=True)
+        is_new = not os.path.exists(self.manifest_file)
+        self.connection = sqlite3.connect(self.manifest_file, timeout=60, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " file_name TEXT PRIMARY KEY,"
+                " doi TEXT,"
+                " path TEXT,"
+                " status TEXT,"
+                " size INTEGER,"
+                " content_hash TEXT,"
+                " updated_at TEXT"
+                ")"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS changes ("
+                " file_name TEXT,"
+                " doi TEXT,"
+                " change TEXT,"
+                " content_hash TEXT,"
+                " changed_at TEXT"
+                ")"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS changes_changed_at ON changes (changed_at)")
+            self.connection.commit()
+        if is_new:
+            self.rebuild()
+
+    def get(self, file_name):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT file_name, doi, path, status, size, content_hash, updated_at FROM entries WHERE file_name = ?",
+                (file_name,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(["file_name", "doi", "path", "status", "size", "content_hash", "updated_at"], row))
+
+    def is_done(self, file_name):
+        """
+        Return True if the entry saved in file_name has been collected and its file is still present.
+        """
+        entry = self.get(file_name)
+        if entry is None or entry["status"] != "done":
+            return False
+        if not os.path.exists(entry["path"]):
+            # the file has been removed since, for example by the collection bash script,
+            # its content hash is kept to detect if the entry collected again has changed
+            self.set_status(file_name, "missing")
+            return False
+        return True
+
+    def record(self, file_name, doi, data, content_hash, status="done"):
+        """
+        Record the entry of doi, whose content data (bytes) has been saved in file_name.
+        """
+        self.write_rows([self.get_row(file_name, doi, len(data), content_hash, status)])
+
+    def save_entry(self, file_name, doi, entry):
+        """
+        Save entry in file_name and record it, unless its content hash matches the stored one.
+
+        It returns True if the entry is new or has changed.
+        """
+        content_hash = get_entry_hash(entry)
+        previous = self.get(file_name)
+        is_changed = previous is None or previous["content_hash"] != content_hash
+        file_path = os.path.join(self.folder, file_name)
+        if is_changed or not os.path.exists(file_path):
+            data = json.dumps(entry).encode("utf-8")
+            # written through a temporary file, an interrupted run never leaves a truncated entry file
+            temp_file = f"{file_path}.{os.getpid()}.tmp"
+            with open(temp_file, 'wb') as fh:
+                fh.write(data)
+            os.replace(temp_file, file_path)
+            self.record(file_name, doi, data, content_hash)
+        else:
+            self.set_status(file_name, "done")
+        if is_changed:
+            self.add_changes([(file_name, doi, changed if previous else added, content_hash)])
+        return is_changed
+
+    def get_snapshot_changes(self, entry_hashes):
+        """
+        Return the changes of the entries saved together in a snapshot file since the previous snapshot.
+
+        entry_hashes maps the key of each entry to its DOI and content hash. The entries of the previous
+        snapshot missing from entry_hashes are removed.
+        """
+        with self.lock:
+            previous_hashes = dict(self.connection.execute("SELECT file_name, content_hash FROM entries").fetchall())
+        changes = [
+            (key, doi, changed if key in previous_hashes else added, content_hash)
+            for key, (doi, content_hash)
+            in entry_hashes.items()
+            if previous_hashes.get(key) != content_hash
+        ]
+        changes += [(key, None, removed, None) for key in previous_hashes if key not in entry_hashes]
+        return changes
+
+    def save_snapshot_entries(self, entry_hashes, snapshot_file, changes):
+        """
+        Record the entries saved together in snapshot_file and their changes, returned as dicts.
+        """
+        now = datetime.datetime.now().isoformat()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, NULL, ?, ?)",
+                [
+                    (key, doi, os.path.abspath(snapshot_file), "done", content_hash, now)
+                    for key, (doi, content_hash)
+                    in entry_hashes.items()
+                ]
+            )
+            self.connection.executemany(
+                "DELETE FROM entries WHERE file_name = ?",
+                [(change[0],) for change in changes if change[2] == removed]
+            )
+            self.connection.commit()
+        return self.add_changes(changes)
+
+    def add_changes(self, changes):
+        """
+        Record the changes, (file_name, doi, change, content_hash) tuples, and return them as dicts.
+        """
+        now = datetime.datetime.now().isoformat()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT INTO changes VALUES (?, ?, ?, ?, ?)",
+                [change + (now,) for change in changes]
+            )
+            self.connection.commit()
+        return [dict(zip(change_fields, change + (now,))) for change in changes]
+
+    def get_changes(self, since):
+        """
+        Return the entries added, changed or removed since the given ISO time, in the order of the changes.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT file_name, doi, change, content_hash, changed_at FROM changes"
+                " WHERE changed_at >= ? ORDER BY changed_at, rowid",
+                (since,)
+            ).fetchall()
+        return [dict(zip(change_fields, row)) for row in rows]
+
+    def set_status(self, file_name, status):
+        with self.lock:
+            self.connection.execute("UPDATE entries SET status = ? WHERE file_name = ?", (status, file_name))
+            self.connection.commit()
+
+    def get_row(self, file_name, doi, size, content_hash, status):
+        return (
+            file_name,
+            doi,
+            os.path.join(self.folder, file_name),
+            status,
+            size,
+            content_hash,
+            datetime.datetime.now().isoformat(),
+        )
+
+    def write_rows(self, rows):
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.commit()
+
+    def remove(self, file_name):
+        with self.lock:
+            self.connection.execute("DELETE FROM entries WHERE file_name = ?", (file_name,))
+            self.connection.commit()
+
+    def iterate_files(self, file_prefix, status="done", batch_size=1000):
+        """
+        Yield the name and path of the entries whose file name starts with file_prefix, ordered by file name.
+
+        The entries are read batch_size rows at a time, so the whole manifest is never loaded in memory.
+        """
+        last_file_name = ""
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT file_name, path FROM entries"
+                    " WHERE file_name > ? AND substr(file_name, 1, ?) = ? AND status = ?"
+                    " ORDER BY file_name LIMIT ?",
+                    (last_file_name, len(file_prefix), file_prefix, status, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_file_name = rows[-1][0]
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def rebuild(self):
+        """
+        Replace the content of the manifest with the entry files present in the folder, in a single pass.
+
+        The DOI is not known from the file name only, it is left empty until the entry is collected again.
+        The files that can not be read or are not valid json, for example truncated by an interrupted run,
+        are recorded as failed, without content hash, and collected again.
+        """
+        print("rebuild manifest - BEGIN")
+        print(f" - Folder : {self.folder}")
+        with self.lock:
+            self.connection.execute("DELETE FROM entries")
+            self.connection.commit()
+
+        batch = []
+        number_of_entries = 0
+        number_of_failed = 0
+        with os.scandir(self.folder) as folder_entries:
+            for folder_entry in folder_entries:
+                if not folder_entry.is_file() or not folder_entry.name.endswith(".json"):
+                    continue
+                if not any(folder_entry.name.startswith(prefix) for prefix in self.file_prefixes):
+                    continue
+                try:
+                    size, content_hash = get_file_hash(folder_entry.path)
+                    batch.append(self.get_row(folder_entry.name, None, size, content_hash, "done"))
+                except (OSError, ValueError) as e:
+                    print(f" - Entry file {folder_entry.name} can not be read, recorded as failed: {e}")
+                    batch.append(self.get_row(folder_entry.name, None, None, None, "failed"))
+                    number_of_failed += 1
+                if len(batch) == 1000:
+                    self.write_rows(batch)
+                    number_of_entries += len(batch)
+                    batch = []
+        self.write_rows(batch)
+        number_of_entries += len(batch)
+
+        print(f" - Number of entries : {number_of_entries}")
+        print(f" - Failed entries    : {number_of_failed}")
+        print("rebuild manifest - END")
+        return number_of_entries
+
+
+def get_manifest(folder, file_name=manifest_file_name, file_prefixes=None):
+    """
+    Return the manifest of the folder, shared by all the threads of this process.
+    """
+    key = (os.getpid(), os.path.abspath(folder), file_name)
+    with manifests_lock:
+        if key not in manifests:
+            manifests[key] = Manifest(folder, file_name, file_prefixes)
+        return manifests[key]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-f","--folder",
+        help="Output folder of the collected entries.",
+        dest="folder",
+        default="../data/esrf/",
+        type=str
+    )
+    parser.add_argument(
+        "-r","--rebuild",
+        help="Rebuild the manifest from the files present in the folder",
+        dest="rebuild",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-c","--changes-since",
+        help="Print the entries added, changed or removed since this ISO time",
+        dest="changes_since",
+        default=None,
+        type=str
+    )
+    args = parser.parse_args()
+
+    manifest = get_manifest(args.folder)
+    if args.rebuild:
+        manifest.rebuild()
+    print(f"Manifest file     : {manifest.manifest_file}")
+    print(f"Number of entries : {manifest.count()}")
+    if args.changes_since:
+        print(json.dumps(manifest.get_changes(args.changes_since), indent=2))
+
+
+if __name__ == "__main__":
+    main()
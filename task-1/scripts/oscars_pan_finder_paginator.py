@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Windowed pagination used by the data collectors to list all the entries of an endpoint.
+#
+# Once the total number of entries is known, the disjoint skip/limit windows are requested concurrently
+# with bounded parallelism. The pages are then reassembled in the order of the windows, which is the sort
+# order of the endpoint, and the entries are deduplicated by their key.
+# When the total is not known, the pages are requested one after the other until a short page comes back.
+#
+# Version: 1.0
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import concurrent.futures
+
+# number of windows requested at the same time
+default_workers = 4
+
+
+def collect_sequentially(fetch_window, batch_limit, skip=0):
+    """
+    Request one page after the other until a short page comes back.
+
+    fetch_window(skip, limit) returns the list of entries of one page.
+    """
+    entries = []
+    keep_going = True
+    while keep_going:
+        current_batch = fetch_window(skip, batch_limit)
+        keep_going = len(current_batch) == batch_limit
+        entries += current_batch
+        print(".", end="", flush=True)
+        skip += len(current_batch)
+    return entries
+
+
+def get_page_total(page):
+    """
+    Return the total number of entries reported in the meta section of a page of ICAT+ entries, if any.
+    """
+    try:
+        return int(page[0]["meta"]["page"]["total"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def deduplicate(entries, key):
+    """
+    Remove the entries with a key already seen, keeping the first occurrence.
+
+    Entries without a key are always kept.
+    """
+    seen = set()
+    output = []
+    for entry in entries:
+        entry_key = key(entry)
+        if entry_key is not None:
+            if entry_key in seen:
+                continue
+            seen.add(entry_key)
+        output.append(entry)
+    return output
+
+
+def collect_all(fetch_window, total, batch_limit, workers=default_workers, initial_skip=0, key=None, first_page=None):
+    """
+    Request all the skip/limit windows of an endpoint concurrently and return its entries in sort order.
+
+    fetch_window(skip, limit) returns the list of entries of one page, total is the number of entries
+    reported by the endpoint and key(entry) returns the identifier used to deduplicate the entries.
+    first_page is the page starting at initial_skip when it has already been retrieved to learn the total.
+    If the total is unknown, the pages are requested sequentially.
+    If the last window is full, the endpoint has grown in the meantime and the remaining pages are
+    requested sequentially.
+    """
+    if total is None:
+        entries = list(first_page or [])
+        if first_page is None or len(first_page) == batch_limit:
+            entries += collect_sequentially(fetch_window, batch_limit, initial_skip + len(entries))
+        return deduplicate(entries, key) if key else entries
+
+    skips = list(range(initial_skip, max(total, initial_skip + 1), batch_limit))
+    pages = {}
+    if first_page is not None and skips:
+        pages[skips[0]] = first_page
+    remaining = [skip for skip in skips if skip not in pages]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(fetch_window, skip, batch_limit): skip
+            for skip
+            in remaining
+        }
+        for future in concurrent.futures.as_completed(futures):
+            pages[futures[future]] = future.result()
+            print(".", end="", flush=True)
+
+    entries = []
+    for skip in skips:
+        entries += pages[skip]
+
+    last_skip = skips[-1]
+    if len(pages[last_skip]) == batch_limit:
+        entries += collect_sequentially(fetch_window, batch_limit, last_skip + batch_limit)
+
+    return deduplicate(entries, key) if key else entries
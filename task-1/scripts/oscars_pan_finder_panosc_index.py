@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Index by DOI of the PaNOSC documents saved in a file, such as ../data/esrf/oscars_pan_finder_esrf_panosc_documents.json,
+# or of the publications saved in ../data/esrf/oscars_pan_finder_esrf_publications.json
+#
+# The entry and publication collectors run once per DOI and need only the document of their DOI. Instead of parsing the
+# whole file at each run, the documents are indexed once:
+# - in memory, for the collections running in a single process, such as the harvester with the thread or
+#   process executors
+# - in a SQLite file saved next to the input file, <input file>.doi_index.sqlite, for the collections running
+#   one process per DOI. The index records the size and modification time of the input file and it is rebuilt
+#   when the input file changes.
+# The seekable files of oscars_pan_finder_seekable.py are read through their own index.
+# The index, or the seekable reader, is opened once per process and input file and shared by all the lookups.
+#
+# Usage: oscars_pan_finder_panosc_index
+#   -i, --input-file = File with the PaNOSC documents. Default="../data/esrf/oscars_pan_finder_esrf_panosc_documents.json"
+#   -d, --doi = DOI of the document to be printed
+#
+# Version: 1.2
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+import oscars_pan_finder_jsonl as jsonl
+import oscars_pan_finder_seekable as seekable
+
+default_input_file = "../data/esrf/oscars_pan_finder_esrf_panosc_documents.json"
+index_suffix = ".doi_index.sqlite"
+document_key = "doi"
+
+# one index or seekable reader per process and input file
+memory_indexes = {}
+file_indexes = {}
+seekable_readers = {}
+indexes_lock = threading.Lock()
+
+
+def get_file_signature(input_file):
+    stat = os.stat(input_file)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_memory_index(input_file):
+    """
+    Return the documents of input_file keyed by their DOI, the first document wins when a DOI is repeated.
+    """
+    index = {}
+    for document in jsonl.iterate_records(input_file):
+        index.setdefault(document.get(document_key), document)
+    return index
+
+
+class PanoscIndex:
+    """
+    SQLite index of the documents of a PaNOSC input file, keyed by their DOI.
+    """
+
+    def __init__(self, input_file):
+        self.input_file = os.path.abspath(input_file)
+        self.index_file = self.input_file + index_suffix
+        if not self.is_current():
+            self.build()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(f"file:{self.index_file}?mode=ro", uri=True, check_same_thread=False)
+
+    def is_current(self):
+        if not os.path.exists(self.index_file):
+            return False
+        try:
+            connection = sqlite3.connect(f"file:{self.index_file}?mode=ro", uri=True)
+            try:
+                row = connection.execute("SELECT size, mtime_ns FROM source").fetchone()
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            return False
+        return row is not None and tuple(row) == get_file_signature(self.input_file)
+
+    def build(self):
+        """
+        Index the documents of the input file in a single pass, through a temporary file renamed once complete.
+        """
+        print(f"Building PaNOSC index {self.index_file}")
+        signature = get_file_signature(self.input_file)
+        temp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        connection = sqlite3.connect(temp_file)
+        connection.execute("CREATE TABLE source (size INTEGER, mtime_ns INTEGER)")
+        connection.execute("INSERT INTO source VALUES (?, ?)", signature)
+        connection.execute("CREATE TABLE documents (doi TEXT PRIMARY KEY, document TEXT)")
+        batch = []
+        number_of_documents = 0
+        for document in jsonl.iterate_records(self.input_file):
+            if not isinstance(document.get(document_key), str):
+                continue
+            batch.append((document[document_key], json.dumps(document)))
+            if len(batch) == 1000:
+                connection.executemany("INSERT OR IGNORE INTO documents VALUES (?, ?)", batch)
+                number_of_documents += len(batch)
+                batch = []
+        connection.executemany("INSERT OR IGNORE INTO documents VALUES (?, ?)", batch)
+        number_of_documents += len(batch)
+        connection.commit()
+        connection.close()
+        os.replace(temp_file, self.index_file)
+        print(f" - Documents indexed : {number_of_documents}")
+
+    def get(self, doi):
+        with self.lock:
+            row = self.connection.execute("SELECT document FROM documents WHERE doi = ?", (doi,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+def get_seekable_reader(input_file):
+    key = (os.getpid(), os.path.abspath(input_file))
+    with indexes_lock:
+        if key not in seekable_readers:
+            seekable_readers[key] = seekable.SeekableReader(input_file, shared=True)
+        return seekable_readers[key]
+
+
+def get_memory_index(input_file):
+    key = (os.getpid(), os.path.abspath(input_file))
+    with indexes_lock:
+        if key not in memory_indexes:
+            memory_indexes[key] = build_memory_index(input_file)
+        return memory_indexes[key]
+
+
+def get_file_index(input_file):
+    key = (os.getpid(), os.path.abspath(input_file))
+    with indexes_lock:
+        if key not in file_indexes:
+            file_indexes[key] = PanoscIndex(input_file)
+        return file_indexes[key]
+
+
+def get_panosc_entry(input_file, doi, in_memory=False):
+    """
+    Return the PaNOSC document of doi saved in input_file, or None if it is not there.
+
+    With in_memory, the documents are indexed in memory, once per process, otherwise in the SQLite index.
+    Seekable files are always read through their own index.
+    """
+    if seekable.is_seekable_file(input_file):
+        records = get_seekable_reader(input_file).get_records(doi)
+        return next((record for record in records if record.get(document_key) == doi), None)
+    if in_memory:
+        return get_memory_index(input_file).get(doi)
+    return get_file_index(input_file).get(doi)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i","--input-file",
+        help="File with the PaNOSC documents",
+        dest="input_file",
+        default=default_input_file,
+        type=str
+    )
+    parser.add_argument(
+        "-d","--doi",
+        help="DOI of the document to be printed",
+        dest="doi",
+        default=None,
+        type=str
+    )
+    args = parser.parse_args()
+
+    index = get_file_index(args.input_file)
+    print(f"Input file : {index.input_file}")
+    print(f"Index file : {index.index_file}")
+    if args.doi:
+        print(json.dumps(index.get(args.doi), indent=2))
+
+
+if __name__ == "__main__":
+    main()
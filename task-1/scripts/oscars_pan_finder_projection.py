@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Projection of the records retrieved from the data providers.
+#
+# The fields kept from each type of record are declared once, in the settings of the data provider, as:
+#   {"<record type>": {"keep": [<fields>]} or {"drop": [<fields>]}, "nested": {"<field>": "<record type>"}}
+# "keep" lists the only fields kept, "drop" the fields removed, the fields missing in a record are ignored.
+# "nested" projects the record, or the list of records, of a field with the projection of another record type.
+# Each declaration is compiled once into a projector, a function building the projected record in a single pass,
+# without intermediate copies. The order of the fields of the record is preserved.
+# The records of a nested list must be dicts, as the parameters of the datasets and samples.
+#
+# Run as a script, it compares the projectors with the previous remove_fields/extract_fields helpers of the ESRF
+# collectors on the responses recorded in the ESRF HTTP cache, or on generated records when the cache is empty.
+#
+# Usage: oscars_pan_finder_projection
+#   -C, --http-cache-file = SQLite file with the recorded ESRF responses. Default="../data/esrf/esrf_http_cache.sqlite"
+#   -n, --repetitions = Number of times each payload is projected. Default=20
+#   -g, --generated-records = Number of records of each type generated when no response is recorded. Default=1000
+#
+# Version: 1.0
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import time
+import urllib.parse
+
+default_repetitions = 20
+default_generated_records = 1000
+
+
+def compile_projection(projections, record_type):
+    """
+    Return the projector of record_type: a function returning a new dict with the fields of the record selected
+    by its declaration in projections, and with its nested records projected.
+
+    The projector is generated as the source code of a function dedicated to the declaration: the record is copied
+    once and each dropped field is removed with its own statement, without any loop on the declared fields.
+    """
+    declaration = projections[record_type]
+    if ("keep" in declaration) == ("drop" in declaration):
+        raise ValueError(f"Projection of {record_type} must declare either keep or drop fields")
+    nested = list(declaration.get("nested", {}).items())
+    namespace = {}
+    lines = ["def project(record):"]
+
+    if "keep" in declaration:
+        # the nested fields are kept as well, the fields keep the order of the record
+        namespace["keep"] = frozenset(declaration["keep"]) | frozenset(field for field, _ in nested)
+        lines.append("    outitem = {field: value for field, value in record.items() if field in keep}")
+    else:
+        # a dict copy is done in C, much faster than a comprehension for the few fields dropped
+        lines.append("    outitem = dict(record)")
+        for field in declaration["drop"]:
+            lines += [
+                "    try:",
+                f"        del outitem[{field!r}]",
+                "    except KeyError:",
+                "        pass",
+            ]
+
+    for index, (field, nested_type) in enumerate(nested):
+        namespace[f"project_{index}"] = compile_projection(projections, nested_type)
+        lines += [
+            f"    value = outitem.get({field!r})",
+            "    if isinstance(value, list):",
+            f"        outitem[{field!r}] = [project_{index}(item) for item in value]",
+            "    elif isinstance(value, dict):",
+            f"        outitem[{field!r}] = project_{index}(value)",
+        ]
+    lines.append("    return outitem")
+
+    exec(compile("\n".join(lines), f"<projection {record_type}>", "exec"), namespace)
+    return namespace["project"]
+
+
+def compile_projections(projections):
+    """
+    Return the projectors of all the record types declared in projections.
+    """
+    return {record_type: compile_projection(projections, record_type) for record_type in projections}
+
+
+# ------------------------------------------------
+# Benchmark on the ESRF records
+
+# record type of the records returned by each ESRF endpoint, by last part of the url path
+endpoint_record_types = {
+    "dataset": "dataset",
+    "samples": "sample",
+    "datafile": "datafile",
+    "investigation": "investigation",
+    "datasets": "doi_dataset",
+    "datacollection": "data_collection",
+    "investigationusers": "user",
+}
+
+
+def get_legacy_projectors(settings):
+    """
+    Return the projections done by the ESRF collectors with remove_fields and extract_fields, before the projectors.
+    """
+    def fix_dataset_parameter(initem):
+        outitem = dict(initem)
+        del outitem["id"]
+        del outitem["datasetId"]
+        return outitem
+
+    def fix_dataset(initem):
+        outitem = dict(initem)
+        outitem = settings.remove_fields(outitem, ["investigation", "meta"])
+        outitem["parameters"] = [fix_dataset_parameter(parameter) for parameter in outitem["parameters"]]
+        return outitem
+
+    def fix_sample_parameter(initem):
+        outitem = dict(initem)
+        del outitem["id"]
+        return outitem
+
+    def fix_sample(initem):
+        outitem = dict(initem)
+        outitem = settings.remove_fields(outitem, ["investigation", "meta", "datasets"])
+        outitem["parameters"] = [fix_sample_parameter(parameter) for parameter in outitem["parameters"]]
+        return outitem
+
+    return {
+        "dataset": fix_dataset,
+        "sample": fix_sample,
+        "datafile": lambda item: settings.remove_fields(
+            item, ["dataset", "dataCollectionDatafiles", "destDatafiles", "sourceDatafiles"]
+        ),
+        "investigation": lambda item: settings.remove_fields(item, ["meta", "type"]),
+        "doi_dataset": lambda item: settings.remove_fields(item, ["meta", "type"]),
+        "data_collection": lambda item: settings.extract_fields(
+            item, ["createTime", "modTime", "dataCollectionDatasets", "doi", "parameters"]
+        ),
+        "user": lambda item: settings.extract_fields(
+            item, ["fullName", "email", "familyName", "givenName", "affiliation"]
+        ),
+    }
+
+
+def load_recorded_payloads(http_cache_file):
+    """
+    Return the records of the successful responses saved in the HTTP cache, grouped by record type.
+    """
+    payloads = {}
+    if not http_cache_file or not os.path.exists(http_cache_file):
+        return payloads
+    connection = sqlite3.connect(f"file:{os.path.abspath(http_cache_file)}?mode=ro", uri=True)
+    try:
+        rows = connection.execute("SELECT url, body FROM responses WHERE status = 200").fetchall()
+    finally:
+        connection.close()
+    for url, body in rows:
+        record_type = endpoint_record_types.get(urllib.parse.urlsplit(url).path.rstrip("/").split("/")[-1])
+        if record_type is None:
+            continue
+        try:
+            records = json.loads(body)
+        except ValueError:
+            continue
+        if not isinstance(records, list):
+            continue
+        if record_type == "datafile":
+            records = [record["Datafile"] for record in records if isinstance(record, dict) and "Datafile" in record]
+        payloads.setdefault(record_type, []).extend(record for record in records if isinstance(record, dict))
+    return payloads
+
+
+def generate_payloads(number_of_records):
+    """
+    Return generated records with the fields of the ESRF catalogue records, grouped by record type.
+    """
+    meta = {"page": {"total": number_of_records}}
+    investigation = {"id": 1, "name": "MX-0000", "title": "Investigation", "meta": meta, "type": {"name": "proposal"}}
+
+    def parameters(record_id, number_of_parameters, dataset=True):
+        return [
+            {
+                "id": record_id * 100 + index,
+                **({"datasetId": record_id} if dataset else {}),
+                "name": f"parameter_{index}",
+                "value": str(index * 1.5),
+                "units": "mm",
+            }
+            for index in range(number_of_parameters)
+        ]
+
+    return {
+        "dataset": [
+            {
+                "id": index, "name": f"dataset_{index}", "startDate": "2024-01-01T00:00:00", "location": "/data",
+                "investigation": investigation, "meta": meta, "sampleName": "sample", "type": "acquisition",
+                "parameters": parameters(index, 60),
+            }
+            for index in range(number_of_records)
+        ],
+        "sample": [
+            {
+                "id": index, "name": f"sample_{index}", "investigation": investigation, "meta": meta,
+                "datasets": [{"id": index}], "parameters": parameters(index, 10, dataset=False),
+            }
+            for index in range(number_of_records)
+        ],
+        "datafile": [
+            {
+                "id": index, "name": f"file_{index}.h5", "location": f"/data/file_{index}.h5", "fileSize": 1024,
+                "createTime": "2024-01-01T00:00:00", "modTime": "2024-01-01T00:00:00", "isReleased": True,
+                "dataset": {"id": index}, "dataCollectionDatafiles": [], "destDatafiles": [], "sourceDatafiles": [],
+            }
+            for index in range(number_of_records)
+        ],
+        "investigation": [dict(investigation, id=index) for index in range(number_of_records)],
+        "doi_dataset": [
+            {"id": index, "name": f"dataset_{index}", "investigation": investigation, "meta": meta, "type": "acquisition"}
+            for index in range(number_of_records)
+        ],
+        "data_collection": [
+            {
+                "id": index, "createTime": "2024-01-01T00:00:00", "modTime": "2024-01-01T00:00:00",
+                "doi": f"10.15151/ESRF-DC-{index}", "dataCollectionDatasets": [], "parameters": [],
+                "dataCollectionDatafiles": [], "dataPublications": [],
+            }
+            for index in range(number_of_records)
+        ],
+        "user": [
+            {
+                "id": index, "name": f"user_{index}", "fullName": "User", "email": "user@esrf.fr",
+                "familyName": "User", "givenName": "User", "affiliation": "ESRF", "orcidId": None,
+                "role": "Principal investigator", "investigationId": 1,
+            }
+            for index in range(number_of_records)
+        ],
+    }
+
+
+def time_projection(projector, records, repetitions):
+    start_time = time.perf_counter()
+    for _ in range(repetitions):
+        for record in records:
+            projector(record)
+    return time.perf_counter() - start_time
+
+
+def benchmark(projectors, legacy_projectors, payloads, repetitions):
+    """
+    Time the projectors and the legacy projections on the payloads, checking that both give the same records.
+
+    It returns, for each record type, the number of records and the seconds spent by each implementation.
+    """
+    results = {}
+    for record_type, records in payloads.items():
+        projector = projectors[record_type]
+        legacy_projector = legacy_projectors[record_type]
+        compared = []
+        for record in records:
+            try:
+                expected = legacy_projector(record)
+            except KeyError:
+                # the legacy helpers fail on the records missing a dropped field, the projectors ignore it
+                continue
+            if projector(record) != expected:
+                raise ValueError(f"Projection of {record_type} {record.get('id')} differs from the legacy helpers")
+            compared.append(record)
+        records = compared
+        results[record_type] = {
+            "records": len(records),
+            "legacy_seconds": time_projection(legacy_projector, records, repetitions),
+            "projector_seconds": time_projection(projector, records, repetitions),
+        }
+    return results
+
+
+def print_results(results, repetitions):
+    print("Projection benchmark")
+    print(f" - {'Record type':<16}{'Records':>9}{'Legacy (us)':>14}{'Projector (us)':>17}{'Speed-up':>10}")
+    for record_type, result in results.items():
+        projections = max(result["records"] * repetitions, 1)
+        legacy_us = result["legacy_seconds"] / projections * 1e6
+        projector_us = result["projector_seconds"] / projections * 1e6
+        print(
+            f" - {record_type:<16}{result['records']:>9}{legacy_us:>14.2f}{projector_us:>17.2f}"
+            f"{legacy_us / max(projector_us, 1e-9):>10.2f}"
+        )
+
+
+def main():
+    # the ESRF settings compile their projections with this module
+    import oscars_pan_finder_settings_esrf as settings
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-C","--http-cache-file",
+        help="SQLite file with the recorded ESRF responses",
+        dest="http_cache_file",
+        default=settings.http_cache_file,
+        type=str
+    )
+    parser.add_argument(
+        "-n","--repetitions",
+        help="Number of times each payload is projected",
+        dest="repetitions",
+        default=default_repetitions,
+        type=int
+    )
+    parser.add_argument(
+        "-g","--generated-records",
+        help="Number of records of each type generated when no response is recorded",
+        dest="generated_records",
+        default=default_generated_records,
+        type=int
+    )
+    args = parser.parse_args()
+
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_projection - BEGIN")
+    print(datetime.datetime.now().isoformat())
+    print(f" - HTTP Cache File   : {args.http_cache_file}")
+    print(f" - Repetitions       : {args.repetitions}")
+
+    payloads = load_recorded_payloads(args.http_cache_file)
+    if payloads:
+        print(" - Payloads          : recorded")
+    else:
+        print(f" - Payloads          : generated, {args.generated_records} records per type")
+        payloads = generate_payloads(args.generated_records)
+    results = benchmark(settings.projectors, get_legacy_projectors(settings), payloads, args.repetitions)
+    print_results(results, args.repetitions)
+
+    print(datetime.datetime.now().isoformat())
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_projection - END")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Per host rate limiter used by the data collectors.
+#
+# Each host has a token bucket refilled at its current rate, in requests per second.
+# A request refused with 429 Too Many Requests or 503 Service Unavailable is retried after the delay given by
+# the Retry-After header, or after an exponential backoff with jitter, and the rate of the host is halved.
+# Transient errors (502, 504, connection errors and timeouts) are retried with the same backoff.
+# Each successful request increases the rate of the host a little, up to its maximum rate, so that the rate
+# converges toward the highest rate the host accepts (additive increase, multiplicative decrease).
+# The throttle events are counted per host and reported with the statistics of the run.
+# The number of requests sent at the same time to a host is bounded by its max_concurrency limit, when it has one.
+#
+# Version: 1.1
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import contextlib
+import datetime
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+# limits applied to the hosts without dedicated limits, rates in requests per second.
+# max_concurrency is None by default: the requests in flight are only bounded by the connection pool of the host.
+default_limits = {
+    "rate": 10.0,
+    "max_rate": 50.0,
+    "min_rate": 0.2,
+    "burst": 10,
+    "max_concurrency": None,
+}
+
+# responses meaning that the host is overloaded and the rate must be reduced
+throttle_status_codes = (429, 503)
+# responses worth retrying without reducing the rate
+transient_status_codes = (502, 504)
+
+default_max_retries = 5
+default_backoff_base = 1.0
+default_backoff_max = 120.0
+# rate added, in requests per second, after each successful request
+default_rate_increase = 0.05
+# factor applied to the rate when the host throttles the requests
+default_rate_decrease = 0.5
+
+
+def get_retry_after(res):
+    """
+    Return the delay in seconds requested by the Retry-After header of a response, or None.
+    """
+    retry_after = res.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+        return max(0.0, (retry_date - datetime.datetime.now(retry_date.tzinfo)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens per second, holding at most burst tokens.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Wait for a token and return the time waited in seconds.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def block(self, seconds):
+        """
+        Hold all the requests to the host for the given number of seconds.
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.refill(time.monotonic())
+            self.rate = rate
+
+
+class RateLimiter:
+    """
+    Rate limiter with one token bucket per host.
+
+    host_limits maps a host name to its limits: rate, max_rate, min_rate, burst and max_concurrency.
+    Missing values are taken from default_limits.
+    """
+
+    def __init__(
+            self,
+            host_limits=None,
+            max_retries=default_max_retries,
+            backoff_base=default_backoff_base,
+            backoff_max=default_backoff_max,
+            rate_increase=default_rate_increase,
+            rate_decrease=default_rate_decrease
+    ):
+        self.host_limits = dict(host_limits or {})
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_increase = rate_increase
+        self.rate_decrease = rate_decrease
+        self.buckets = {}
+        self.semaphores = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def get_limits(self, host):
+        return {**default_limits, **self.host_limits.get(host, {})}
+
+    def get_bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                limits = self.get_limits(host)
+                self.buckets[host] = TokenBucket(limits["rate"], limits["burst"])
+                self.semaphores[host] = (
+                    threading.BoundedSemaphore(limits["max_concurrency"])
+                    if limits["max_concurrency"]
+                    else contextlib.nullcontext()
+                )
+                self.stats[host] = {
+                    "requests": 0,
+                    "throttled": 0,
+                    "transient_errors": 0,
+                    "retries": 0,
+                    "waited_seconds": 0.0,
+                    "lowest_rate": limits["rate"],
+                }
+            return self.buckets[host]
+
+    def count(self, host, stat, value=1):
+        with self.lock:
+            self.stats[host][stat] += value
+
+    def get_backoff(self, attempt):
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def on_success(self, host, bucket):
+        limits = self.get_limits(host)
+        if bucket.rate < limits["max_rate"]:
+            bucket.set_rate(min(limits["max_rate"], bucket.rate + self.rate_increase))
+
+    def on_throttle(self, host, bucket, delay):
+        limits = self.get_limits(host)
+        rate = max(limits["min_rate"], bucket.rate * self.rate_decrease)
+        bucket.set_rate(rate)
+        bucket.block(delay)
+        with self.lock:
+            self.stats[host]["throttled"] += 1
+            self.stats[host]["lowest_rate"] = min(self.stats[host]["lowest_rate"], rate)
+
+    def send(self, host, send_request):
+        """
+        Send a request to host through its token bucket, retrying it when throttled or on transient errors.
+
+        send_request() sends the request and returns the response.
+        The last response is returned, or the last connection error raised, when the retries are exhausted.
+        """
+        bucket = self.get_bucket(host)
+        attempt = 0
+        while True:
+            self.count(host, "waited_seconds", bucket.acquire())
+            self.count(host, "requests")
+            try:
+                with self.semaphores[host]:
+                    res = send_request()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                print(f" -- {host} : {type(e).__name__}, retrying")
+                self.count(host, "transient_errors")
+            else:
+                if res.status_code in throttle_status_codes:
+                    if attempt >= self.max_retries:
+                        return res
+                    retry_after = get_retry_after(res)
+                    delay = retry_after if retry_after is not None else self.get_backoff(attempt)
+                    print(f" -- {host} : throttled with status {res.status_code}, retrying in {delay:.1f}s")
+                    self.on_throttle(host, bucket, delay)
+                    attempt += 1
+                    self.count(host, "retries")
+                    continue
+                if res.status_code in transient_status_codes:
+                    if attempt >= self.max_retries:
+                        return res
+                    print(f" -- {host} : status {res.status_code}, retrying")
+                    self.count(host, "transient_errors")
+                else:
+                    self.on_success(host, bucket)
+                    return res
+            time.sleep(self.get_backoff(attempt))
+            attempt += 1
+            self.count(host, "retries")
+
+    def get_stats(self):
+        """
+        Return the statistics of each host, with its current rate.
+        """
+        with self.lock:
+            return {
+                host: {**host_stats, "rate": self.buckets[host].rate}
+                for host, host_stats
+                in self.stats.items()
+            }
+
+    def print_stats(self):
+        print("HTTP rate limits")
+        stats = self.get_stats()
+        if not stats:
+            print(" - no requests sent")
+        for host, host_stats in sorted(stats.items()):
+            print(
+                f" - {host:<24} : {host_stats['requests']} requests,"
+                f" {host_stats['throttled']} throttled,"
+                f" {host_stats['transient_errors']} transient errors,"
+                f" {host_stats['retries']} retries,"
+                f" waited {host_stats['waited_seconds']:.1f}s,"
+                f" rate {host_stats['rate']:.1f}/s (lowest {host_stats['lowest_rate']:.1f}/s)"
+            )
@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Data collector for the SciCat based PaN data providers:
+# - DESY (Deutsches Elektronen-Synchrotron, https://www.desy.de/)
+# - ESS (European Spallation Source, https://ess.eu)
+# - Max IV (https://www.maxiv.se.lu/)
+# - PSI (Paul Scherrer Institute, https://www.psi.ch)
+#
+# The collection is driven by the profile of the facility, defined in oscars_pan_finder_settings_scicat.py.
+# The collector lists all the public documents of the facility (publisheddata), retrieves their datasets,
+# joins them with the PaNOSC documents when the facility provides a PaNOSC search api, and saves them
+# in a file named <output_file_prefix><timestamp>.json, for example ../data/oscars_pan_finder_ess_data_<timestamp>.json
+#
+# With -d/--delta, only the documents and datasets updated since the previous run are requested and merged
+# into its snapshot, the documents no longer published are dropped. See oscars_pan_finder_scicat_sync.py
+#
+# Usage: oscars_pan_finder_scicat_collector
+#   -f, --facility = Facility to collect: desy, desy_fs, ess, maxiv or psi
+#   -d, --delta = Request only the records updated since the last run and merge them into its snapshot
+#   -b, --dataset-batch-size = Number of datasets requested together. Default=100
+#   -w, --workers = Number of dataset requests sent at the same time. Default=4
+#   -j, --jsonl = Save the snapshot as JSONL, one entry per line, in <output_file_prefix><timestamp>.jsonl
+#   -z, --seekable = Save the snapshot as seekable compressed JSONL, in <output_file_prefix><timestamp>.jsonl.gz,
+#                    with an index of the DOI and pid of the entries. See oscars_pan_finder_seekable.py
+#   -a, --all-fields = Request all the fields of the published data, without server-side field selection
+#
+# The datasets of all the documents are requested in batches, with a filter on their pid, and mapped back to
+# their documents. Only the datasets not returned by the batch requests are requested one by one.
+# The dataset requests run on a bounded pool of threads, the number of requests sent at the same time to a host
+# is also bounded by its max_concurrency limit. The order of the entries in the output file does not change.
+# The datasets are retrieved for document_chunk_size documents at a time and each entry is streamed to the
+# snapshot file as soon as it is prepared, so the memory used does not grow with the catalogue.
+# The published data are requested without the fields deleted from the entries, with a fields filter, unless
+# --all-fields is given. The run report shows the bytes transferred per endpoint, compared with the last run
+# made in the other mode, saved in ../data/<facility>/<facility>_http_transfers.json
+#
+# Version: 1.5
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import urllib.parse
+
+import oscars_pan_finder_http_client as http_client
+import oscars_pan_finder_jsonl as jsonl
+import oscars_pan_finder_scicat_sync as scicat_sync
+import oscars_pan_finder_seekable as seekable
+import oscars_pan_finder_settings_scicat as scicat_settings
+
+# extension of the snapshot file of each output format
+output_extensions = {
+    "json": ".json",
+    "jsonl": jsonl.jsonl_extension,
+    "seekable": seekable.seekable_extension,
+}
+
+
+def get_urls(profile):
+    """
+    Return the endpoints used to retrieve the data of a facility.
+    """
+    catalog_publisheddata_url = urllib.parse.urljoin(profile["catalog_url"] + "/", "publisheddata")
+    urls = {
+        "catalog_publisheddata": catalog_publisheddata_url,
+        "catalog_publisheddata_count": urllib.parse.urljoin(catalog_publisheddata_url + "/", "count"),
+        "catalog_datasets": urllib.parse.urljoin(profile["catalog_url"] + "/", "datasets"),
+    }
+    if profile["panosc_url"]:
+        panosc_documents_url = urllib.parse.urljoin(profile["panosc_url"] + "/", "documents")
+        urls["panosc_documents"] = panosc_documents_url
+        urls["panosc_documents_count"] = urllib.parse.urljoin(panosc_documents_url + "/", "count")
+    return urls
+
+
+def retrieve_panosc_documents(client, urls):
+    """
+    Return all the PaNOSC documents of the facility, keyed by their pid.
+    """
+    res = client.get(urls["panosc_documents_count"])
+    print(res.text)
+    assert(res.status_code == 200)
+    number_of_panosc_documents = res.json()["count"]
+    print("Number of panosc documents available : " + str(number_of_panosc_documents))
+
+    print("Starting panosc document collection...")
+    panosc_documents = []
+    keep_going = True
+    skip = scicat_settings.initial_skip
+    while keep_going:
+        params = {
+            "filter" : json.dumps({
+                "skip" : skip,
+                "limit" : scicat_settings.batch_limit
+            })
+        }
+        res = client.get(
+            urls["panosc_documents"],
+            params = params
+        )
+        current_batch = res.json()
+        keep_going = len(current_batch) == scicat_settings.batch_limit
+        panosc_documents += current_batch
+        print(".",end="",flush=True)
+        skip += len(current_batch)
+
+    print("")
+    print("{} Panosc documents collected".format(len(panosc_documents)))
+
+    if len(panosc_documents) == number_of_panosc_documents:
+        print("Correct number of documents collected")
+    else:
+        print("Number of PaNOSC documents collected does not match with the count provided")
+
+    return {
+        document['pid']: document
+        for document
+        in panosc_documents
+    }
+
+
+def retrieve_open_documents(client, urls, strict_count, document_fields=None):
+    """
+    Return all the publicly available data (aka documents in PaNOSC terms, aka publishedData entities in SciCat terms).
+
+    document_fields is the fields filter of the documents requested, all their fields are requested when it is None.
+    """
+    res = client.get(urls["catalog_publisheddata_count"])
+    assert(res.status_code == 200)
+    number_of_open_documents = res.json()["count"]
+    print("Number of public documents available in catalog : " + str(number_of_open_documents))
+
+    print("Starting open document collection...")
+    open_documents = []
+    keep_going = True
+    skip = scicat_settings.initial_skip
+    while keep_going:
+        params = {
+            "limits" : json.dumps({
+                "skip" : skip,
+                "limit" : scicat_settings.batch_limit
+            },separators=(',', ':'))
+        }
+        if document_fields:
+            # publisheddata reads the fields parameter, older catalogues the fields of the filter
+            params["fields"] = json.dumps(document_fields, separators=(',', ':'))
+            params["filter"] = json.dumps({"fields": document_fields}, separators=(',', ':'))
+        res = client.get(
+            urls["catalog_publisheddata"],
+            params = params
+        )
+        current_batch = res.json()
+        keep_going = len(current_batch) == scicat_settings.batch_limit
+        open_documents += current_batch
+        print(".",end="",flush=True)
+        skip += len(current_batch)
+
+    print("")
+    print("Catalog open documents collected")
+
+    # Confirm that we retrieved the correct amount of documents
+    if strict_count:
+        assert(len(open_documents) == number_of_open_documents)
+        print("Correct number of open documents collected")
+    elif len(open_documents) == number_of_open_documents:
+        print("Correct number of documents collected")
+    else:
+        print("Number of open documents collected ({}) does not match with the count provided".format(len(open_documents)))
+    return open_documents
+
+
+def get_dataset(client, urls, pid):
+    res = client.get(
+        urls["catalog_datasets"] + "/" + urllib.parse.quote_plus(pid)
+    )
+    return res.json()
+
+
+def retrieve_dataset_batch(client, urls, batch):
+    """
+    Return the datasets of a batch of pids returned by a single request with a filter on pid, keyed by pid.
+    """
+    params = {
+        "filter" : json.dumps({
+            "where" : {"pid" : {"inq" : batch}},
+            "limits" : {"skip" : 0, "limit" : len(batch)}
+        },separators=(',', ':'))
+    }
+    res = client.get(
+        urls["catalog_datasets"],
+        params = params
+    )
+    datasets = {}
+    if res.status_code == 200 and isinstance(res.json(), list):
+        requested = set(batch)
+        for dataset in res.json():
+            if isinstance(dataset, dict) and dataset.get("pid") in requested:
+                datasets[dataset["pid"]] = dataset
+    return datasets
+
+
+def retrieve_datasets(client, urls, pids, batch_size, workers):
+    """
+    Return the datasets of pids keyed by their pid.
+
+    The datasets are requested in batches of batch_size pids with a filter on pid,
+    only the datasets not returned by the batch requests are requested one by one.
+    The requests run on a pool of workers threads, the rate limiter of the client bounds
+    the number of requests sent at the same time to the host.
+    """
+    pids = list(dict.fromkeys(pids))
+    batches = [pids[start:start + batch_size] for start in range(0, len(pids), batch_size)]
+    datasets = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for batch_datasets in executor.map(lambda batch: retrieve_dataset_batch(client, urls, batch), batches):
+            datasets.update(batch_datasets)
+            print(".",end="",flush=True)
+
+        missing_pids = [pid for pid in pids if pid not in datasets]
+        for pid, dataset in zip(missing_pids, executor.map(lambda pid: get_dataset(client, urls, pid), missing_pids)):
+            datasets[pid] = dataset
+            print(".",end="",flush=True)
+    print("")
+    print(f" - Datasets requested             : {len(pids)}")
+    print(f" - Batch requests                 : {len(batches)}")
+    print(f" - Datasets requested one by one  : {len(missing_pids)}")
+    return datasets
+
+
+def prepare_entry(profile, panosc_documents, document, datasets):
+    # the fields are not returned at all by the catalogues supporting server-side field selection
+    for field_to_be_deleted in list(set(document.keys()).intersection(scicat_settings.fields_to_be_deleted_from_document)):
+        document.pop(field_to_be_deleted)
+
+    entry = {
+        "document" : document,
+        "datasets" : datasets
+    }
+    join_value = document.get(profile["panosc_join_field"])
+    if join_value in panosc_documents.keys():
+        entry['panosc'] = panosc_documents[join_value]
+    return entry
+
+
+def iterate_entries(client, urls, open_documents, prepare, dataset_batch_size, workers):
+    """
+    Yield the entry of each document, retrieving the datasets of document_chunk_size documents at a time.
+    """
+    chunk_size = scicat_settings.document_chunk_size
+    for start in range(0, len(open_documents), chunk_size):
+        chunk = open_documents[start:start + chunk_size]
+        print(f"Retrieving datasets of documents {start} to {start + len(chunk) - 1}...")
+        datasets = retrieve_datasets(
+            client,
+            urls,
+            [pid for document in chunk for pid in document['pidArray']],
+            dataset_batch_size,
+            workers
+        )
+        print("Preparing raw data for task 1")
+        for document in chunk:
+            yield prepare(document, [datasets[pid] for pid in document['pidArray']])
+
+
+def collect(facility, delta=False, dataset_batch_size=None, workers=None, output_format="json", field_selection=True):
+    """
+    Collect all the public data of a SciCat facility and save them in a new snapshot, returning its file name.
+
+    output_format is one of output_extensions: json array, JSONL or seekable compressed JSONL.
+    With field_selection, the fields deleted from the entries are excluded by the catalogue and not downloaded.
+    """
+    if facility not in scicat_settings.facilities:
+        raise ValueError(f"Unknown facility {facility}. Valid values: {list(scicat_settings.facilities)}")
+    profile = scicat_settings.facilities[facility]
+    dataset_batch_size = dataset_batch_size or scicat_settings.dataset_batch_size
+    workers = workers or scicat_settings.dataset_workers
+
+    print(f"Retrieving {profile['name']} data for OSCARS PaN-Finder project - Task 1")
+    print(datetime.datetime.now().isoformat())
+    print("----------------------------------------------------------")
+    if profile["panosc_url"]:
+        print("PaNOSC Data Provider Url: " + profile["panosc_url"])
+    print("Catalog Data Catalog Url: " + profile["catalog_url"])
+
+    urls = get_urls(profile)
+    print("Urls used to retrieve data")
+    if profile["panosc_url"]:
+        print(f" - PaNOSC Documents             : {urls['panosc_documents']}")
+        print(f" - PaNOSC Documents Count       : {urls['panosc_documents_count']}")
+    print(f" - Catalog Published Data       : {urls['catalog_publisheddata']}")
+    print(f" - Catalog Published Data Count : {urls['catalog_publisheddata_count']}")
+    print(f" - Catalog Dataset              : {urls['catalog_datasets']}")
+
+    # shared HTTP client with persistent response cache
+    client = scicat_settings.get_http_client(facility)
+    print(f" - HTTP Cache File              : {client.cache.cache_file}")
+    transfers_file = scicat_settings.get_http_transfers_file(facility)
+    print(f" - HTTP Transfers File          : {transfers_file}")
+    document_fields = scicat_settings.document_fields_filter if field_selection else None
+    print(f" - Server-side Field Selection  : {json.dumps(document_fields)}")
+
+    # previous snapshot, merged with the updated records in delta mode
+    watermark_file = scicat_settings.get_watermark_file(facility)
+    print(f" - Watermark File               : {watermark_file}")
+    previous_snapshot = scicat_sync.load_previous_snapshot(watermark_file) if delta else None
+
+    panosc_documents = retrieve_panosc_documents(client, urls) if profile["panosc_url"] else {}
+
+    # documents returned with fields that the catalogue should have excluded
+    pruned_documents = [0]
+
+    def prepare(document, datasets):
+        if document_fields and any(field in document for field in document_fields):
+            pruned_documents[0] += 1
+        return prepare_entry(profile, panosc_documents, document, datasets)
+
+    if previous_snapshot is None:
+        open_documents = retrieve_open_documents(client, urls, profile["strict_count"], document_fields)
+
+        # the entries are prepared chunk by chunk while the snapshot is written
+        documents = iterate_entries(client, urls, open_documents, prepare, dataset_batch_size, workers)
+    else:
+        # Merge the records updated since the previous run into its snapshot
+        print("Starting delta synchronisation...")
+        previous_watermark, previous_documents = previous_snapshot
+        documents = scicat_sync.sync_snapshot(
+            client,
+            urls["catalog_publisheddata"],
+            urls["catalog_datasets"],
+            previous_documents,
+            previous_watermark["high_water_mark"],
+            scicat_settings.batch_limit,
+            lambda pids: retrieve_datasets(client, urls, pids, dataset_batch_size, workers),
+            prepare,
+            document_fields=document_fields
+        )
+
+    # the snapshot is kept only if an entry has changed since the previous one
+    output_data_file = (
+        profile["output_file_prefix"]
+        + datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+        + output_extensions[output_format]
+    )
+    output_data_file, changed_entries = scicat_sync.save_snapshot(documents, output_data_file, facility)
+
+    print("")
+    print("Raw data for task 1 preparation completed")
+    if document_fields:
+        print(f" - Documents pruned client-side   : {pruned_documents[0]}")
+
+    # the transfers are compared with the last run made in the other mode
+    transfer_label = "selected_fields" if document_fields else "all_fields"
+    baseline_label = "all_fields" if document_fields else "selected_fields"
+    baseline = http_client.load_transfer_stats(transfers_file).get(baseline_label, {})
+    client.print_stats(
+        transfer_baseline=baseline.get("endpoints"),
+        transfer_baseline_label=f"{baseline_label} run of {baseline.get('saved_at')}"
+    )
+    http_client.save_transfer_stats(transfers_file, transfer_label, client.transfer_stats())
+
+    print("----------------------------------------------------------")
+    print(datetime.datetime.now().isoformat())
+    print(f"{profile['name']} data for OSCARS PaN-Finder project retrieved and saved")
+    return output_data_file
+
+
+def main(facility=None):
+    """
+    Run the collection of a facility, given with -f/--facility, or by the facility script calling main.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-f","--facility",
+        help="Facility to collect.",
+        dest="facility",
+        choices=sorted(scicat_settings.facilities),
+        default=facility,
+        required=facility is None,
+        type=str
+    )
+    parser.add_argument(
+        "-d","--delta",
+        help="Request only the records updated since the last run and merge them into its snapshot",
+        dest="delta",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-b","--dataset-batch-size",
+        help="Number of datasets requested together.",
+        dest="dataset_batch_size",
+        default=scicat_settings.dataset_batch_size,
+        type=int
+    )
+    parser.add_argument(
+        "-w","--workers",
+        help="Number of dataset requests sent at the same time.",
+        dest="workers",
+        default=scicat_settings.dataset_workers,
+        type=int
+    )
+    parser.add_argument(
+        "-j","--jsonl",
+        help="Save the snapshot as JSONL, one entry per line",
+        dest="output_format",
+        action="store_const",
+        const="jsonl",
+        default="json",
+    )
+    parser.add_argument(
+        "-z","--seekable",
+        help="Save the snapshot as seekable compressed JSONL, with an index of the DOI and pid of the entries",
+        dest="output_format",
+        action="store_const",
+        const="seekable",
+    )
+    parser.add_argument(
+        "-a","--all-fields",
+        help="Request all the fields of the published data, without server-side field selection",
+        dest="field_selection",
+        action="store_false",
+    )
+    args = parser.parse_args()
+
+    collect(
+        args.facility,
+        delta=args.delta,
+        dataset_batch_size=args.dataset_batch_size,
+        workers=args.workers,
+        output_format=args.output_format,
+        field_selection=args.field_selection
+    )
+
+
+if __name__ == "__main__":
+    main()
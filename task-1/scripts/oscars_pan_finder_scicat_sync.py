@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Delta synchronisation of the snapshot of a SciCat based PaN data provider.
+#
+# After each run, the collectors save in the watermark file of the facility the most recent updatedAt
+# of the documents (publisheddata) and datasets of the snapshot, with the name of the snapshot file.
+# In delta mode, the next run does not download every document and dataset again, it requests:
+# - the keys of the documents currently listed, to drop the documents that are no longer published
+# - the documents with updatedAt after the high-water mark
+# - among the datasets of the documents listed that are already in the previous snapshot, the ones with
+#   updatedAt after the high-water mark. The datasets of the rest of the catalogue are never listed
+# - the documents listed but missing from the previous snapshot
+# and merges them into the previous snapshot, which is then saved as a new timestamped snapshot.
+# If there is no watermark or the previous snapshot file is missing, the collectors run a full collection.
+#
+# In both modes, the content hash of each entry is compared to the one recorded in the manifest of the facility.
+# The snapshot is not written again when no entry has changed, and the list of the entries added, changed or
+# removed is saved in ../data/<facility>/<facility>_changed_entries_<timestamp>.json
+#
+# Version: 1.2
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import datetime
+import json
+import os
+
+import oscars_pan_finder_jsonl as jsonl
+import oscars_pan_finder_manifest as manifest
+import oscars_pan_finder_paginator as paginator
+import oscars_pan_finder_settings_scicat as scicat_settings
+import oscars_pan_finder_watermark as watermark
+
+# name of the listing in the watermark file and field with the modification time of the records
+watermark_source = "publisheddata"
+time_fields = ["updatedAt"]
+
+# field identifying a document (publisheddata) and a dataset
+document_key = "doi"
+dataset_key = "pid"
+
+# number of keys sent in each inq filter
+inq_batch_size = 100
+
+
+def get_document_key(document):
+    return document.get(document_key)
+
+
+def load_previous_snapshot(watermark_file):
+    """
+    Return the watermark of the previous run and the entries of its snapshot, or None if a full collection is needed.
+    """
+    previous_watermark = watermark.load_watermark(watermark_file, watermark_source)
+    if not previous_watermark or not previous_watermark.get("high_water_mark"):
+        print(" - No previous synchronisation, running a full collection")
+        return None
+    snapshot_file = previous_watermark.get("snapshot_file")
+    if not snapshot_file or not os.path.exists(snapshot_file):
+        print(f" - Previous snapshot {snapshot_file} not found, running a full collection")
+        return None
+    entries = jsonl.load_records(snapshot_file)
+    print(f" - Previous snapshot              : {snapshot_file}")
+    print(f" - Previous number of entries     : {len(entries)}")
+    print(f" - High-water mark                : {previous_watermark['high_water_mark']}")
+    return previous_watermark, entries
+
+
+def get_entries_high_water_mark(entries, high_water_mark=None):
+    """
+    Return the most recent updatedAt of the documents and datasets of the entries of a snapshot.
+    """
+    records = []
+    for entry in entries:
+        records.append(entry["document"])
+        records += [dataset for dataset in entry["datasets"] if isinstance(dataset, dict)]
+    return watermark.get_high_water_mark(records, time_fields, high_water_mark)
+
+
+def save_snapshot(entries, output_data_file, facility):
+    """
+    Save the entries of the facility in output_data_file and return the snapshot file and the changed entries.
+
+    The entries are streamed to a temporary file as they come, in the format given by the extension of
+    output_data_file, while their content hashes are computed. The snapshot is only kept if an entry has been
+    added, changed or removed since the previous snapshot, according to the content hashes of the manifest
+    of the facility, otherwise the previous snapshot file is kept.
+    """
+    watermark_file = scicat_settings.get_watermark_file(facility)
+    snapshot_manifest = scicat_settings.get_manifest(facility)
+    previous_watermark = watermark.load_watermark(watermark_file, watermark_source)
+    previous_snapshot_file = previous_watermark.get("snapshot_file") if previous_watermark else None
+
+    print("Saving raw data in file : " + os.path.abspath(output_data_file))
+    entry_hashes = {}
+    high_water_mark = None
+    with jsonl.open_writer(output_data_file) as writer:
+        for entry in entries:
+            writer.write(entry)
+            entry_hashes[get_document_key(entry["document"])] = (
+                entry["document"].get(document_key),
+                manifest.get_entry_hash(entry)
+            )
+            high_water_mark = get_entries_high_water_mark([entry], high_water_mark)
+            print(".",end="",flush=True)
+        print("")
+
+        changes = snapshot_manifest.get_snapshot_changes(entry_hashes)
+        print(f" - Changed entries                : {len(changes)}")
+        if (
+                not changes
+                and previous_snapshot_file
+                and os.path.exists(previous_snapshot_file)
+                and jsonl.get_file_format(previous_snapshot_file) == jsonl.get_file_format(writer.output_file)
+        ):
+            writer.discard()
+            snapshot_file = previous_snapshot_file
+            print("No entry changed, keeping the previous snapshot : " + snapshot_file)
+        else:
+            writer.close()
+            snapshot_file = writer.output_file
+    changes = snapshot_manifest.save_snapshot_entries(entry_hashes, snapshot_file, changes)
+
+    changed_entries_file = scicat_settings.get_changed_entries_file(facility, datetime.datetime.now())
+    with open(changed_entries_file, 'w') as fh:
+        json.dump(changes, fh, indent=2)
+    print("Changed entries saved in file : " + changed_entries_file)
+
+    watermark.save_watermark(
+        watermark_file,
+        watermark_source,
+        high_water_mark,
+        len(entry_hashes),
+        details={"snapshot_file": snapshot_file}
+    )
+    return snapshot_file, changes
+
+
+def list_records(client, url, record_filter, batch_limit):
+    """
+    Return all the records of a SciCat endpoint matching record_filter, page by page.
+    """
+    def fetch_window(skip, limit):
+        limits = {"skip": skip, "limit": limit}
+        # publisheddata reads the limits and fields parameters, datasets the limits and fields of the filter
+        params = {
+            "filter": json.dumps({**record_filter, "limits": limits}, separators=(',', ':')),
+            "limits": json.dumps(limits, separators=(',', ':')),
+        }
+        if "fields" in record_filter:
+            params["fields"] = json.dumps(record_filter["fields"], separators=(',', ':'))
+        res = client.get(url, params=params)
+        assert(res.status_code == 200)
+        return res.json()
+
+    records = paginator.collect_sequentially(fetch_window, batch_limit)
+    print("")
+    return records
+
+
+def get_record_filter(where, fields=None):
+    """
+    Return the filter of the records matching where, with only the fields selected by fields when given.
+    """
+    record_filter = {"where": where}
+    if fields:
+        record_filter["fields"] = fields
+    return record_filter
+
+
+def list_updated_records(client, url, high_water_mark, batch_limit, fields=None):
+    return list_records(client, url, get_record_filter({"updatedAt": {"gt": high_water_mark}}, fields), batch_limit)
+
+
+def list_records_by_key(client, url, key, values, batch_limit, batch_size=inq_batch_size, fields=None, where=None):
+    """
+    Return the records whose key is one of values, requested with inq filters of batch_size values.
+
+    where holds additional conditions the records must match.
+    """
+    records = []
+    for start in range(0, len(values), batch_size):
+        records += list_records(
+            client,
+            url,
+            get_record_filter({**(where or {}), key: {"inq": values[start:start + batch_size]}}, fields),
+            batch_limit
+        )
+    return records
+
+
+def sync_snapshot(
+        client,
+        publisheddata_url,
+        datasets_url,
+        previous_entries,
+        high_water_mark,
+        batch_limit,
+        retrieve_datasets,
+        prepare_entry,
+        document_fields=None
+):
+    """
+    Merge the documents and datasets updated since the high-water mark into the entries of the previous snapshot.
+
+    retrieve_datasets(pids) returns the datasets missing from the previous snapshot keyed by their pid and
+    prepare_entry(document, datasets) returns the entry saved in the snapshot.
+    document_fields is the fields filter of the documents requested, all their fields are requested when it is None.
+    The entries are returned in the order of the publisheddata listing.
+    """
+    print("Listing published documents keys...")
+    listed_keys = [
+        get_document_key(document)
+        for document
+        in list_records(client, publisheddata_url, {"fields": [document_key]}, batch_limit)
+    ]
+    print(f" - Documents listed               : {len(listed_keys)}")
+
+    print("Listing documents updated since the high-water mark...")
+    updated_documents = {
+        get_document_key(document): document
+        for document
+        in list_updated_records(client, publisheddata_url, high_water_mark, batch_limit, fields=document_fields)
+    }
+    print(f" - Updated documents listed       : {len(updated_documents)}")
+
+    previous_documents = {
+        get_document_key(entry["document"]): entry
+        for entry
+        in previous_entries
+    }
+    missing_keys = [
+        key
+        for key
+        in listed_keys
+        if key not in previous_documents and key not in updated_documents
+    ]
+    if missing_keys:
+        print("Retrieving listed documents missing from the previous snapshot...")
+        for document in list_records_by_key(
+                client, publisheddata_url, document_key, missing_keys, batch_limit, fields=document_fields
+        ):
+            updated_documents[get_document_key(document)] = document
+
+    # first pass: the document of each entry and the datasets known from the previous snapshot
+    merged = []
+    for key in listed_keys:
+        previous_entry = previous_documents.get(key)
+        if key in updated_documents:
+            document = updated_documents[key]
+        elif previous_entry:
+            document = previous_entry["document"]
+        else:
+            print(f" - Document {key} listed but not retrieved, skipped")
+            continue
+        known_datasets = {
+            dataset[dataset_key]: dataset
+            for dataset
+            in (previous_entry["datasets"] if previous_entry else [])
+            if isinstance(dataset, dict) and dataset_key in dataset
+        }
+        merged.append((key, previous_entry, document, known_datasets))
+
+    # only the known datasets of the documents listed are checked for updates, the others are retrieved below
+    known_pids = list(dict.fromkeys(
+        pid
+        for key, previous_entry, document, known_datasets
+        in merged
+        for pid
+        in document.get("pidArray", [])
+        if pid in known_datasets
+    ))
+    print("Listing datasets of the documents updated since the high-water mark...")
+    updated_datasets = {
+        dataset[dataset_key]: dataset
+        for dataset
+        in list_records_by_key(
+            client,
+            datasets_url,
+            dataset_key,
+            known_pids,
+            batch_limit,
+            where={"updatedAt": {"gt": high_water_mark}}
+        )
+        if dataset_key in dataset
+    }
+    print(f" - Datasets checked               : {len(known_pids)}")
+    print(f" - Updated datasets listed        : {len(updated_datasets)}")
+
+    missing_pids = [
+        pid
+        for key, previous_entry, document, known_datasets
+        in merged
+        for pid
+        in document.get("pidArray", [])
+        if pid not in updated_datasets and pid not in known_datasets
+    ]
+
+    # the datasets missing from the previous snapshot are retrieved together
+    retrieved_datasets = retrieve_datasets(list(dict.fromkeys(missing_pids))) if missing_pids else {}
+
+    stats = {"added": 0, "updated": 0, "datasets_updated": 0, "unchanged": 0, "removed": 0}
+    entries = []
+    for key, previous_entry, document, known_datasets in merged:
+        datasets = []
+        for pid in document.get("pidArray", []):
+            if pid in updated_datasets:
+                datasets.append(updated_datasets[pid])
+            elif pid in known_datasets:
+                datasets.append(known_datasets[pid])
+            else:
+                datasets.append(retrieved_datasets[pid])
+        if key in updated_documents:
+            stats["updated" if previous_entry else "added"] += 1
+        elif any(pid in updated_datasets for pid in document.get("pidArray", [])):
+            stats["datasets_updated"] += 1
+        else:
+            stats["unchanged"] += 1
+        entries.append(prepare_entry(document, datasets))
+
+    stats["removed"] = len(set(previous_documents.keys()) - set(listed_keys))
+    print("Delta synchronisation")
+    print(f" - Documents added                : {stats['added']}")
+    print(f" - Documents updated              : {stats['updated']}")
+    print(f" - Documents with updated datasets: {stats['datasets_updated']}")
+    print(f" - Documents unchanged            : {stats['unchanged']}")
+    print(f" - Documents removed              : {stats['removed']}")
+    return entries
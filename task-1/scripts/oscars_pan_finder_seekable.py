@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Seekable compressed format of the output files of the data collectors.
+#
+# The records are saved as JSONL in a .jsonl.gz file made of independent gzip members, or frames, of
+# frame_records records each. The file is still a valid gzip file, it can be read with zcat or gzip.open,
+# but each frame can also be decompressed on its own.
+# A sidecar SQLite index, <file>.index.sqlite, maps the DOI, pid and id of each record, and of its document,
+# collection, panosc document and datasets, to the offset and length of its frame and its line in the frame.
+# The keys of the parts are indexed with the name of their part, such as document.pid or datasets.id, so that
+# a record is found by its own keys and not by the id of one of its datasets, unless asked for.
+# Reading a single record seeks to its frame and decompresses only that frame. A reader can be shared by several
+# threads, to be opened once per process.
+# The data file and the index are written through temporary files renamed once complete.
+#
+# Usage: oscars_pan_finder_seekable
+#   -i, --input-file = Seekable file to be read, or json/JSONL file to be converted with --convert
+#   -k, --key = DOI, pid or id of the record to be printed
+#   -f, --key-field = Field of the key, such as doi, document.pid or datasets.id. Default: the keys of the record and of its parts
+#   -c, --convert = Convert the input file to the seekable format, in <input file without extension>.jsonl.gz
+#   -r, --frame-records = Number of records in each frame when converting. Default=100
+#
+# Version: 1.2
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import argparse
+import datetime
+import gzip
+import json
+import os
+import sqlite3
+import threading
+
+seekable_extension = ".jsonl.gz"
+index_suffix = ".index.sqlite"
+
+default_frame_records = 100
+
+# fields indexed, in the record and in its parts
+key_fields = ["doi", "pid", "id"]
+record_parts = ["document", "collection", "panosc"]
+record_list_parts = ["datasets"]
+# fields a record is looked up by when no field is given: its own keys and the keys of its parts, not of its datasets
+record_key_fields = key_fields + [f"{part}.{field}" for part in record_parts for field in key_fields]
+
+
+def is_seekable_file(file_name):
+    return file_name.endswith(seekable_extension)
+
+
+def get_index_file(data_file):
+    return data_file + index_suffix
+
+
+def get_record_keys(record):
+    """
+    Return the field and value of the keys of a record: DOI, pid and id of the record, of its parts and datasets.
+
+    The fields of the parts are prefixed with the name of their part, such as document.doi or datasets.id.
+    """
+    parts = [("", record)]
+    parts += [(f"{part}.", record[part]) for part in record_parts if isinstance(record.get(part), dict)]
+    for part in record_list_parts:
+        if isinstance(record.get(part), list):
+            parts += [(f"{part}.", item) for item in record[part] if isinstance(item, dict)]
+    keys = []
+    for prefix, part in parts:
+        for field in key_fields:
+            value = part.get(field)
+            if isinstance(value, (str, int)) and (prefix + field, str(value)) not in keys:
+                keys.append((prefix + field, str(value)))
+    return keys
+
+
+class SeekableWriter:
+    """
+    Write records one by one to a seekable file and its index, through temporary files renamed when the writer is closed.
+
+    It has the same interface as oscars_pan_finder_jsonl.JsonlWriter. The records are flushed to disk frame by frame.
+    """
+
+    def __init__(self, output_file, frame_records=default_frame_records):
+        self.output_file = os.path.abspath(output_file)
+        self.index_file = get_index_file(self.output_file)
+        self.frame_records = frame_records
+        self.temp_file = f"{self.output_file}.{os.getpid()}.tmp"
+        self.temp_index_file = f"{self.index_file}.{os.getpid()}.tmp"
+        self.number_of_records = 0
+        self.number_of_frames = 0
+        self.frame_lines = []
+        self.frame_keys = []
+        self.offset = 0
+
+        os.makedirs(os.path.dirname(self.output_file), exist_ok=True)
+        self.fh = open(self.temp_file, "wb")
+        if os.path.exists(self.temp_index_file):
+            os.remove(self.temp_index_file)
+        self.connection = sqlite3.connect(self.temp_index_file)
+        self.connection.execute(
+            "CREATE TABLE frames (frame INTEGER PRIMARY KEY, offset INTEGER, length INTEGER, number_of_records INTEGER)"
+        )
+        self.connection.execute("CREATE TABLE keys (key TEXT, field TEXT, frame INTEGER, line INTEGER)")
+
+    def write(self, record):
+        for field, key in get_record_keys(record):
+            self.frame_keys.append((key, field, self.number_of_frames, len(self.frame_lines)))
+        self.frame_lines.append(json.dumps(record))
+        self.number_of_records += 1
+        if len(self.frame_lines) >= self.frame_records:
+            self.flush()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+        return self.number_of_records
+
+    def flush(self):
+        """
+        Compress the pending records in a new frame.
+        """
+        if not self.frame_lines:
+            return
+        data = gzip.compress(("\n".join(self.frame_lines) + "\n").encode("utf-8"), mtime=0)
+        self.fh.write(data)
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+        self.connection.execute(
+            "INSERT INTO frames VALUES (?, ?, ?, ?)",
+            (self.number_of_frames, self.offset, len(data), len(self.frame_lines))
+        )
+        self.connection.executemany("INSERT INTO keys VALUES (?, ?, ?, ?)", self.frame_keys)
+        self.connection.commit()
+        self.offset += len(data)
+        self.number_of_frames += 1
+        self.frame_lines = []
+        self.frame_keys = []
+
+    def close(self):
+        """
+        Complete the output file and its index, they replace the previous files with the same name.
+        """
+        self.flush()
+        self.fh.close()
+        self.connection.execute("CREATE INDEX keys_key ON keys (key)")
+        self.connection.commit()
+        self.connection.close()
+        # the index is renamed first, a data file is never left with the index of a previous version
+        os.replace(self.temp_index_file, self.index_file)
+        os.replace(self.temp_file, self.output_file)
+
+    def discard(self):
+        """
+        Remove the temporary files, the output file is left untouched.
+        """
+        self.fh.close()
+        self.connection.close()
+        os.remove(self.temp_file)
+        os.remove(self.temp_index_file)
+
+    def abort(self):
+        """
+        Keep the frames already written in the temporary files, the output file is left untouched.
+        """
+        self.fh.close()
+        self.connection.close()
+        print(
+            f" - {self.number_of_frames} frames written before the error kept in {self.temp_file}"
+            f" and {self.temp_index_file}"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.fh.closed:
+            return False
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class SeekableReader:
+    """
+    Read single records of a seekable file through its index.
+
+    With shared, the reader can be used by several threads, its reads are serialized.
+    """
+
+    def __init__(self, data_file, shared=False):
+        self.data_file = os.path.abspath(data_file)
+        self.connection = sqlite3.connect(
+            f"file:{get_index_file(self.data_file)}?mode=ro",
+            uri=True,
+            check_same_thread=not shared
+        )
+        self.fh = open(self.data_file, "rb")
+        self.lock = threading.Lock()
+
+    def get_frame(self, offset, length):
+        self.fh.seek(offset)
+        return gzip.decompress(self.fh.read(length)).decode("utf-8").split("\n")
+
+    def get_records(self, key, fields=None):
+        """
+        Return the records with key as DOI, pid or id, decompressing only their frames.
+
+        fields are the indexed fields the key is looked for in, by default the keys of the record and of
+        its parts, see record_key_fields. Use ["datasets.id"] to find the record of a dataset.
+        """
+        fields = record_key_fields if fields is None else fields
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT DISTINCT frames.offset, frames.length, keys.line"
+                " FROM keys JOIN frames ON keys.frame = frames.frame"
+                f" WHERE keys.key = ? AND keys.field IN ({', '.join('?' * len(fields))})"
+                " ORDER BY keys.frame, keys.line",
+                (key, *fields)
+            ).fetchall()
+            records = []
+            lines = None
+            frame_offset = None
+            for offset, length, line in rows:
+                if offset != frame_offset:
+                    lines = self.get_frame(offset, length)
+                    frame_offset = offset
+                records.append(json.loads(lines[line]))
+        return records
+
+    def get_record(self, key, fields=None):
+        records = self.get_records(key, fields)
+        return records[0] if records else None
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(SUM(number_of_records), 0) FROM frames").fetchone()[0]
+
+    def close(self):
+        self.fh.close()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def iterate_records(data_file):
+    """
+    Yield all the records of a seekable file, frame after frame.
+    """
+    with gzip.open(data_file, "rt", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+
+
+def get_record(data_file, key, fields=None):
+    with SeekableReader(data_file) as reader:
+        return reader.get_record(key, fields)
+
+
+def get_seekable_file_name(input_file):
+    base_name = input_file
+    for extension in [".json", ".jsonl"]:
+        if base_name.endswith(extension):
+            base_name = base_name[:-len(extension)]
+    return base_name + seekable_extension
+
+
+def main():
+    # the converter reads the other formats through the jsonl module, which writes seekable files through this one
+    import oscars_pan_finder_jsonl as jsonl
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i","--input-file",
+        help="Seekable file to be read, or json/JSONL file to be converted with --convert",
+        dest="input_file",
+        required=True,
+        type=str
+    )
+    parser.add_argument(
+        "-k","--key",
+        help="DOI, pid or id of the record to be printed",
+        dest="key",
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        "-f","--key-field",
+        help="Field of the key, such as doi, document.pid or datasets.id. Default: the keys of the record and of its parts",
+        dest="key_field",
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        "-c","--convert",
+        help="Convert the input file to the seekable format, in <input file without extension>.jsonl.gz",
+        dest="convert",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-r","--frame-records",
+        help="Number of records in each frame when converting",
+        dest="frame_records",
+        default=default_frame_records,
+        type=int
+    )
+    args = parser.parse_args()
+    input_file = os.path.abspath(args.input_file)
+
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_seekable - BEGIN")
+    print(datetime.datetime.now().isoformat())
+    print(f" - Input File  : {input_file}")
+    data_file = input_file
+    if args.convert:
+        data_file = get_seekable_file_name(input_file)
+        print(f" - Output File : {data_file}")
+        with SeekableWriter(data_file, frame_records=args.frame_records) as writer:
+            writer.write_all(jsonl.iterate_records(input_file))
+        print(f" - Records     : {writer.number_of_records}")
+        print(f" - Frames      : {writer.number_of_frames}")
+        print(f" - Input Size  : {os.path.getsize(input_file)}")
+        print(f" - Output Size : {os.path.getsize(data_file)}")
+        print(f" - Index Size  : {os.path.getsize(writer.index_file)}")
+    if args.key:
+        record = get_record(data_file, args.key, [args.key_field] if args.key_field else None)
+        if record is None:
+            print(f"No record found with key {args.key}")
+        else:
+            print(json.dumps(record, indent=2))
+    print(datetime.datetime.now().isoformat())
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_seekable - END")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,7 @@
 #
 # This script contains all the settings needed to interact with ESRF portal
 #
-# Version: 1.1
+# Version: 1.2
 #
 #
 # -------------------------------------------------
@@ -27,10 +27,16 @@
 # You should have received a copy of the GNU General Public License along with PaN-Finder.
 # If not, see <https://www.gnu.org/licenses/>.
 #
+import datetime
 import json
 import os
+import re
+import threading
 
-import requests
+import oscars_pan_finder_http_cache as http_cache
+import oscars_pan_finder_http_client as http_client
+import oscars_pan_finder_projection as projection
+import oscars_pan_finder_rate_limiter as rate_limiter
 
 # PaNOSC API url
 panosc_data_provider_url = "https://icatplus.esrf.fr/api"
@@ -41,6 +47,17 @@ panosc_documents_count_url = "https://icatplus.esrf.fr/api/Documents/count"
 initial_skip = 0
 batch_limit = 100
 
+# Number of pages of a listing requested at the same time
+pagination_workers = 4
+
+# Number of enrichment calls sent at the same time by the publication collector
+enrichment_workers = 16
+
+# Number of datafile requests sent at the same time in the whole process
+# and page sizes tried, largest first, when listing the datafiles of a dataset
+datafile_workers = 16
+datafile_page_sizes = [1000, 500, 200, 100]
+
 # ESRF Data Portal frontend
 data_portal_frontend_url = "https://data.esrf.fr"
 
@@ -65,12 +82,110 @@ datacite_base_url = "https://api.datacite.org/dois/<DOI>"
 
 sftp_reports_base = "http://ftp.esrf.fr/pub/UserReports/<REPORT>"
 
+# Shared HTTP client: number of keep-alive connections per host and default timeout (connect, read) in seconds
+http_pool_sizes = {
+  "icatplus.esrf.fr": 32,
+  "api.datacite.org": 16,
+  "data.esrf.fr": 2,
+  "ftp.esrf.fr": 2,
+}
+http_timeout = (10, 300)
+
+# Rate limits per host, in requests per second. The rate starts at rate and is tuned between min_rate and max_rate
+# according to the throttling responses of the host. The DataCite REST API allows 3000 requests in 5 minutes.
+http_rate_limits = {
+  "icatplus.esrf.fr": {"rate": 20, "max_rate": 100, "burst": 32},
+  "api.datacite.org": {"rate": 8, "max_rate": 10, "burst": 16},
+  "data.esrf.fr": {"rate": 2, "max_rate": 5, "burst": 2},
+  "ftp.esrf.fr": {"rate": 2, "max_rate": 5, "burst": 2},
+}
+# Number of retries of a throttled request or of a transient error
+http_max_retries = 5
+
+# Persistent HTTP response cache shared by all the ESRF collectors, disabled when http_cache_file is None.
+# Time to live in seconds of the cached responses, per endpoint. The first matching url pattern applies,
+# urls not matching any pattern are not cached and 0 means that the response is revalidated every time.
+http_cache_file = "../data/esrf/esrf_http_cache.sqlite"
+http_cache_ttls = [
+  (r"api\.datacite\.org/dois/", 30 * 24 * 3600),
+  (r"/doi/.+/json-datacite$", 7 * 24 * 3600),
+  (r"/doi/.+/(datasets|reports)$", 24 * 3600),
+  (r"/catalogue/.+/(dataset|datafile|samples|investigation|investigationusers)$", 24 * 3600),
+  (r"/catalogue/.+/datacollection$", 10 * 60),
+  (r"/api/Documents/count$", 0),
+  (r"/api/Documents$", 10 * 60),
+]
+
+# Names of the endpoints in the HTTP transfer statistics, matched on the url path. The first matching rule applies.
+# The ICAT+ catalogue has no field selection, the fields not needed are removed by the projections of
+# record_projections once the records are received.
+http_endpoint_names = [
+  (r"/api/Documents/count$", "api/Documents/count"),
+  (r"/api/Documents$", "api/Documents"),
+  (r"/doi/.+/datasets$", "doi/<DOI>/datasets"),
+  (r"/doi/.+/json-datacite$", "doi/<DOI>/json-datacite"),
+  (r"/doi/.+/reports$", "doi/<DOI>/reports"),
+  (r"/catalogue/[^/]+/dataset$", "catalogue/dataset"),
+  (r"/catalogue/[^/]+/datafile$", "catalogue/datafile"),
+  (r"/catalogue/[^/]+/samples$", "catalogue/samples"),
+  (r"/catalogue/[^/]+/investigation$", "catalogue/investigation"),
+  (r"/catalogue/[^/]+/investigationusers$", "catalogue/investigationusers"),
+  (r"/catalogue/[^/]+/datacollection$", "catalogue/datacollection"),
+  (r"^/dois/", "dois/<DOI>"),
+  (r"/UserReports/", "UserReports/<REPORT>"),
+]
+
+client = None
+client_lock = threading.Lock()
+
 session_payload = {
   "plugin": "<PLUGIN>",
   "username": "<USERNAME>",
   "password": "<PASSWORD>"
 }
 
+# Session manager: the ICAT+ session is shared by all the workers of a run.
+# It is renewed session_refresh_margin_minutes before it expires, or when a catalogue request is refused.
+# The lifetime reported by the server is used when available, session_lifetime_minutes otherwise.
+# When session_cache_file is set, the session is also shared with other processes through that file.
+session_lifetime_minutes = 120
+session_refresh_margin_minutes = 10
+session_cache_file = None
+session_state = {
+  "session_id": None,
+  "expires_at": None,
+  "user_info": None,
+  "logins": 0,
+}
+session_lock = threading.RLock()
+session_token_pattern = re.compile(r"(/catalogue/)([^/?]+)")
+
+
+def get_http_client():
+  """
+  Return the HTTP client shared by all the ESRF collectors running in this process.
+  """
+  global client
+  if client is None:
+    with client_lock:
+      if client is None:
+        client = http_client.HttpClient(
+          host_pool_sizes=http_pool_sizes,
+          timeout=http_timeout,
+          url_rewriter=update_session_url,
+          auth_refresher=refresh_session_url,
+          cache=http_cache.ResponseCache(http_cache_file, http_cache_ttls) if http_cache_file else None,
+          rate_limiter=rate_limiter.RateLimiter(http_rate_limits, max_retries=http_max_retries),
+          endpoint_names=http_endpoint_names,
+        )
+  return client
+
+
+def print_http_stats():
+  print(f"Session logins : {session_state['logins']}")
+  if client is not None:
+    client.print_stats()
+
 
 def get_config(data_portal_config_esrf_file: None):
   print("get_config - BEGIN")
@@ -85,7 +200,7 @@ def get_config(data_portal_config_esrf_file: None):
   if not os.path.exists(data_portal_config_esrf_file):
     print("Get config from portal")
     print(f"Config url  : {data_portal_config_url}")
-    res = requests.get(data_portal_config_url)
+    res = get_http_client().get(data_portal_config_url)
     print(" -- configuration request result : ", res.status_code)
     config = res.json()
     print(" -- saving configuration to file")
@@ -100,15 +215,18 @@ def get_config(data_portal_config_esrf_file: None):
   return config
 
 
-def get_session(user_info: dict):
-  print("get_session - BEGIN")
-  payload = session_payload
+def login(user_info: dict):
+  """
+  Post the credentials to the ICAT+ session endpoint and return the session id and its expiry time.
+  """
+  print("login - BEGIN")
+  payload = dict(session_payload)
   payload["username"] = user_info["username"]
   payload["password"] = user_info["password"]
   payload["plugin"] = user_info["plugin"]
 
   print("requesting session")
-  res = requests.post(
+  res = get_http_client().post(
     session_url,
     json=payload,
   )
@@ -117,9 +235,163 @@ def get_session(user_info: dict):
   session_info = res.json()
 
   print(" -- session info : ", session_info)
+  session_state["logins"] += 1
+
+  lifetime_minutes = session_info.get("lifeTimeMinutes") or session_lifetime_minutes
+  expires_at = datetime.datetime.now() + datetime.timedelta(minutes=lifetime_minutes)
+
+  print("login - END")
+  return session_info["sessionId"], expires_at
+
+
+def is_session_valid(session_id, expires_at):
+  margin = datetime.timedelta(minutes=session_refresh_margin_minutes)
+  return bool(session_id) and expires_at is not None and expires_at - margin > datetime.datetime.now()
+
+
+def load_cached_session(user_info):
+  """
+  Return the session id and its expiry time saved in session_cache_file for this user, if any.
+  """
+  if not session_cache_file or not os.path.exists(session_cache_file):
+    return None, None
+  try:
+    with open(session_cache_file) as f:
+      cached = json.load(f)
+    if cached["username"] != user_info["username"] or cached["plugin"] != user_info["plugin"]:
+      return None, None
+    return cached["session_id"], datetime.datetime.fromisoformat(cached["expires_at"])
+  except (OSError, ValueError, KeyError):
+    return None, None
 
+
+def save_cached_session(user_info, session_id, expires_at):
+  if not session_cache_file:
+    return
+  temp_file = f"{session_cache_file}.{os.getpid()}.tmp"
+  with open(temp_file, "w") as f:
+    json.dump({
+      "username": user_info["username"],
+      "plugin": user_info["plugin"],
+      "session_id": session_id,
+      "expires_at": expires_at.isoformat(),
+    }, f)
+  os.replace(temp_file, session_cache_file)
+
+
+def renew_session(stale_session_id=None):
+  """
+  Return a valid session id, logging in again only if needed.
+
+  If stale_session_id is given, that session has been refused by the server and is not reused.
+  """
+  with session_lock:
+    user_info = session_state["user_info"]
+    session_id = session_state["session_id"]
+    expires_at = session_state["expires_at"]
+    if session_id != stale_session_id and is_session_valid(session_id, expires_at):
+      return session_id
+
+    session_id, expires_at = load_cached_session(user_info)
+    if session_id == stale_session_id or not is_session_valid(session_id, expires_at):
+      session_id, expires_at = login(user_info)
+      save_cached_session(user_info, session_id, expires_at)
+
+    session_state["session_id"] = session_id
+    session_state["expires_at"] = expires_at
+    return session_id
+
+
+def get_session(user_info: dict):
+  """
+  Return the ICAT+ session id for this user.
+
+  The session is cached and shared by all the callers of this process, and by other processes
+  when session_cache_file is set. Credentials are posted only when there is no valid session.
+  """
   print("get_session - BEGIN")
-  return session_info["sessionId"]
+  with session_lock:
+    if session_state["user_info"] != user_info:
+      session_state["user_info"] = dict(user_info)
+      session_state["session_id"] = None
+      session_state["expires_at"] = None
+    session_id = renew_session()
+  print("get_session - END")
+  return session_id
+
+
+def export_session():
+  """
+  Return the session state, to be shared with worker processes by import_session.
+  """
+  with session_lock:
+    return dict(session_state)
+
+
+def import_session(state, cache_file=None, response_cache_file=None):
+  """
+  Initialise a worker process with the session state of its parent.
+
+  The HTTP client inherited from the parent is dropped, its connections and cache file handle can not be shared.
+  """
+  global session_cache_file, http_cache_file, client
+  with session_lock:
+    session_state.update(state)
+    session_state["logins"] = 0
+    if cache_file:
+      session_cache_file = cache_file
+  http_cache_file = response_cache_file
+  client = None
+
+
+def update_session_url(url):
+  """
+  Replace the session token of a catalogue url with the current one, renewing the session before it expires.
+  """
+  match = session_token_pattern.search(url)
+  if not match or session_state["user_info"] is None:
+    return url
+  session_id = renew_session()
+  if session_id == match.group(2):
+    return url
+  return url[:match.start(2)] + session_id + url[match.end(2):]
+
+
+def refresh_session_url(url):
+  """
+  Renew the session refused for a catalogue url and return the url with the new token.
+
+  It returns None for urls that do not contain a session token.
+  """
+  match = session_token_pattern.search(url)
+  if not match or session_state["user_info"] is None:
+    return None
+  print(" -- session refused, renewing session")
+  session_id = renew_session(stale_session_id=match.group(2))
+  return url[:match.start(2)] + session_id + url[match.end(2):]
+
+
+# Fields kept ("keep") or removed ("drop") from each type of record retrieved from the ESRF portal.
+# "nested" projects the records of a field with the projection of another type, see oscars_pan_finder_projection.py
+record_projections = {
+  "dataset": {"drop": ["investigation", "meta"], "nested": {"parameters": "dataset_parameter"}},
+  "dataset_parameter": {"drop": ["id", "datasetId"]},
+  "sample": {"drop": ["investigation", "meta", "datasets"], "nested": {"parameters": "sample_parameter"}},
+  "sample_parameter": {"drop": ["id"]},
+  "datafile": {"drop": ["dataset", "dataCollectionDatafiles", "destDatafiles", "sourceDatafiles"]},
+  "datafile_summary": {"keep": ["id", "createTime", "modTime", "fileSize", "location", "name", "isReleased"]},
+  "investigation": {"drop": ["meta", "type"]},
+  "publication_investigation": {"drop": ["investigationInstruments"]},
+  "instrument": {"drop": ["shifts", "datasetInstruments", "instrumentScientists", "investigationInstruments"]},
+  "doi_dataset": {"drop": ["meta", "type"]},
+  "publication_dataset": {"drop": ["investigation"]},
+  "data_collection": {"keep": ["createTime", "modTime", "dataCollectionDatasets", "doi", "parameters"]},
+  "user": {"keep": ["fullName", "email", "familyName", "givenName", "affiliation"]},
+  "datacite": {"drop": ["relationships"]},
+}
+# compiled once, projectors[<record type>](record) returns the projected copy of the record
+projectors = projection.compile_projections(record_projections)
+
 
 def remove_fields(initem, fields):
   outitem = dict(initem)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Settings shared by the data collectors of the SciCat based PaN data providers:
+# - DESY (Deutsches Elektronen-Synchrotron, https://www.desy.de/)
+# - ESS (European Spallation Source, https://ess.eu)
+# - Max IV (https://www.maxiv.se.lu/)
+# - PSI (Paul Scherrer Institute, https://www.psi.ch)
+#
+# Version: 1.1
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import os
+
+import oscars_pan_finder_http_cache as http_cache
+import oscars_pan_finder_http_client as http_client
+import oscars_pan_finder_manifest as manifest
+import oscars_pan_finder_rate_limiter as rate_limiter
+
+# Profile of each facility collected by oscars_pan_finder_scicat_collector.py
+# - name: name of the facility in the log messages
+# - panosc_url: url of the PaNOSC search api, None if it is not used
+# - catalog_url: url of the SciCat api
+# - panosc_join_field: field of the published data matching the pid of the PaNOSC documents
+# - strict_count: stop the collection if the number of published data collected does not match the count
+# - output_file_prefix: the snapshot is saved in <output_file_prefix><timestamp>.json
+facilities = {
+  "ess": {
+    "name": "ESS",
+    # ESS PaNOSC API is momentarily off-line: "https://search.panosc.ess.eu/"
+    "panosc_url": None,
+    "catalog_url": "https://scicat.ess.eu/api/v3",
+    "panosc_join_field": "id",
+    "strict_count": True,
+    "output_file_prefix": "../data/oscars_pan_finder_ess_data_",
+  },
+  "maxiv": {
+    "name": "MaxIV",
+    "panosc_url": "https://searchapi.maxiv.lu.se/api",
+    "catalog_url": "https://scicat.maxiv.lu.se/api/v3",
+    "panosc_join_field": "doi",
+    "strict_count": False,
+    "output_file_prefix": "../data/oscars_pan_finder_maxiv_data_",
+  },
+  "psi": {
+    "name": "PSI",
+    "panosc_url": "https://dacat.psi.ch/panosc-api",
+    "catalog_url": "https://dacat.psi.ch/api/v3",
+    "panosc_join_field": "doi",
+    "strict_count": True,
+    "output_file_prefix": "../data/oscars_pan_finder_psi_data_",
+  },
+  "desy": {
+    "name": "DESY",
+    "panosc_url": None,
+    "catalog_url": "https://public-data.desy.de/api/v3",
+    "panosc_join_field": "id",
+    "strict_count": True,
+    "output_file_prefix": "../data/oscars_pan_finder_desy_data_",
+  },
+  "desy_fs": {
+    "name": "DESY fs",
+    "panosc_url": "https://panosc-search.desy.de/api",
+    "catalog_url": "https://fsdata.desy.de/api/v3",
+    "panosc_join_field": "doi",
+    "strict_count": True,
+    "output_file_prefix": "../data/oscars_pan_finder_desy_fs_data_",
+  },
+}
+
+# batch collection settings
+initial_skip = 0
+batch_limit = 1000
+
+# number of datasets requested together with a filter on their pid
+dataset_batch_size = 100
+# number of dataset requests sent at the same time
+dataset_workers = 4
+# number of documents whose datasets are retrieved before their entries are written to the snapshot
+document_chunk_size = 1000
+
+# fields that are not necessary and needs to be deleted from the entries saved in the output file
+fields_to_be_deleted_from_document = ["thumbnail", "history"]
+
+# Server-side field selection: the published data are requested with a fields filter excluding the fields
+# deleted from the entries, so that they are not downloaded at all. The fields are still deleted from the
+# documents returned by a catalogue ignoring the filter. Disabled by the collector with -a/--all-fields.
+document_fields_filter = {field: False for field in fields_to_be_deleted_from_document}
+
+# Shared HTTP client: default timeout (connect, read) in seconds
+http_timeout = (10, 300)
+
+# Rate limits of the SciCat and PaNOSC search api of each facility, in requests per second
+# The rate starts at rate and is tuned between min_rate and max_rate according to the throttling responses.
+# max_concurrency bounds the number of requests sent at the same time to the host.
+http_rate_limits = {
+  "scicat.ess.eu": {"rate": 10, "max_rate": 50, "max_concurrency": 4},
+  "search.panosc.ess.eu": {"rate": 10, "max_rate": 50, "max_concurrency": 4},
+  "scicat.maxiv.lu.se": {"rate": 10, "max_rate": 50, "max_concurrency": 4},
+  "searchapi.maxiv.lu.se": {"rate": 10, "max_rate": 50, "max_concurrency": 4},
+  "dacat.psi.ch": {"rate": 10, "max_rate": 50, "max_concurrency": 4},
+  "public-data.desy.de": {"rate": 10, "max_rate": 50, "max_concurrency": 4},
+  "fsdata.desy.de": {"rate": 10, "max_rate": 50, "max_concurrency": 4},
+  "panosc-search.desy.de": {"rate": 10, "max_rate": 50, "max_concurrency": 4},
+}
+# Number of retries of a throttled request or of a transient error
+http_max_retries = 5
+
+# Persistent HTTP response cache, one file per facility: ../data/<facility>/<facility>_http_cache.sqlite
+# Time to live in seconds of the cached responses, per endpoint. The first matching url pattern applies.
+# The listings and their counts are revalidated every time, so that the number of entries listed
+# always matches the count returned by the catalogue.
+http_cache_folder = "../data"
+http_cache_ttls = [
+  (r"/publisheddata/count$", 0),
+  (r"/publisheddata$", 0),
+  (r"/datasets/[^/]+$", 7 * 24 * 3600),
+  (r"/documents/count$", 0),
+  (r"/documents$", 0),
+]
+
+# Names of the endpoints in the HTTP transfer statistics, matched on the url path. The first matching rule applies.
+# The statistics of the last run with and without server-side field selection are saved, one file per facility:
+# ../data/<facility>/<facility>_http_transfers.json
+http_endpoint_names = [
+  (r"/publisheddata/count$", "publisheddata/count"),
+  (r"/publisheddata$", "publisheddata"),
+  (r"/datasets/[^/]+$", "datasets/<pid>"),
+  (r"/datasets$", "datasets"),
+  (r"/documents/count$", "documents/count"),
+  (r"/documents$", "documents"),
+]
+
+
+# Delta synchronisation: high-water mark and snapshot file of the last run, one file per facility:
+# ../data/<facility>/<facility>_watermarks.json
+watermark_folder = "../data"
+
+# Manifest with the content hash of each entry of the last snapshot, one file per facility:
+# ../data/<facility>/<facility>_manifest.sqlite
+# and list of the entries added, changed or removed by each run:
+# ../data/<facility>/<facility>_changed_entries_<timestamp>.json
+manifest_folder = "../data"
+
+
+def get_http_cache_file(facility):
+  return os.path.abspath(os.path.join(http_cache_folder, facility, f"{facility}_http_cache.sqlite"))
+
+
+def get_http_transfers_file(facility):
+  return os.path.abspath(os.path.join(http_cache_folder, facility, f"{facility}_http_transfers.json"))
+
+
+def get_watermark_file(facility):
+  return os.path.abspath(os.path.join(watermark_folder, facility, f"{facility}_watermarks.json"))
+
+
+def get_manifest(facility):
+  """
+  Return the manifest of the snapshot entries of the facility, keyed by the DOI of their document.
+  """
+  return manifest.get_manifest(os.path.join(manifest_folder, facility), f"{facility}_manifest.sqlite", file_prefixes=[])
+
+
+def get_changed_entries_file(facility, timestamp):
+  return os.path.abspath(os.path.join(
+    manifest_folder,
+    facility,
+    f"{facility}_changed_entries_{timestamp.strftime('%Y%m%d%H%M%S%f')}.json"
+  ))
+
+
+def get_http_client(facility):
+  """
+  Return an HTTP client for the SciCat collector of the facility, with its persistent response cache.
+  """
+  return http_client.HttpClient(
+    timeout=http_timeout,
+    cache=http_cache.ResponseCache(get_http_cache_file(facility), http_cache_ttls),
+    rate_limiter=rate_limiter.RateLimiter(http_rate_limits, max_retries=http_max_retries),
+    endpoint_names=http_endpoint_names,
+  )
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Differences between snapshots of the same facility and history of the snapshots saved as base and deltas.
+#
+# The records of two snapshots are matched by their key, the DOI, pid or id of the record, or of its document or
+# collection, and compared by content hash. The records without key are matched by their content hash.
+# The diff lists the keys of the records added, changed and removed.
+#
+# The history folder keeps one full snapshot, the base, in the seekable format of oscars_pan_finder_seekable.py,
+# and for each following snapshot a delta against the base: the keys of the snapshot in order and the records
+# added or changed. A snapshot is reconstructed reading only its base and its delta. When the delta of a new
+# snapshot would hold more than max_delta_ratio of the records of the base, the snapshot is saved as a new base.
+# The snapshots of the history are listed in history.json in the history folder.
+#
+# Usage: oscars_pan_finder_snapshot_diff
+#   -o, --old-file = Old snapshot, compared to the new snapshot
+#   -n, --new-file = New snapshot, compared to the old snapshot
+#   -c, --changes-file = File where the keys of the records added, changed and removed are saved
+#   -s, --store = Snapshot to be saved in the history folder
+#   -r, --reconstruct = Name of the snapshot of the history to be reconstructed, in the output file
+#   -O, --output-file = Reconstructed snapshot, in the format given by its extension
+#   -H, --history-folder = Folder with the history of the snapshots. Default="../data/history/"
+#
+# Version: 1.1
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import argparse
+import datetime
+import gzip
+import json
+import os
+
+import oscars_pan_finder_jsonl as jsonl
+import oscars_pan_finder_manifest as manifest
+import oscars_pan_finder_seekable as seekable
+
+default_history_folder = "../data/history/"
+history_file_name = "history.json"
+base_suffix = ".base" + seekable.seekable_extension
+delta_suffix = ".delta.gz"
+
+# fields identifying a record, in the record parts first
+key_fields = ["doi", "pid", "id"]
+key_parts = ["document", "collection"]
+
+# a snapshot is saved as a new base when its delta holds more than this fraction of the records of the base
+max_delta_ratio = 0.5
+
+
+def get_record_key(record):
+    """
+    Return the DOI, pid or id of the record, taken from its document or collection if any.
+    """
+    for part in [record.get(part) for part in key_parts] + [record]:
+        if not isinstance(part, dict):
+            continue
+        for field in key_fields:
+            if part.get(field) is not None:
+                return str(part[field])
+    return None
+
+
+def iterate_keyed_records(input_file):
+    """
+    Yield the key and the record of each record of a snapshot, in order.
+
+    The records without key are keyed by their content hash, so that inserting or removing a record does not
+    change the key of the others, and a repeated key gets the number of its occurrence, so that every record
+    of the snapshot has a distinct key.
+    """
+    seen_keys = set()
+    for record in jsonl.iterate_records(input_file):
+        key = get_record_key(record)
+        if key is None:
+            key = f"#{manifest.get_entry_hash(record)}"
+        if key in seen_keys:
+            occurrence = 2
+            while f"{key}#{occurrence}" in seen_keys:
+                occurrence += 1
+            key = f"{key}#{occurrence}"
+        seen_keys.add(key)
+        yield key, record
+
+
+def get_snapshot_hashes(input_file):
+    return {key: manifest.get_entry_hash(record) for key, record in iterate_keyed_records(input_file)}
+
+
+def diff_snapshots(old_file, new_file, on_record=None):
+    """
+    Return the keys of the records of new_file added, changed and removed since old_file, and its keys in order.
+
+    Only the content hashes of old_file are kept in memory. The records of new_file added or changed are passed
+    to on_record(key, record), if given, as they are read.
+    """
+    old_hashes = get_snapshot_hashes(old_file)
+    diff = {"added": [], "changed": [], "removed": [], "keys": []}
+    for key, record in iterate_keyed_records(new_file):
+        diff["keys"].append(key)
+        old_hash = old_hashes.pop(key, None)
+        if old_hash is None:
+            change = "added"
+        elif old_hash != manifest.get_entry_hash(record):
+            change = "changed"
+        else:
+            continue
+        diff[change].append(key)
+        if on_record:
+            on_record(key, record)
+    diff["removed"] = list(old_hashes)
+    return diff
+
+
+def print_diff(diff):
+    print("Snapshot diff")
+    print(f" - Records                  : {len(diff['keys'])}")
+    print(f" - Records added            : {len(diff['added'])}")
+    print(f" - Records changed          : {len(diff['changed'])}")
+    print(f" - Records removed          : {len(diff['removed'])}")
+
+
+def get_snapshot_name(snapshot_file):
+    file_name = os.path.basename(snapshot_file)
+    for extension in [".zip", ".gz", ".jsonl", ".json"]:
+        if file_name.endswith(extension):
+            file_name = file_name[:-len(extension)]
+    return file_name
+
+
+def load_history(history_folder):
+    history_file = os.path.join(history_folder, history_file_name)
+    if not os.path.exists(history_file):
+        return {"snapshots": []}
+    with open(history_file) as fh:
+        return json.load(fh)
+
+
+def save_history(history_folder, history):
+    history_file = os.path.join(history_folder, history_file_name)
+    temp_file = f"{history_file}.{os.getpid()}.tmp"
+    with open(temp_file, "w") as fh:
+        json.dump(history, fh, indent=2)
+    os.replace(temp_file, history_file)
+
+
+def save_base(snapshot_file, history_folder, name):
+    base_file = os.path.join(history_folder, name + base_suffix)
+    number_of_records = jsonl.save_records(base_file, jsonl.iterate_records(snapshot_file))
+    return base_file, number_of_records
+
+
+def save_delta(snapshot_file, base_file, history_folder, name):
+    """
+    Save the delta of snapshot_file against base_file and return the delta file and the diff.
+    """
+    delta_file = os.path.join(history_folder, name + delta_suffix)
+    temp_file = f"{delta_file}.{os.getpid()}.tmp"
+    with gzip.open(temp_file, "wt", encoding="utf-8") as fh:
+        diff = diff_snapshots(
+            base_file,
+            snapshot_file,
+            lambda key, record: fh.write(json.dumps({"key": key, "record": record}) + "\n")
+        )
+        # the keys in order and the removed ones close the delta, they are only known once the snapshot is read
+        fh.write(json.dumps({"keys": diff["keys"], "removed": diff["removed"]}) + "\n")
+    os.replace(temp_file, delta_file)
+    return delta_file, diff
+
+
+def store_snapshot(snapshot_file, history_folder=default_history_folder):
+    """
+    Save snapshot_file in the history folder, as a delta against the current base or as a new base.
+    """
+    os.makedirs(history_folder, exist_ok=True)
+    history = load_history(history_folder)
+    name = get_snapshot_name(snapshot_file)
+    if any(snapshot["name"] == name for snapshot in history["snapshots"]):
+        print(f"Snapshot {name} already saved in the history")
+        return None
+    bases = [snapshot for snapshot in history["snapshots"] if snapshot["type"] == "base"]
+    snapshot = {
+        "name": name,
+        "source_file": os.path.abspath(snapshot_file),
+        "saved_at": datetime.datetime.now().isoformat(),
+    }
+
+    if bases:
+        base = bases[-1]
+        base_file = os.path.join(history_folder, base["file"])
+        delta_file, diff = save_delta(snapshot_file, base_file, history_folder, name)
+        print_diff(diff)
+        if len(diff["added"]) + len(diff["changed"]) <= max_delta_ratio * base["number_of_records"]:
+            snapshot.update({
+                "type": "delta",
+                "file": os.path.basename(delta_file),
+                "base": base["name"],
+                "number_of_records": len(diff["keys"]),
+                "added": len(diff["added"]),
+                "changed": len(diff["changed"]),
+                "removed": len(diff["removed"]),
+            })
+        else:
+            print(" - Delta too large, saving the snapshot as a new base")
+            os.remove(delta_file)
+            bases = []
+    if not bases:
+        base_file, number_of_records = save_base(snapshot_file, history_folder, name)
+        snapshot.update({"type": "base", "file": os.path.basename(base_file), "number_of_records": number_of_records})
+
+    print(f"Snapshot {name} saved as {snapshot['type']} in {snapshot['file']}")
+    history["snapshots"].append(snapshot)
+    save_history(history_folder, history)
+    return snapshot
+
+
+def iterate_snapshot(name, history_folder=default_history_folder):
+    """
+    Yield the records of a snapshot of the history, in their original order.
+    """
+    history = load_history(history_folder)
+    snapshots = {snapshot["name"]: snapshot for snapshot in history["snapshots"]}
+    if name not in snapshots:
+        raise ValueError(f"Snapshot {name} not found in the history folder {history_folder}")
+    snapshot = snapshots[name]
+    if snapshot["type"] == "base":
+        yield from jsonl.iterate_records(os.path.join(history_folder, snapshot["file"]))
+        return
+
+    records = {}
+    with gzip.open(os.path.join(history_folder, snapshot["file"]), "rt", encoding="utf-8") as fh:
+        for line in fh:
+            item = json.loads(line)
+            if "keys" in item:
+                keys = item["keys"]
+            else:
+                records[item["key"]] = item["record"]
+    # only the records of the base still present and unchanged are needed
+    base_file = os.path.join(history_folder, snapshots[snapshot["base"]]["file"])
+    needed_keys = set(keys) - set(records)
+    for key, record in iterate_keyed_records(base_file):
+        if key in needed_keys:
+            records[key] = record
+    for key in keys:
+        yield records[key]
+
+
+def reconstruct_snapshot(name, output_file, history_folder=default_history_folder):
+    return jsonl.save_records(output_file, iterate_snapshot(name, history_folder))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-o","--old-file",
+        help="Old snapshot, compared to the new snapshot",
+        dest="old_file",
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        "-n","--new-file",
+        help="New snapshot, compared to the old snapshot",
+        dest="new_file",
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        "-c","--changes-file",
+        help="File where the keys of the records added, changed and removed are saved",
+        dest="changes_file",
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        "-s","--store",
+        help="Snapshot to be saved in the history folder",
+        dest="store",
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        "-r","--reconstruct",
+        help="Name of the snapshot of the history to be reconstructed, in the output file",
+        dest="reconstruct",
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        "-O","--output-file",
+        help="Reconstructed snapshot, in the format given by its extension",
+        dest="output_file",
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        "-H","--history-folder",
+        help="Folder with the history of the snapshots",
+        dest="history_folder",
+        default=default_history_folder,
+        type=str
+    )
+    args = parser.parse_args()
+    history_folder = os.path.abspath(args.history_folder)
+
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_snapshot_diff - BEGIN")
+    print(datetime.datetime.now().isoformat())
+
+    if args.old_file and args.new_file:
+        print(f" - Old File       : {os.path.abspath(args.old_file)}")
+        print(f" - New File       : {os.path.abspath(args.new_file)}")
+        diff = diff_snapshots(args.old_file, args.new_file)
+        print_diff(diff)
+        if args.changes_file:
+            with open(args.changes_file, "w") as fh:
+                json.dump({change: diff[change] for change in ["added", "changed", "removed"]}, fh, indent=2)
+            print(f"Changes saved in file : {os.path.abspath(args.changes_file)}")
+    if args.store:
+        print(f" - Snapshot       : {os.path.abspath(args.store)}")
+        print(f" - History Folder : {history_folder}")
+        store_snapshot(args.store, history_folder)
+    if args.reconstruct:
+        if not args.output_file:
+            parser.error("--reconstruct requires --output-file")
+        print(f" - Snapshot       : {args.reconstruct}")
+        print(f" - History Folder : {history_folder}")
+        print(f" - Output File    : {os.path.abspath(args.output_file)}")
+        number_of_records = reconstruct_snapshot(args.reconstruct, args.output_file, history_folder)
+        print(f" - Records        : {number_of_records}")
+
+    print(datetime.datetime.now().isoformat())
+    print("OSCARS PaN-Finder project - Task 1 - oscars_pan_finder_snapshot_diff - END")
+
+
+if __name__ == "__main__":
+    main()
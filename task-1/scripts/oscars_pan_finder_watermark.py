@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#
+# OSCARS project - https://oscars-project.eu/
+# PaN-Finder     - https://oscars-project.eu/projects/pan-finder-photon-and-neutron-federated-knowledge-finder
+#
+# Task 1 v2 - Body of Knowledge
+#
+# Incremental listing of a source of entries sorted by date, most recent first.
+#
+# The high-water mark of each source, the most recent creation or modification time seen, is saved in
+# a json file at the end of each listing. The next listing requests the pages one after the other and stops
+# at the first page where all the entries have already been seen, with the same modification time, and are
+# not more recent than the high-water mark. Only the new and modified entries are returned.
+# A modification is detected on the pages requested only: entries modified further down the listing, and
+# entries removed from the source, are only detected by a full listing. The time of the last full listing is
+# saved with the high-water mark, so that a full sweep of the source can be run periodically between the
+# incremental listings, comparing the modification time of every entry.
+#
+# Version: 1.1
+#
+#
+# -------------------------------------------------
+# This file is part of deliverables for the PaN-Finder project, founded by the OSCARS project and the European Union .
+# PaN-Finder is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# PaN-Finder is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with PaN-Finder.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import datetime
+import json
+import os
+
+
+def load_watermark(watermark_file, source):
+    """
+    Return the watermark saved for source, or None if the source has never been listed.
+    """
+    if not os.path.exists(watermark_file):
+        return None
+    with open(watermark_file) as f:
+        return json.load(f).get(source)
+
+
+def save_watermark(watermark_file, source, high_water_mark, number_of_entries, details=None):
+    """
+    Save the high-water mark of source, details holds additional values saved with it.
+    """
+    watermarks = {}
+    if os.path.exists(watermark_file):
+        with open(watermark_file) as f:
+            watermarks = json.load(f)
+    watermarks[source] = {
+        "high_water_mark": high_water_mark,
+        "number_of_entries": number_of_entries,
+        "updated_at": datetime.datetime.now().isoformat(),
+        **(details or {}),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(watermark_file)), exist_ok=True)
+    temp_file = f"{watermark_file}.{os.getpid()}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(temp_file, watermark_file)
+
+
+def get_entry_time(entry, time_fields):
+    """
+    Return the most recent of the time fields of an entry, the times are ISO 8601 strings.
+    """
+    times = [entry[field] for field in time_fields if entry.get(field)]
+    return max(times) if times else None
+
+
+def get_high_water_mark(entries, time_fields, high_water_mark=None):
+    times = [get_entry_time(entry, time_fields) for entry in entries]
+    times = [t for t in times + [high_water_mark] if t]
+    return max(times) if times else None
+
+
+def collect_new_entries(fetch_window, batch_limit, known_times, high_water_mark, key, time_fields, initial_skip=0):
+    """
+    Request the pages of a source, most recent first, until a page only holds already seen entries.
+
+    fetch_window(skip, limit) returns the list of entries of one page, known_times maps the key of the entries
+    already seen to their modification time and key(entry) returns the key of an entry.
+    It returns the new and modified entries, in the order of the source, and the number of pages requested.
+    """
+    new_entries = []
+    number_of_pages = 0
+    skip = initial_skip
+    keep_going = True
+    while keep_going:
+        current_batch = fetch_window(skip, batch_limit)
+        number_of_pages += 1
+        print(".", end="", flush=True)
+        page_has_changes = False
+        for entry in current_batch:
+            entry_time = get_entry_time(entry, time_fields)
+            entry_key = key(entry)
+            is_known = entry_key in known_times and known_times[entry_key] == entry_time
+            if not is_known or (entry_time and high_water_mark and entry_time > high_water_mark):
+                new_entries.append(entry)
+                page_has_changes = True
+        keep_going = page_has_changes and len(current_batch) == batch_limit
+        skip += len(current_batch)
+    print("")
+    return new_entries, number_of_pages
+
+
+def is_full_sweep_due(watermark, interval_days):
+    """
+    Return True if the source has not been fully listed for interval_days, or has never been.
+    """
+    last_full_sweep = (watermark or {}).get("last_full_sweep")
+    if not last_full_sweep:
+        return True
+    elapsed = datetime.datetime.now() - datetime.datetime.fromisoformat(last_full_sweep)
+    return elapsed >= datetime.timedelta(days=interval_days)
+
+
+def select_changed_entries(entries, known_times, key, time_fields):
+    """
+    Return the entries of a full listing that are new, or whose modification time differs from known_times.
+    """
+    return [
+        entry
+        for entry
+        in entries
+        if key(entry) not in known_times or known_times[key(entry)] != get_entry_time(entry, time_fields)
+    ]
+
+
+def merge_entries(previous_entries, new_entries, key):
+    """
+    Return the new entries followed by the previous entries that have not been replaced by a new one.
+    """
+    new_keys = set(key(entry) for entry in new_entries)
+    return new_entries + [
+        entry
+        for entry
+        in previous_entries
+        if key(entry) not in new_keys
+    ]
@@ -23,5 +23,5 @@
 # If not, see <https://www.gnu.org/licenses/>.
 #
 
-micromamba run -n oscars-pan-finder-task-1 ./oscars_pan_finder_collect_desy_data.py
+micromamba run -n oscars-pan-finder-task-1 ./oscars_pan_finder_collect_desy_data.py "$@"
 
@@ -25,5 +25,5 @@
 #
 
 
-micromamba run -n oscars-pan-finder-task-1 ./oscars_pan_finder_collect_ess_data.py
+micromamba run -n oscars-pan-finder-task-1 ./oscars_pan_finder_collect_ess_data.py "$@"
 
@@ -24,5 +24,5 @@
 # If not, see <https://www.gnu.org/licenses/>.
 #
 
-micromamba run -n oscars-pan-finder-task-1 ./oscars_pan_finder_collect_psi_data.py
+micromamba run -n oscars-pan-finder-task-1 ./oscars_pan_finder_collect_psi_data.py "$@"
 